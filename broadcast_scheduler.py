@@ -0,0 +1,85 @@
+import random
+
+
+class BroadcastScheduler:
+    """Trickle-style broadcast timer, stretched by crowd density and TX errors.
+
+    Each interval picks one jittered slot in its second half. Quiet,
+    consistent intervals double the interval up to `max_interval`; a local
+    change or an inconsistency heard from a neighbour drops it back to the
+    density-scaled floor. A beacon whose slot saw at least `redundancy`
+    consistent frames may be suppressed, but never once `max_silence` has
+    passed since our last transmission, so neighbours do not time us out.
+    """
+
+    def __init__(self, min_interval, max_interval, max_silence,
+                 redundancy=3, density_step=20, error_weight=2.0):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.max_silence = max_silence
+        self.redundancy = redundancy
+        self.density_step = max(1, density_step)
+        self.error_weight = error_weight
+
+        self.peer_count = 0
+        self.error_rate = 0.0
+        self.interval = min_interval
+        self.interval_start = 0.0
+        self.fire_at = 0.0
+        self.fired = False
+        self.consistent_heard = 0
+        self.last_tx = 0.0
+
+        self.slots = 0
+        self.suppressed = 0
+        self.resets = 0
+
+    def floor_interval(self):
+        """Fastest interval allowed for the current crowd size and error rate."""
+        scale = 1.0 + (self.peer_count / self.density_step) + (self.error_weight * self.error_rate)
+        return min(self.max_interval, self.min_interval * scale)
+
+    def _begin_interval(self, now):
+        self.interval_start = now
+        self.fire_at = now + self.interval * (0.5 + 0.5 * random.random())
+        if self.last_tx:
+            # Pull the slot in if a suppressed beacon would overrun max_silence.
+            self.fire_at = min(self.fire_at, max(now, self.last_tx + self.max_silence))
+        self.fired = False
+        self.consistent_heard = 0
+
+    def reset(self, now):
+        """Local change or inconsistency: snap back to the fastest interval."""
+        floor = self.floor_interval()
+        if self.interval_start and self.interval <= floor:
+            return
+        self.resets += 1
+        self.interval = floor
+        self._begin_interval(now)
+
+    def heard_consistent(self):
+        self.consistent_heard += 1
+
+    def poll(self, now):
+        """Return True once per interval, when its jittered slot comes due."""
+        if (not self.interval_start) or now >= self.interval_start + self.interval:
+            self.interval = max(self.floor_interval(), min(self.interval * 2, self.max_interval))
+            self._begin_interval(now)
+        if self.fired or now < self.fire_at:
+            return False
+        self.fired = True
+        self.slots += 1
+        return True
+
+    def should_suppress(self, now):
+        """True if this slot's beacon is redundant and may be skipped."""
+        if self.consistent_heard < self.redundancy:
+            return False
+        if now - self.last_tx >= self.max_silence:
+            return False
+        self.suppressed += 1
+        return True
+
+    def note_tx(self, now, ok):
+        self.last_tx = now
+        self.error_rate = (self.error_rate * 0.9) + (0.0 if ok else 0.1)
@@ -0,0 +1,131 @@
+import random
+
+# ---------------------------
+# Multi-channel plan
+# ---------------------------
+# One channel's airtime caps how many badges a venue can hold. With a list of
+# data channels configured, every badge hashes its MAC onto one of them and
+# lives there, visiting the shared rendezvous channel for `dwell` seconds
+# roughly every `period` seconds so badges homed elsewhere are still
+# discovered. Chat pairs leave both and settle on one agreed channel; the
+# runtime pins it here once the partner has confirmed it.
+#
+# Visit times are jittered, so two badges whose visits keep missing each
+# other drift into overlap instead of missing forever.
+
+
+def home_channel(mac, data_channels):
+    """Data channel a badge lives on, derived from its MAC alone."""
+    h = 0
+    for b in mac:
+        h = (h * 31 + b) & 0xFFFF
+    return data_channels[h % len(data_channels)]
+
+
+class ChannelPlan:
+    """Picks the radio channel over time and measures what switching costs.
+
+    Per channel it keeps the seconds spent there (dwell) and the frames
+    heard, so quietest() can steer chat pairs to the least busy data channel.
+    Channels never visited count as idle.
+    """
+
+    def __init__(self, rendezvous, data_channels, my_mac, period=10.0, dwell=2.0):
+        self.rendezvous = rendezvous
+        self.data_channels = tuple(data_channels)
+        self.home = home_channel(my_mac, self.data_channels) if self.data_channels else rendezvous
+        self.period = period
+        self.dwell = dwell
+
+        self.current = rendezvous
+        # Chat channel agreed with the partner; 0 while there is none.
+        self.pinned = 0
+        self.visit_until = 0.0
+        self.next_visit = 0.0
+        self.entered_at = None
+
+        self.switches = 0
+        self.switch_total = 0.0
+        self.switch_max = 0.0
+        self.dwell_s = {}
+        self.heard = {}
+
+    def enabled(self):
+        return bool(self.data_channels)
+
+    def target(self, now, hold=False):
+        """Channel the radio should be on now; `hold` keeps us at rendezvous."""
+        if not self.data_channels:
+            return self.rendezvous
+        if self.pinned:
+            return self.pinned
+        if hold or now < self.visit_until:
+            return self.rendezvous
+        if now >= self.next_visit:
+            self.visit_until = now + self.dwell
+            self.next_visit = now + self.period * (0.75 + 0.5 * random.random())
+            return self.rendezvous
+        return self.home
+
+    def _account(self, now):
+        if self.entered_at is not None:
+            self.dwell_s[self.current] = self.dwell_s.get(self.current, 0.0) + (now - self.entered_at)
+        self.entered_at = now
+
+    def note_switch(self, channel, now, cost):
+        """Record a retune to `channel` that took `cost` seconds."""
+        self._account(now)
+        self.current = channel
+        self.switches += 1
+        self.switch_total += cost
+        self.switch_max = max(self.switch_max, cost)
+
+    def note_rx(self):
+        self.heard[self.current] = self.heard.get(self.current, 0) + 1
+
+    def occupancy(self, channel, now):
+        """Frames per second heard on `channel` while we were there."""
+        seconds = self.dwell_s.get(channel, 0.0)
+        if channel == self.current and self.entered_at is not None:
+            seconds += now - self.entered_at
+        if seconds <= 0:
+            return 0.0
+        return self.heard.get(channel, 0) / seconds
+
+    def quietest(self, salt, now):
+        """Least busy data channel; `salt` spreads ties so pairs do not pile up."""
+        best = self.rendezvous
+        best_key = None
+        count = len(self.data_channels)
+        for i, channel in enumerate(self.data_channels):
+            key = (self.occupancy(channel, now), (i + salt) % count)
+            if best_key is None or key < best_key:
+                best = channel
+                best_key = key
+        return best
+
+    def summary(self, now):
+        total = 0.0
+        for seconds in self.dwell_s.values():
+            total += seconds
+        if self.entered_at is not None:
+            total += now - self.entered_at
+        parts = []
+        for channel in sorted(set(self.data_channels + (self.rendezvous,))):
+            seconds = self.dwell_s.get(channel, 0.0)
+            if channel == self.current and self.entered_at is not None:
+                seconds += now - self.entered_at
+            parts.append("{}:{}%/{:.1f}fps".format(
+                channel,
+                int(100 * seconds / total) if total > 0 else 0,
+                self.occupancy(channel, now),
+            ))
+        return "cur={} home={} pinned={} switches={} switch_ms_avg={} switch_ms_max={} dwell={}".format(
+            self.current,
+            self.home,
+            self.pinned,
+            self.switches,
+            int(1000 * self.switch_total / self.switches) if self.switches else 0,
+            int(1000 * self.switch_max),
+            " ".join(parts),
+        )
@@ -0,0 +1,121 @@
+import espnow
+
+import badge_frame
+
+
+class ChatLink:
+    """Unicast ESP-NOW link to the current chat partner.
+
+    open() registers an espnow.Peer for the partner and close() removes it.
+    Every send() is resolved on a later poll_ack() against the driver's
+    send_success / send_failure counters, which move once the MAC-layer ACK
+    arrives or the retries run out. After `max_failures` unacknowledged
+    sends in a row the link reports itself down so the caller can fall back
+    to broadcast; the next ACK brings it back up.
+    """
+
+    def __init__(self, esp, channel=0, interval=0.5, max_failures=3):
+        self.esp = esp
+        self.channel = channel
+        self.interval = interval
+        self.max_failures = max_failures
+
+        self.mac = None
+        self.peer = None
+        self.seq = 0
+        self.last_send = 0.0
+        self.pending = False
+        self.failures = 0
+        self.acked_since_open = False
+        self._success_mark = 0
+        self._failure_mark = 0
+
+        self.sent = 0
+        self.acked = 0
+        self.nacked = 0
+
+    def open(self, mac):
+        """Point the link at `mac`; return False if the peer could not be added."""
+        if mac == self.mac and self.peer is not None:
+            return True
+        self.close()
+        try:
+            peer = espnow.Peer(mac=mac, channel=self.channel)
+            self.esp.peers.append(peer)
+        except Exception:
+            return False
+        self.mac = mac
+        self.peer = peer
+        self.last_send = 0.0
+        return True
+
+    def close(self):
+        if self.peer is not None:
+            try:
+                self.esp.peers.remove(self.peer)
+            except Exception:
+                pass
+        self.mac = None
+        self.peer = None
+        self.pending = False
+        self.failures = 0
+        self.acked_since_open = False
+
+    def is_up(self):
+        """True while the partner is acknowledging our unicast frames."""
+        return self.peer is not None and self.acked_since_open and self.failures < self.max_failures
+
+    def note_broadcast(self):
+        """A broadcast went out while a unicast is unresolved; it always counts as success."""
+        if self.pending:
+            self._success_mark += 1
+
+    def poll_ack(self):
+        """Resolve the last send: True (ACKed), False (no ACK) or None (unknown yet)."""
+        if not self.pending:
+            return None
+        if self.esp.send_failure != self._failure_mark:
+            ok = False
+        elif self.esp.send_success != self._success_mark:
+            ok = True
+        else:
+            return None
+        self.pending = False
+        if ok:
+            self.acked += 1
+            self.failures = 0
+            self.acked_since_open = True
+        else:
+            self.nacked += 1
+            self.failures += 1
+        return ok
+
+    def due(self, now):
+        if self.peer is None or self.pending:
+            return False
+        interval = self.interval
+        if self.failures >= self.max_failures:
+            # Partner is not answering: keep probing, but slowly.
+            interval *= 4
+        return now - self.last_send >= interval
+
+    def send(self, frame, now):
+        """Unicast a state frame as FRAME_DIRECT; return False if nothing went out."""
+        if self.peer is None or self.pending:
+            return False
+        direct = badge_frame.as_direct(frame, self.seq)
+        if direct is None:
+            return False
+        self._success_mark = self.esp.send_success
+        self._failure_mark = self.esp.send_failure
+        self.last_send = now
+        self.seq = (self.seq + 1) & 0xFF
+        self.sent += 1
+        try:
+            self.esp.send(direct, self.peer)
+        except Exception:
+            self.nacked += 1
+            self.failures += 1
+            return False
+        self.pending = True
+        return True
@@ -2,6 +2,7 @@ import maintenance_mode
 
 import time
 import os
+import random
 import board
 import displayio
 import terminalio
@@ -10,6 +11,8 @@ import digitalio
 import espnow
 import wifi
 from adafruit_display_text import label
+import badge_frame
+import interest_catalog
 
 # ---------------------------
 # Load settings.toml config
@@ -37,7 +40,10 @@ def _parse_interests(csv_text):
 
 MY_NAME = _get_env_str("MY_NAME", "MagTag")
 MY_INTERESTS = _parse_interests(_get_env_str("MY_INTERESTS", "python,circuitpython"))
+MY_INTEREST_MASK, MY_INTEREST_EXTRAS = interest_catalog.encode_interests(MY_INTERESTS[:12])
 ESPNOW_CHANNEL = _get_env_int("ESPNOW_CHANNEL", 6)
+# Send legacy "|"-joined text frames instead of binary ones (for older fleets).
+ESPNOW_TEXT_FRAMES = (_get_env_int("ESPNOW_TEXT_FRAMES", 0) != 0)
 RECENT_CHAT_PEERS_TOML = "/recent_chat_peers.toml"
 RECENT_CHAT_PEERS_KEY = "RECENT_CHATTED_MACS"
 
@@ -45,7 +51,6 @@ RECENT_CHAT_PEERS_KEY = "RECENT_CHATTED_MACS"
 BROADCAST_INTERVAL = 2.0
 PEER_TIMEOUT = 15.0
 DISPLAY_REFRESH = 8.0
-MAX_MSG_LEN = 250
 
 # -- Modes --
 MODE_SEARCH = 0
@@ -117,67 +122,61 @@ search_match_color = (0, 0, 0)
 RSSI_BADGE_THRESHOLD = -65
 seen_badge_devices = set()
 
+# Receivers cache our record until this moves, so bump it on every change.
+state_version = random.randint(0, 255)
+last_state_frame = b""
+# Per-transmission sequence number so receivers can measure frame loss.
+tx_seq = random.randint(0, 255)
+# This runtime reads only full state frames; say so once if presence-only
+# badges (ESPNOW_PULL_PROFILES=1) are around.
+presence_warned = False
+
 # -------------------------
 # Helper functions
 # -------------------------
 def build_message():
-    interests_str = ",".join(MY_INTERESTS[:12])
     topic_str = ""
-    peer_mac_hex = ""
-    shared_flag = "0"
-    idx_str = "0"
-    ver_str = "0"
+    peer_mac = None
+    idx = 0
+    ver = 0
 
     if current_mode == MODE_CHAT:
         if (not chat_force_empty_topic) and chat_common:
             topic_str = chat_common[chat_common_idx][:30]
         if isinstance(chat_peer_mac, (bytes, bytearray)):
-            peer_mac_hex = chat_peer_mac.hex()
-        else:
-            peer_mac_hex = ""
-        shared_flag = "1" if contact_shared else "0"
-        idx_str = str(chat_common_idx)
-        ver_str = str(chat_idx_ver)
+            peer_mac = chat_peer_mac
+        idx = chat_common_idx
+        ver = chat_idx_ver
 
-    parts = [
-        str(current_mode),
+    encode = badge_frame.encode_text if ESPNOW_TEXT_FRAMES else badge_frame.encode_state
+    return encode(
+        current_mode,
         MY_NAME[:20],
-        interests_str,
-        topic_str,
-        peer_mac_hex,
-        shared_flag,
-        idx_str,
-        ver_str,
-    ]
-    msg = "|".join(parts)
-    return msg[:MAX_MSG_LEN]
+        interest_mask=MY_INTEREST_MASK,
+        interest_extras=MY_INTEREST_EXTRAS,
+        topic=topic_str,
+        peer_mac=peer_mac,
+        shared=(current_mode == MODE_CHAT and contact_shared),
+        common_idx=idx,
+        idx_ver=ver,
+        state_ver=state_version,
+    )
 
 def parse_message(data):
-    try:
-        text = str(data, "utf-8")
-        parts = text.split("|")
-        while len(parts) < 8:
-            parts.append("")
-        mode = int(parts[0])
-        name = parts[1]
-        interests = [s.strip() for s in parts[2].split(",") if s.strip()]
-        topic = parts[3].strip()
-        peer_mac = bytes.fromhex(parts[4]) if parts[4] else None
-        shared = (parts[5] == "1")
-        common_idx = int(parts[6]) if parts[6] else 0
-        idx_ver = int(parts[7]) if parts[7] else 0
-        return {
-            "mode": mode,
-            "name": name,
-            "interests": interests,
-            "topic": topic,
-            "peer_mac": peer_mac,
-            "contact_shared": shared,
-            "common_idx": common_idx,
-            "idx_ver": idx_ver,
-        }
-    except Exception:
+    """Peer info from a full state frame, else None (presence frames are dropped)."""
+    global presence_warned
+    info = badge_frame.decode_frame(data)
+    if info is None or info["frame_type"] != badge_frame.FRAME_STATE:
+        if (not presence_warned) and badge_frame.has_header(data) and data[2] == badge_frame.FRAME_PRESENCE:
+            presence_warned = True
+            print("ESPNOW: ignoring presence frames; set ESPNOW_PULL_PROFILES=0 on those badges")
         return None
+    info["contact_shared"] = info.pop("shared_flag")
+    info["interests"] = (
+        interest_catalog.names_from_mask(info.pop("interest_mask")) +
+        list(info.pop("interest_extras"))
+    )
+    return info
 
 def compute_match(mine, theirs):
     mine_set = set(s.lower() for s in mine)
@@ -420,12 +419,17 @@ def check_badge_matches(packet_mac, peer_info):
 # Broadcast / receive
 # -------------------------
 def do_broadcast():
-    global last_broadcast
+    global last_broadcast, state_version, last_state_frame, tx_seq
     msg = build_message()
+    if msg != last_state_frame:
+        state_version = (state_version + 1) & 0xFF
+        msg = build_message()
+        last_state_frame = msg
     try:
-        e.send(bytes(msg, "utf-8"), broadcast_peer)
+        e.send(badge_frame.with_seq(msg, tx_seq), broadcast_peer)
     except Exception:
         pass
+    tx_seq = (tx_seq + 1) & 0xFF
     last_broadcast = time.monotonic()
 
 def flash_new_peer():
@@ -0,0 +1,322 @@
+import random
+import struct
+
+import badge_frame
+
+# ---------------------------
+# Fragmented ESP-NOW messages
+# ---------------------------
+# Payloads bigger than one ESP-NOW frame (contact cards, long interest blurbs)
+# are split into FRAME_FRAGMENT frames carrying a message id, fragment
+# index/count and the total length, and rebuilt on the far side. Everything is
+# driven from poll()/receive() in the main loop, a few fragments per call, so
+# a transfer never blocks buttons or the display.
+#
+# Reliable (unicast) messages set FRAG_FLAG_STATUS: the receiver answers the
+# last fragment with a FRAME_FRAG_STATUS bitmap of what it is still missing
+# and the sender re-sends only those fragments. A receiver that stays silent
+# is probed by re-sending the last fragment. Broadcast messages are
+# best-effort.
+
+MAX_MESSAGE_LEN = 8192
+MAX_FRAGMENTS = (MAX_MESSAGE_LEN + badge_frame.FRAG_PAYLOAD_LEN - 1) // badge_frame.FRAG_PAYLOAD_LEN
+# Completed (mac, msg_id) pairs remembered so a late probe is re-confirmed
+# instead of starting a second copy of the message.
+DONE_HISTORY = 4
+
+
+def _fragment_count(total_len):
+    return (total_len + badge_frame.FRAG_PAYLOAD_LEN - 1) // badge_frame.FRAG_PAYLOAD_LEN
+
+
+def _bitmap(count, fill):
+    bits = bytearray((count + 7) // 8)
+    if fill:
+        for i in range(count):
+            bits[i >> 3] |= 1 << (i & 7)
+    return bits
+
+
+def _has_bit(bits, i):
+    return bits[i >> 3] & (1 << (i & 7))
+
+
+class _Reassembly:
+    """One incoming message; its buffer is sized from the first fragment seen."""
+
+    def __init__(self, mac, msg_id, kind, count, total_len, now):
+        self.mac = mac
+        self.msg_id = msg_id
+        self.kind = kind
+        self.count = count
+        self.total_len = total_len
+        self.data = bytearray(total_len)
+        self.missing = _bitmap(count, True)
+        self.remaining = count
+        self.started = now
+        self.last = now
+
+
+class FragmentTransport:
+    """Non-blocking transfer of messages up to MAX_MESSAGE_LEN bytes.
+
+    send() queues one outgoing message and poll() pushes up to `burst`
+    fragments of it per call, handling status timeouts and selective
+    retransmits. receive() takes every fragment/status frame and returns
+    (kind, payload) once a message is complete. At most `max_buffers`
+    messages are reassembled at once; one that stalls for
+    `reassembly_timeout` seconds is dropped.
+    """
+
+    def __init__(self, esp, burst=4, max_buffers=2, reassembly_timeout=5.0,
+                 status_timeout=0.5, max_retries=6):
+        self.esp = esp
+        self.burst = burst
+        self.max_buffers = max_buffers
+        self.reassembly_timeout = reassembly_timeout
+        self.status_timeout = status_timeout
+        self.max_retries = max_retries
+
+        self.seq = 0
+        # Random start so a rebooted sender does not reuse a recent id.
+        self.tx_id = random.randint(0, 255)
+        self.tx_payload = None
+        self.tx_peer = None
+        self.tx_kind = 0
+        self.tx_flags = 0
+        self.tx_count = 0
+        self.tx_pending = None
+        self.tx_left = 0
+        self.tx_started = 0.0
+        self.tx_deadline = 0.0
+        self.tx_retries = 0
+        self.buffers = []
+        self.done = []
+
+        self.tx_messages = 0
+        self.tx_ok = 0
+        self.tx_failed = 0
+        self.tx_fragments = 0
+        self.tx_retransmits = 0
+        self.rx_messages = 0
+        self.rx_fragments = 0
+        self.rx_expired = 0
+        self.rx_dropped = 0
+        # Bytes/s of the last completed transfer in each direction.
+        self.tx_rate = 0.0
+        self.rx_rate = 0.0
+
+    # -- sending --
+    def busy(self):
+        return self.tx_payload is not None
+
+    def send(self, peer, kind, payload, now, reliable=False):
+        """Queue `payload` for `peer`; return False if busy or it is too big."""
+        if self.tx_payload is not None or not payload or len(payload) > MAX_MESSAGE_LEN:
+            return False
+        self.tx_id = (self.tx_id + 1) & 0xFF
+        self.tx_payload = memoryview(payload)
+        self.tx_peer = peer
+        self.tx_kind = kind
+        self.tx_flags = badge_frame.FRAG_FLAG_STATUS if reliable else 0
+        self.tx_count = _fragment_count(len(payload))
+        self.tx_pending = _bitmap(self.tx_count, True)
+        self.tx_left = self.tx_count
+        self.tx_started = now
+        self.tx_deadline = 0.0
+        self.tx_retries = 0
+        self.tx_messages += 1
+        return True
+
+    def cancel(self):
+        """Drop the outgoing message, e.g. when its peer goes away."""
+        self.tx_payload = None
+        self.tx_peer = None
+
+    def _finish(self, now, ok):
+        if ok:
+            self.tx_ok += 1
+            elapsed = now - self.tx_started
+            if elapsed > 0:
+                self.tx_rate = len(self.tx_payload) / elapsed
+        else:
+            self.tx_failed += 1
+        self.cancel()
+
+    def _send_fragment(self, index):
+        step = badge_frame.FRAG_PAYLOAD_LEN
+        total = len(self.tx_payload)
+        start = index * step
+        frame = badge_frame.encode_fragment(
+            self.tx_id, self.seq, self.tx_flags, self.tx_kind, index, self.tx_count, total,
+            self.tx_payload[start:min(start + step, total)],
+        )
+        self.seq = (self.seq + 1) & 0xFF
+        self.esp.send(frame, self.tx_peer)
+        self.tx_fragments += 1
+
+    def poll(self, now):
+        """Expire stalled reassemblies and push the next few outgoing fragments."""
+        self._expire(now)
+        if self.tx_payload is None:
+            return
+
+        sent = 0
+        for i in range(self.tx_count):
+            if sent >= self.burst or not self.tx_left:
+                break
+            if not _has_bit(self.tx_pending, i):
+                continue
+            try:
+                self._send_fragment(i)
+            except Exception:
+                self.tx_retries += 1
+                if self.tx_retries > self.max_retries:
+                    self._finish(now, False)
+                return
+            self.tx_pending[i >> 3] &= ~(1 << (i & 7))
+            self.tx_left -= 1
+            sent += 1
+            if not self.tx_left:
+                self.tx_deadline = now + self.status_timeout
+
+        if self.tx_left:
+            return
+        if not self.tx_flags:
+            self._finish(now, True)
+        elif now >= self.tx_deadline:
+            # No status yet: re-send the last fragment to ask for one.
+            self.tx_retries += 1
+            if self.tx_retries > self.max_retries:
+                self._finish(now, False)
+                return
+            last = self.tx_count - 1
+            self.tx_pending[last >> 3] |= 1 << (last & 7)
+            self.tx_left = 1
+            self.tx_retransmits += 1
+
+    def _on_status(self, mac, data, now):
+        if self.tx_payload is None or not self.tx_flags or data[3] != self.tx_id:
+            return
+        if bytes(mac) != bytes(self.tx_peer.mac):
+            return
+        count = data[5]
+        if count != self.tx_count or len(data) < badge_frame.FRAG_STATUS_LEN + len(self.tx_pending):
+            return
+        missing = data[badge_frame.FRAG_STATUS_LEN:]
+        if not any(missing):
+            self._finish(now, True)
+            return
+        resend = 0
+        for i in range(count):
+            if _has_bit(missing, i) and not _has_bit(self.tx_pending, i):
+                self.tx_pending[i >> 3] |= 1 << (i & 7)
+                resend += 1
+        # Receiver made progress: retransmit just the gaps it reported.
+        self.tx_left += resend
+        self.tx_retransmits += resend
+        self.tx_retries = 0
+
+    # -- receiving --
+    def _expire(self, now):
+        for buf in list(self.buffers):
+            if now - buf.last > self.reassembly_timeout:
+                self.buffers.remove(buf)
+                self.rx_expired += 1
+
+    def _send_status(self, peer, msg_id, count, missing):
+        try:
+            self.esp.send(badge_frame.encode_frag_status(msg_id, self.seq, count, missing), peer)
+        except Exception:
+            pass
+        self.seq = (self.seq + 1) & 0xFF
+
+    def _buffer_for(self, mac, msg_id, kind, count, total_len, now):
+        for buf in self.buffers:
+            if buf.mac == mac and buf.msg_id == msg_id:
+                if buf.count == count and buf.total_len == total_len and buf.kind == kind:
+                    return buf
+                # Same id, different message: the sender restarted.
+                self.buffers.remove(buf)
+                break
+        if len(self.buffers) >= self.max_buffers:
+            oldest = self.buffers[0]
+            for buf in self.buffers:
+                if buf.last < oldest.last:
+                    oldest = buf
+            self.buffers.remove(oldest)
+            self.rx_dropped += 1
+        buf = _Reassembly(mac, msg_id, kind, count, total_len, now)
+        self.buffers.append(buf)
+        return buf
+
+    def receive(self, mac, data, now, reply_peer=None):
+        """Feed one fragment or status frame; return (kind, payload) when a message completes.
+
+        Status reports for reliable messages go to `reply_peer`; without one
+        the sender's retries simply run out."""
+        if data[2] == badge_frame.FRAME_FRAG_STATUS:
+            if len(data) > badge_frame.FRAG_STATUS_LEN:
+                self._on_status(mac, data, now)
+            return None
+        if len(data) <= badge_frame.FRAG_HEADER_LEN:
+            self.rx_dropped += 1
+            return None
+        _, _, _, msg_id, _, flags, kind, index, count, total_len = struct.unpack_from(
+            badge_frame.FRAG_HEADER_FMT, data, 0
+        )
+        step = badge_frame.FRAG_PAYLOAD_LEN
+        start = index * step
+        size = len(data) - badge_frame.FRAG_HEADER_LEN
+        if (total_len == 0 or total_len > MAX_MESSAGE_LEN or count != _fragment_count(total_len)
+                or index >= count or size != min(step, total_len - start)):
+            self.rx_dropped += 1
+            return None
+        self.rx_fragments += 1
+        mac = bytes(mac)
+        reliable = (flags & badge_frame.FRAG_FLAG_STATUS) and reply_peer is not None
+
+        if (mac, msg_id) in self.done:
+            # Our "complete" report was lost and the sender is probing again.
+            if reliable:
+                self._send_status(reply_peer, msg_id, count, _bitmap(count, False))
+            return None
+
+        buf = self._buffer_for(mac, msg_id, kind, count, total_len, now)
+        buf.last = now
+        if _has_bit(buf.missing, index):
+            buf.data[start:start + size] = memoryview(data)[badge_frame.FRAG_HEADER_LEN:]
+            buf.missing[index >> 3] &= ~(1 << (index & 7))
+            buf.remaining -= 1
+
+        if buf.remaining:
+            if reliable and index == count - 1:
+                self._send_status(reply_peer, msg_id, count, buf.missing)
+            return None
+
+        self.buffers.remove(buf)
+        self.done.append((mac, msg_id))
+        if len(self.done) > DONE_HISTORY:
+            self.done.pop(0)
+        self.rx_messages += 1
+        elapsed = now - buf.started
+        if elapsed > 0:
+            self.rx_rate = total_len / elapsed
+        if reliable:
+            self._send_status(reply_peer, msg_id, count, buf.missing)
+        return buf.kind, buf.data
+
+    def summary(self):
+        return "tx={} ok={} fail={} frags={} retx={} tx_Bps={} rx={} rx_frags={} expired={} dropped={} rx_Bps={}".format(
+            self.tx_messages,
+            self.tx_ok,
+            self.tx_failed,
+            self.tx_fragments,
+            self.tx_retransmits,
+            int(self.tx_rate),
+            self.rx_messages,
+            self.rx_fragments,
+            self.rx_expired,
+            self.rx_dropped,
+            int(self.rx_rate),
+        )
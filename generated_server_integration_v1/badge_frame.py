@@ -0,0 +1,545 @@
+import struct
+
+import interest_catalog
+
+# ---------------------------
+# Compact ESP-NOW frame codec
+# ---------------------------
+# Binary state frame (version 5), all integers little-endian:
+#   0  magic        u8  FRAME_MAGIC (never a printable ASCII digit)
+#   1  version      u8  FRAME_VERSION
+#   2  frame type   u8  FRAME_STATE
+#   3  state_ver    u8  sender's state counter, bumped on every content change
+#   4  seq          u8  sender's frame counter, bumped on every transmission
+#   5  mode         u8  MODE_SEARCH / MODE_CHAT
+#   6  flags        u8  FLAG_* bitfield
+#   7  common_idx   u8
+#   8  idx_ver      u16
+#  10  channel      u8  home data channel, or in CHAT the channel asked of the
+#                       partner (0 = no channel plan, see channel_plan.py)
+#  11  peer mac     6 raw bytes (zeros unless FLAG_PEER_MAC)
+#  17  interests    u8 length + little-endian interest_catalog bitmask
+#   .. name         u8 length + UTF-8 bytes
+#   .. topic        u8 length + UTF-8 bytes
+#   .. extras       u8 length + comma-joined off-catalog interests
+#
+# The version byte moves whenever the layout changes; frames with another
+# binary version are rejected rather than misread.
+#
+# Heartbeat frame: the first five header bytes only (type FRAME_HEARTBEAT).
+# It tells receivers the sender is alive and still at `state_ver`, so a
+# cached record can be kept without re-sending or re-parsing the full state.
+# The seq byte is stamped at send time (with_seq) so receivers can tell lost
+# and duplicated frames apart from a badge that has walked away.
+#
+# Direct frame: a state frame unicast to the chat partner (type FRAME_DIRECT,
+# stamped by as_direct). Its seq byte counts the unicast stream only, so it is
+# kept out of the broadcast loss statistics.
+#
+# Fragment frame (type FRAME_FRAGMENT, see frag_transport.py): one slice of a
+# message too big for a single frame.
+#   3  msg_id       u8  sender's message counter (replaces state_ver)
+#   4  seq          u8
+#   5  flags        u8  FRAG_FLAG_STATUS: receiver should report what it missed
+#   6  kind         u8  MSG_* payload type
+#   7  index        u8  fragment number, 0-based
+#   8  count        u8  fragments in the message
+#   9  total_len    u16 message length in bytes
+#  11  payload      up to FRAG_PAYLOAD_LEN bytes
+# Fragment status frame (type FRAME_FRAG_STATUS): msg_id at 3, seq at 4,
+# count at 5, then a bitmap of the fragments still missing (all zero once the
+# message is complete).
+#
+# Presence frame (type FRAME_PRESENCE): the state frame up to and including
+# the peer mac, then a u32 profile hash at FIXED_LEN and the topic field.
+# Name and interests are left out; a receiver that has no profile cached for
+# that hash asks for it once with a profile request.
+# Profile request frame (type FRAME_PROFILE_REQ): the five heartbeat bytes,
+# then the u32 profile hash wanted.
+# Profile frame (type FRAME_PROFILE): the five heartbeat bytes (state_ver 0),
+# the u32 profile hash, then the interests, name and extras fields exactly as
+# in a state frame. The hash is FNV-1a over those three fields.
+# Legacy "|"-joined text frames are still decoded so mixed fleets keep working.
+
+FRAME_MAGIC = 0xB7
+FRAME_VERSION = 5
+FRAME_STATE = 0x01
+FRAME_HEARTBEAT = 0x02
+FRAME_DIRECT = 0x03
+FRAME_FRAGMENT = 0x04
+FRAME_FRAG_STATUS = 0x05
+FRAME_PRESENCE = 0x06
+FRAME_PROFILE_REQ = 0x07
+FRAME_PROFILE = 0x08
+
+FLAG_SHARED = 0x01
+FLAG_PEER_MAC = 0x02
+
+MAX_FRAME_LEN = 250
+MAX_NAME_BYTES = 20
+MAX_TOPIC_BYTES = 30
+
+HEADER_FMT = "<BBBBBBBBHB"
+HEADER_LEN = 11
+HEARTBEAT_LEN = 5
+SEQ_OFFSET = 4
+CHANNEL_OFFSET = 10
+MAC_LEN = 6
+FIXED_LEN = HEADER_LEN + MAC_LEN
+HASH_LEN = 4
+PROFILE_REQ_LEN = HEARTBEAT_LEN + HASH_LEN
+
+FRAG_HEADER_FMT = "<BBBBBBBBBH"
+FRAG_HEADER_LEN = 11
+FRAG_PAYLOAD_LEN = MAX_FRAME_LEN - FRAG_HEADER_LEN
+FRAG_STATUS_LEN = 6
+FRAG_FLAG_STATUS = 0x01
+
+# Fragmented message payload types.
+MSG_CARD = 0x01
+# Contact card fields are joined with the ASCII unit separator.
+CARD_SEP = "\x1f"
+
+_NO_MAC = b"\x00" * MAC_LEN
+
+
+def _encode_text(text, limit):
+    raw = (text or "").encode("utf-8")
+    if len(raw) <= limit:
+        return raw
+    # Trim whole characters so a multi-byte sequence is never split.
+    value = text[:limit]
+    raw = value.encode("utf-8")
+    while len(raw) > limit:
+        value = value[:-1]
+        raw = value.encode("utf-8")
+    return raw
+
+
+def _split_interests(csv_text):
+    return [s.strip() for s in csv_text.split(",") if s.strip()]
+
+
+def encode_state(mode, name, interest_mask=0, interest_extras=(), topic="",
+                 peer_mac=None, shared=False, common_idx=0, idx_ver=0, state_ver=0, channel=0):
+    """Build a binary state frame from a catalog mask plus off-catalog extras."""
+    flags = 0
+    if shared:
+        flags |= FLAG_SHARED
+    mac = _NO_MAC
+    if isinstance(peer_mac, (bytes, bytearray)) and len(peer_mac) == MAC_LEN:
+        flags |= FLAG_PEER_MAC
+        mac = bytes(peer_mac)
+
+    mask_raw = interest_catalog.mask_to_bytes(interest_mask)
+    name_raw = _encode_text(name, MAX_NAME_BYTES)
+    topic_raw = _encode_text(topic, MAX_TOPIC_BYTES)
+    room = MAX_FRAME_LEN - FIXED_LEN - 4 - len(mask_raw) - len(name_raw) - len(topic_raw)
+    extras_raw = _encode_text(",".join(interest_extras), min(255, room))
+
+    fields = (mask_raw, name_raw, topic_raw, extras_raw)
+    out = bytearray(FIXED_LEN + 4 + sum(len(raw) for raw in fields))
+    struct.pack_into(
+        HEADER_FMT, out, 0,
+        FRAME_MAGIC, FRAME_VERSION, FRAME_STATE, int(state_ver) & 0xFF, 0,
+        int(mode) & 0xFF, flags, int(common_idx) & 0xFF, int(idx_ver) & 0xFFFF,
+        int(channel) & 0xFF,
+    )
+    out[HEADER_LEN:FIXED_LEN] = mac
+    pos = FIXED_LEN
+    for raw in fields:
+        out[pos] = len(raw)
+        pos += 1
+        out[pos:pos + len(raw)] = raw
+        pos += len(raw)
+    return bytes(out)
+
+
+def encode_text(mode, name, interest_mask=0, interest_extras=(), topic="",
+                peer_mac=None, shared=False, common_idx=0, idx_ver=0, state_ver=0, channel=0):
+    """Build a legacy pipe-delimited frame for badges on older firmware."""
+    _ = (state_ver, channel)
+    interests = interest_catalog.names_from_mask(interest_mask) + list(interest_extras)
+    peer_mac_hex = ""
+    if isinstance(peer_mac, (bytes, bytearray)) and len(peer_mac) == MAC_LEN:
+        peer_mac_hex = bytes(peer_mac).hex()
+    parts = [
+        str(mode),
+        (name or "")[:20],
+        ",".join(interests[:12]),
+        (topic or "")[:30],
+        peer_mac_hex,
+        "1" if shared else "0",
+        str(common_idx),
+        str(idx_ver),
+    ]
+    return bytes("|".join(parts)[:MAX_FRAME_LEN], "utf-8")
+
+
+def encode_heartbeat(state_ver):
+    return bytes((FRAME_MAGIC, FRAME_VERSION, FRAME_HEARTBEAT, int(state_ver) & 0xFF, 0))
+
+
+def with_seq(frame, seq):
+    """Return a binary frame with its sequence byte set; text frames pass through."""
+    if not has_header(frame):
+        return frame
+    out = bytearray(frame)
+    out[SEQ_OFFSET] = int(seq) & 0xFF
+    return out
+
+
+def as_direct(frame, seq):
+    """Turn a binary state frame into a FRAME_DIRECT one, or return None."""
+    if not has_header(frame) or frame[2] != FRAME_STATE:
+        return None
+    out = bytearray(frame)
+    out[2] = FRAME_DIRECT
+    out[SEQ_OFFSET] = int(seq) & 0xFF
+    return out
+
+
+def _profile_hash(data):
+    """32-bit FNV-1a; computed once per profile, not per frame."""
+    h = 0x811C9DC5
+    for b in data:
+        h = ((h ^ b) * 0x01000193) & 0xFFFFFFFF
+    return h
+
+
+def as_presence(frame, profile_hash):
+    """Turn a binary state frame into a FRAME_PRESENCE one, or return None."""
+    if not has_header(frame) or frame[2] != FRAME_STATE:
+        return None
+    end = len(frame)
+    topic_pos = _skip_field(frame, _skip_field(frame, FIXED_LEN, end), end)
+    extras_pos = _skip_field(frame, topic_pos, end)
+    if extras_pos < 0:
+        return None
+    out = bytearray(FIXED_LEN + HASH_LEN + extras_pos - topic_pos)
+    out[:FIXED_LEN] = frame[:FIXED_LEN]
+    out[2] = FRAME_PRESENCE
+    struct.pack_into("<I", out, FIXED_LEN, profile_hash)
+    out[FIXED_LEN + HASH_LEN:] = frame[topic_pos:extras_pos]
+    return bytes(out)
+
+
+def encode_profile(name, interest_mask=0, interest_extras=()):
+    """Build the FRAME_PROFILE reply carrying the fields a presence frame leaves out."""
+    mask_raw = interest_catalog.mask_to_bytes(interest_mask)
+    name_raw = _encode_text(name, MAX_NAME_BYTES)
+    room = MAX_FRAME_LEN - PROFILE_REQ_LEN - 3 - len(mask_raw) - len(name_raw)
+    extras_raw = _encode_text(",".join(interest_extras), min(255, room))
+
+    out = bytearray(PROFILE_REQ_LEN)
+    out[0] = FRAME_MAGIC
+    out[1] = FRAME_VERSION
+    out[2] = FRAME_PROFILE
+    for raw in (mask_raw, name_raw, extras_raw):
+        out.append(len(raw))
+        out.extend(raw)
+    struct.pack_into("<I", out, HEARTBEAT_LEN, _profile_hash(memoryview(out)[PROFILE_REQ_LEN:]))
+    return bytes(out)
+
+
+def encode_profile_request(profile_hash):
+    out = bytearray(PROFILE_REQ_LEN)
+    out[0] = FRAME_MAGIC
+    out[1] = FRAME_VERSION
+    out[2] = FRAME_PROFILE_REQ
+    struct.pack_into("<I", out, HEARTBEAT_LEN, profile_hash)
+    return out
+
+
+def profile_hash_of(frame):
+    """Profile hash carried by a profile or profile request frame."""
+    return struct.unpack_from("<I", frame, HEARTBEAT_LEN)[0]
+
+
+def decode_profile(data):
+    """Decode a profile frame into (hash, (name, interest_mask, interest_extras)), or None."""
+    buf = memoryview(data)
+    end = len(buf)
+    if end < PROFILE_REQ_LEN or buf[2] != FRAME_PROFILE:
+        return None
+    name_pos = _skip_field(buf, PROFILE_REQ_LEN, end)
+    extras_pos = _skip_field(buf, name_pos, end)
+    if _skip_field(buf, extras_pos, end) < 0:
+        return None
+    try:
+        name = str(bytes(buf[name_pos + 1:extras_pos]), "utf-8")
+        extras_csv = str(bytes(buf[extras_pos + 1:extras_pos + 1 + buf[extras_pos]]), "utf-8")
+    except Exception:
+        return None
+    mask = interest_catalog.mask_from_bytes(buf[PROFILE_REQ_LEN + 1:name_pos])
+    extras = tuple(_split_interests(extras_csv)) if extras_csv else ()
+    return profile_hash_of(buf), (name, mask, extras)
+
+
+def is_profile_frame(data):
+    """True for profile requests/replies; they are unicast and carry no state."""
+    return has_header(data) and data[2] in (FRAME_PROFILE_REQ, FRAME_PROFILE)
+
+
+def encode_fragment(msg_id, seq, flags, kind, index, count, total_len, chunk):
+    out = bytearray(FRAG_HEADER_LEN + len(chunk))
+    struct.pack_into(
+        FRAG_HEADER_FMT, out, 0,
+        FRAME_MAGIC, FRAME_VERSION, FRAME_FRAGMENT, int(msg_id) & 0xFF, int(seq) & 0xFF,
+        flags, kind, index, count, total_len,
+    )
+    out[FRAG_HEADER_LEN:] = chunk
+    return out
+
+
+def encode_frag_status(msg_id, seq, count, missing):
+    """Build a status frame; `missing` is the receiver's bitmap of absent fragments."""
+    out = bytearray(FRAG_STATUS_LEN + len(missing))
+    out[0] = FRAME_MAGIC
+    out[1] = FRAME_VERSION
+    out[2] = FRAME_FRAG_STATUS
+    out[3] = int(msg_id) & 0xFF
+    out[4] = int(seq) & 0xFF
+    out[5] = count
+    out[FRAG_STATUS_LEN:] = missing
+    return out
+
+
+def encode_card(name, contact="", interests=""):
+    """Contact card payload: untruncated name, contact line and interest text."""
+    return CARD_SEP.join((name or "", contact or "", interests or "")).encode("utf-8")
+
+
+def decode_card(data):
+    """Decode a contact card into {"name", "contact", "interests"}, or None."""
+    try:
+        parts = str(bytes(data), "utf-8").split(CARD_SEP)
+    except Exception:
+        return None
+    while len(parts) < 3:
+        parts.append("")
+    return {"name": parts[0], "contact": parts[1], "interests": parts[2]}
+
+
+def is_transport_frame(data):
+    """True for fragment/status frames; byte 3 there is a msg_id, not state_ver."""
+    return has_header(data) and data[2] in (FRAME_FRAGMENT, FRAME_FRAG_STATUS)
+
+
+def has_header(data):
+    """True if data starts with a binary header this codec can read.
+
+    Callers can then index data[2] (frame type), data[3] (state_ver) and
+    data[SEQ_OFFSET] directly, without decoding or allocating anything."""
+    return len(data) >= HEARTBEAT_LEN and data[0] == FRAME_MAGIC and data[1] == FRAME_VERSION
+
+
+def _read_field(buf, pos, end):
+    if pos >= end:
+        raise ValueError("truncated frame")
+    n = buf[pos]
+    pos += 1
+    if pos + n > end:
+        raise ValueError("truncated frame")
+    return buf[pos:pos + n], pos + n
+
+
+def _read_text(buf, pos, end):
+    raw, pos = _read_field(buf, pos, end)
+    return str(bytes(raw), "utf-8"), pos
+
+
+def decode_binary(data):
+    """Decode a binary state frame, or return None if it is not valid."""
+    try:
+        buf = memoryview(data)
+        end = len(buf)
+        if end < HEARTBEAT_LEN or buf[0] != FRAME_MAGIC or buf[1] != FRAME_VERSION:
+            return None
+        if buf[2] == FRAME_HEARTBEAT:
+            return {"frame_type": FRAME_HEARTBEAT, "state_ver": buf[3], "seq": buf[SEQ_OFFSET]}
+        if end < FIXED_LEN:
+            return None
+        _, _, frame_type, state_ver, seq, mode, flags, common_idx, idx_ver, channel = struct.unpack_from(
+            HEADER_FMT, buf, 0
+        )
+        if frame_type not in (FRAME_STATE, FRAME_DIRECT):
+            return None
+        peer_mac = bytes(buf[HEADER_LEN:FIXED_LEN]) if (flags & FLAG_PEER_MAC) else None
+        mask_raw, pos = _read_field(buf, FIXED_LEN, end)
+        name, pos = _read_text(buf, pos, end)
+        topic, pos = _read_text(buf, pos, end)
+        extras_csv, pos = _read_text(buf, pos, end)
+        extras = ()
+        if extras_csv:
+            extras = tuple(_split_interests(extras_csv))
+        return {
+            "frame_type": frame_type,
+            "state_ver": state_ver,
+            "seq": seq,
+            "mode": mode,
+            "name": name,
+            "interest_mask": interest_catalog.mask_from_bytes(mask_raw),
+            "interest_extras": extras,
+            "topic": topic.strip(),
+            "peer_mac": peer_mac,
+            "shared_flag": bool(flags & FLAG_SHARED),
+            "common_idx": common_idx,
+            "idx_ver": idx_ver,
+            "channel": channel,
+            "profile_hash": None,
+        }
+    except Exception:
+        return None
+
+
+def decode_text(data):
+    """Decode a legacy pipe-delimited frame, or return None if it is not valid."""
+    try:
+        text = str(data, "utf-8")
+        parts = text.split("|")
+        while len(parts) < 8:
+            parts.append("")
+        interest_mask, interest_extras = interest_catalog.encode_interests(
+            _split_interests(parts[2])
+        )
+        return {
+            "frame_type": FRAME_STATE,
+            "state_ver": None,
+            "seq": None,
+            "mode": int(parts[0]),
+            "name": parts[1],
+            "interest_mask": interest_mask,
+            "interest_extras": interest_extras,
+            "topic": parts[3].strip(),
+            "peer_mac": bytes.fromhex(parts[4]) if parts[4] else None,
+            "shared_flag": (parts[5].strip() == "1"),
+            "common_idx": int(parts[6]) if parts[6] else 0,
+            "idx_ver": int(parts[7]) if parts[7] else 0,
+            "channel": 0,
+            "profile_hash": None,
+        }
+    except Exception:
+        return None
+
+
+# Keys decode_frame()/decode_into() fill in a peer record.
+STATE_KEYS = (
+    "state_ver", "mode", "name", "interest_mask", "interest_extras",
+    "topic", "peer_mac", "shared_flag", "common_idx", "idx_ver", "channel",
+    "profile_hash",
+)
+
+
+def _skip_field(buf, pos, end):
+    """Return the offset after a length-prefixed field, or -1 if truncated."""
+    if pos < 0 or pos >= end:
+        return -1
+    pos += 1 + buf[pos]
+    if pos > end:
+        return -1
+    return pos
+
+
+def _same_mac(buf, pos, mac):
+    if mac is None or len(mac) != MAC_LEN:
+        return False
+    for i in range(MAC_LEN):
+        if buf[pos + i] != mac[i]:
+            return False
+    return True
+
+
+def _decode_header_into(buf, rec):
+    flags = buf[6]
+    rec["state_ver"] = buf[3]
+    rec["mode"] = buf[5]
+    rec["shared_flag"] = bool(flags & FLAG_SHARED)
+    rec["common_idx"] = buf[7]
+    rec["idx_ver"] = buf[8] | (buf[9] << 8)
+    rec["channel"] = buf[CHANNEL_OFFSET]
+    if not (flags & FLAG_PEER_MAC):
+        rec["peer_mac"] = None
+    elif not _same_mac(buf, HEADER_LEN, rec.get("peer_mac")):
+        rec["peer_mac"] = bytes(buf[HEADER_LEN:FIXED_LEN])
+
+
+def _decode_presence_into(buf, rec):
+    end = len(buf)
+    topic_pos = FIXED_LEN + HASH_LEN
+    if _skip_field(buf, topic_pos, end) < 0:
+        return False
+    try:
+        topic = str(bytes(buf[topic_pos + 1:topic_pos + 1 + buf[topic_pos]]), "utf-8").strip()
+    except Exception:
+        return False
+    _decode_header_into(buf, rec)
+    rec["topic"] = topic
+    rec["profile_hash"] = struct.unpack_from("<I", buf, FIXED_LEN)[0]
+    return True
+
+
+def _decode_binary_into(data, rec):
+    buf = memoryview(data)
+    end = len(buf)
+    if end >= FIXED_LEN and buf[2] == FRAME_PRESENCE:
+        return _decode_presence_into(buf, rec)
+    if end < FIXED_LEN or buf[2] not in (FRAME_STATE, FRAME_DIRECT):
+        return False
+    # Bounds-check every field before the record is touched.
+    name_pos = _skip_field(buf, FIXED_LEN, end)
+    topic_pos = _skip_field(buf, name_pos, end)
+    extras_pos = _skip_field(buf, topic_pos, end)
+    if _skip_field(buf, extras_pos, end) < 0:
+        return False
+    try:
+        name = str(bytes(buf[name_pos + 1:topic_pos]), "utf-8")
+        topic = str(bytes(buf[topic_pos + 1:extras_pos]), "utf-8").strip()
+        extras_csv = str(bytes(buf[extras_pos + 1:extras_pos + 1 + buf[extras_pos]]), "utf-8")
+    except Exception:
+        return False
+
+    _decode_header_into(buf, rec)
+    rec["profile_hash"] = None
+    rec["interest_mask"] = interest_catalog.mask_from_bytes(buf[FIXED_LEN + 1:name_pos])
+    rec["name"] = name
+    rec["topic"] = topic
+    rec["interest_extras"] = tuple(_split_interests(extras_csv)) if extras_csv else ()
+    return True
+
+
+def decode_into(data, rec):
+    """Decode a state frame straight into an existing peer record.
+
+    Writes the STATE_KEYS fields in place instead of building a new dict,
+    reading binary frames through a memoryview. Presence frames fill in
+    everything but name and interests and set "profile_hash"; full frames set
+    it to None. Returns False, leaving the record untouched, for heartbeats
+    and invalid frames."""
+    if not data:
+        return False
+    if is_binary_frame(data):
+        if not has_header(data):
+            return False
+        return _decode_binary_into(data, rec)
+    info = decode_text(data)
+    if info is None:
+        return False
+    for key in STATE_KEYS:
+        rec[key] = info[key]
+    return True
+
+
+def is_binary_frame(data):
+    return len(data) > 0 and data[0] == FRAME_MAGIC
+
+
+def decode_frame(data):
+    """Decode either frame format into the runtime's peer-info dict.
+
+    Heartbeats decode to {"frame_type": FRAME_HEARTBEAT, "state_ver": n, "seq": m}."""
+    if not data:
+        return None
+    if is_binary_frame(data):
+        return decode_binary(data)
+    return decode_text(data)
@@ -0,0 +1,63 @@
+import math
+
+# ---------------------------
+# Crowd size estimate
+# ---------------------------
+# The peer table only holds the most valuable PEER_TABLE_SIZE badges; the rest
+# of the room is just counted here. Every frame's MAC is hashed into a fixed
+# bitmap and the number of distinct senders is estimated from the bits still
+# clear (linear counting), so memory and per-frame cost stay the same whether
+# 10 or 1000 badges are in range. The bitmap starts over every `window`
+# seconds, so badges that left stop counting after one window.
+
+
+def _mac_hash(mac):
+    # FNV-1a: badges share their vendor prefix, so every byte has to count.
+    h = 0x811C9DC5
+    for b in mac:
+        h = ((h ^ b) * 0x01000193) & 0xFFFFFFFF
+    return h
+
+
+class CrowdMeter:
+    """Distinct senders heard per `window` seconds, in `bits` bits of state."""
+
+    def __init__(self, now, window=15.0, bits=1024):
+        self.window = window
+        self.bits = bits
+        self.bitmap = bytearray(bits // 8)
+        self.zeros = bits
+        self.window_start = now
+        # Estimate for the last full window.
+        self.last_count = 0
+        self.frames = 0
+
+    def note(self, mac):
+        self.frames += 1
+        bit = _mac_hash(mac) % self.bits
+        mask = 1 << (bit & 7)
+        byte = bit >> 3
+        if not self.bitmap[byte] & mask:
+            self.bitmap[byte] |= mask
+            self.zeros -= 1
+
+    def _count(self):
+        if self.zeros == self.bits:
+            return 0
+        if self.zeros == 0:
+            return int(self.bits * math.log(self.bits))
+        return int(0.5 - self.bits * math.log(self.zeros / self.bits))
+
+    def roll(self, now):
+        """Start a new window once the current one is over."""
+        if now - self.window_start < self.window:
+            return
+        self.last_count = self._count()
+        for i in range(len(self.bitmap)):
+            self.bitmap[i] = 0
+        self.zeros = self.bits
+        self.window_start = now
+
+    def size(self):
+        """Badges heard recently: the larger of the last and the current window."""
+        return max(self.last_count, self._count())
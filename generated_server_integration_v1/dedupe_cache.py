@@ -0,0 +1,64 @@
+# ---------------------------
+# TTL de-duplication cache
+# ---------------------------
+# Remembers which keys (peer ids) an event was already raised for, so a match
+# alert or new-peer flash fires once per person rather than once per frame,
+# and fires again when the same badge comes back after `ttl` seconds.
+#
+# Memory is fixed at `size` keys whatever the crowd: keys sit in a ring in the
+# order they were added, and a full ring overwrites its oldest slot. Every key
+# has the same TTL, so the oldest slot is also the first to expire. A key
+# added again takes a new slot; its old one is recognised as stale and skipped.
+# Lookups and inserts are a dict access plus a ring write.
+
+
+class DedupeCache:
+    """Keys seen in the last `ttl` seconds, at most `size` of them."""
+
+    def __init__(self, size=64, ttl=1800.0):
+        self.ttl = ttl
+        self.ring = [None] * size
+        self.head = 0
+        # key -> [expiry, ring slot]
+        self.entries = {}
+        self.expired = 0
+        self.evicted = 0
+
+    def seen(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        if entry[0] <= now:
+            del self.entries[key]
+            self.expired += 1
+            return False
+        return True
+
+    def add(self, key, now):
+        slot = self.head
+        old = self.ring[slot]
+        if old is not None:
+            entry = self.entries.get(old)
+            if entry is not None and entry[1] == slot:
+                del self.entries[old]
+                if entry[0] > now:
+                    self.evicted += 1
+        self.ring[slot] = key
+        self.head = (slot + 1) % len(self.ring)
+        self.entries[key] = [now + self.ttl, slot]
+
+    def first(self, key, now):
+        """True (and remember `key`) unless it was seen in the last `ttl` seconds."""
+        if self.seen(key, now):
+            return False
+        self.add(key, now)
+        return True
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
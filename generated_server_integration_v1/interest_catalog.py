@@ -0,0 +1,167 @@
+# ---------------------------
+# Shared interest catalog
+# ---------------------------
+# Every badge carries the same catalog, so an interest can travel as one bit
+# of a fixed-width mask instead of a string. Index order is part of the
+# wire format: only ever append new entries, never reorder or remove.
+#
+# The index is also the interest's canonical id: the survey saves the ids it
+# picked as MY_INTEREST_IDS, and each entry's display label and /images BMP
+# (named after the entry) are looked up by id.
+CATALOG = (
+    "3D_printer", "AI_chip", "Astrology", "Atom_science", "Backpack", "Baking",
+    "Baseball", "basketball", "Beehive", "Beer", "Bike", "Binoculars", "Book", "Bread",
+    "Calligraphy_pen", "Camera", "Camping_tent", "Cat", "Cheese", "Chef_hat", "chess",
+    "Climbing", "Cocktail", "Coffee_cup", "Coins", "Crystals", "Dice", "dna_helix",
+    "Dog", "Drone", "Drum_kit", "Dumbbell", "Fish", "Fishing_rod", "football",
+    "Fossil", "Globe", "Guitar", "Horse", "Journal", "lotus_flower", "Magic_wand",
+    "Microphone", "Movie_camera", "Mushroom", "Music_notes", "origami", "Paint_brush",
+    "phone", "Pi", "Piano_keys", "Pillow_sleeping", "Plane", "Playing_cards",
+    "Postage_stamp", "Potted_plant", "Pottery", "Puzzle_piece", "Rabbit", "Robot",
+    "Running_shoe", "Sail_boat", "Saxophone", "Sewing_needle_thread", "Shirt",
+    "Skateboard", "Skiing", "Snorkel", "Snowboarding", "Soccer", "Stock", "Surfing",
+    "Telescope", "Tennis_racket", "Test_tube", "Tools", "Video_game_controller",
+    "Vinyl_record", "Violin", "Wine", "Yarn_ball_needles",
+)
+
+# Wire width of the interest mask; leaves room to grow the catalog to 128.
+MASK_BYTES = 16
+
+
+def normalize_interest(text):
+    """Fold case, "_" / "-" and repeated spaces so spellings compare equal."""
+    value = (text or "").lower().replace("_", " ").replace("-", " ")
+    return " ".join(value.split())
+
+
+def _label(text):
+    words = [w for w in normalize_interest(text).split(" ") if w]
+    return " ".join(w[0].upper() + w[1:] for w in words)
+
+
+# Spelling -> index, built once at import: the normalized form of every entry
+# plus the spellings that actually travel (as listed, lower case, and the
+# display label), so those resolve with one dict lookup and no string work.
+_INDEX = {}
+_LABELS = []
+for _i, _name in enumerate(CATALOG):
+    _LABELS.append(_label(_name))
+    for _alias in (normalize_interest(_name), _name, _name.lower(), _LABELS[_i]):
+        _INDEX[_alias] = _i
+
+
+def interest_index(text):
+    """Return the catalog index for an interest, or None if off-catalog."""
+    idx = _INDEX.get(text)
+    if idx is None:
+        idx = _INDEX.get(normalize_interest(text))
+    return idx
+
+
+def catalog_name(index):
+    if 0 <= index < len(CATALOG):
+        return CATALOG[index]
+    return None
+
+
+def catalog_label(index):
+    """Display label of a catalog entry ("3D_printer" -> "3d Printer")."""
+    return _LABELS[index]
+
+
+def image_path(index):
+    """Path of the BMP for a catalog entry (it may not be on this badge)."""
+    return "/images/" + CATALOG[index] + ".bmp"
+
+
+def parse_ids(text):
+    """Catalog ids from a comma-separated list such as MY_INTEREST_IDS="20, 45"."""
+    ids = []
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            idx = int(part)
+        except ValueError:
+            continue
+        if 0 <= idx < len(CATALOG) and idx not in ids:
+            ids.append(idx)
+    return ids
+
+
+def encode_interests(interests):
+    """Split interests into (catalog bitmask, tuple of normalized off-catalog extras)."""
+    mask = 0
+    extras = []
+    for item in interests:
+        key = normalize_interest(item)
+        if not key:
+            continue
+        idx = _INDEX.get(key)
+        if idx is None:
+            if key not in extras:
+                extras.append(key)
+        else:
+            mask |= 1 << idx
+    return mask, tuple(extras)
+
+
+def names_from_mask(mask):
+    names = []
+    idx = 0
+    while mask:
+        if mask & 1:
+            name = catalog_name(idx)
+            if name:
+                names.append(name)
+        mask >>= 1
+        idx += 1
+    return names
+
+
+def popcount(value):
+    count = 0
+    while value:
+        value &= value - 1
+        count += 1
+    return count
+
+
+def mask_to_bytes(mask):
+    """Little-endian mask bytes with trailing zero bytes trimmed."""
+    out = bytearray()
+    while mask and len(out) < MASK_BYTES:
+        out.append(mask & 0xFF)
+        mask >>= 8
+    return bytes(out)
+
+
+def mask_from_bytes(buf):
+    mask = 0
+    shift = 0
+    for b in buf:
+        mask |= b << shift
+        shift += 8
+    return mask
+
+
+def match_counts(mask_a, extras_a, mask_b, extras_b):
+    """Return (shared, union) counts using mask AND/OR plus the string fallback."""
+    shared = popcount(mask_a & mask_b)
+    union = popcount(mask_a | mask_b)
+    if extras_a or extras_b:
+        common_extra = 0
+        for item in extras_a:
+            if item in extras_b:
+                common_extra += 1
+        shared += common_extra
+        union += len(extras_a) + len(extras_b) - common_extra
+    return shared, union
+
+
+def jaccard_pct(mask_a, extras_a, mask_b, extras_b):
+    shared, union = match_counts(mask_a, extras_a, mask_b, extras_b)
+    if union == 0:
+        return 0
+    return int((shared / union) * 100)
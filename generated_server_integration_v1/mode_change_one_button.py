@@ -1,5 +1,7 @@
 import time
 import os
+import gc
+import random
 import board
 import displayio
 import terminalio
@@ -10,6 +12,19 @@ import wifi
 import adafruit_imageload
 from adafruit_display_text import label
 import server_match_client
+import badge_frame
+import broadcast_scheduler
+import chat_link
+import crowd_meter
+import dedupe_cache
+import frag_transport
+import link_stats
+import mac_intern
+import peer_index
+import profile_cache
+import recent_peers
+import timer_wheel
+import interest_catalog
 
 # ---------------------------
 # Load settings.toml config
@@ -45,12 +60,62 @@ def _get_env_bool(key, default=True):
     return _get_env_int(key, d) != 0
 
 MY_NAME = _get_env_str("MY_NAME", "MagTag")
+# Optional contact line (handle, email, ...) for the contact card.
+MY_CONTACT = _get_env_str("MY_CONTACT", "")
 MY_INTERESTS = _get_env_str("MY_INTERESTS", "")
+# The same interests as a catalog bitmask + normalized extras, computed once:
+# broadcast in our profile and used by the local match fallback.
+MY_INTEREST_LIST = [p.strip() for p in MY_INTERESTS.split(",") if p.strip()][:12]
+MY_INTEREST_MASK, MY_INTEREST_EXTRAS = interest_catalog.encode_interests(MY_INTEREST_LIST)
 ESPNOW_CHANNEL = _get_env_int("ESPNOW_CHANNEL", 6)
 ESPNOW_PEER_CHANNEL = _get_env_int("ESPNOW_PEER_CHANNEL", 0)
+# Badges we chatted with are not auto-rematched: up to RECENT_PEERS_SIZE of
+# them, each forgotten RECENT_PEERS_TTL seconds (of badge uptime) after the
+# last chat. The list is rewritten on flash at most every RECENT_PEERS_WRITE_GAP s.
+RECENT_CHAT_PEERS_FILE = "/recent_chat_peers.bin"
+RECENT_PEERS_SIZE = max(4, _get_env_int("RECENT_PEERS_SIZE", 64))
+RECENT_PEERS_TTL = max(60, _get_env_int("RECENT_PEERS_TTL", 86400))
+RECENT_PEERS_WRITE_GAP = max(1, _get_env_int("RECENT_PEERS_WRITE_GAP", 30))
+# Match alerts and new-peer flashes fire once per badge, and again if it is
+# met ALERT_DEDUPE_TTL seconds later; ALERT_DEDUPE_SIZE badges are remembered.
+ALERT_DEDUPE_SIZE = max(4, _get_env_int("ALERT_DEDUPE_SIZE", 64))
+ALERT_DEDUPE_TTL = max(10, _get_env_int("ALERT_DEDUPE_TTL", 1800))
+# Older text list, imported once when RECENT_CHAT_PEERS_FILE does not exist.
 RECENT_CHAT_PEERS_TOML = "/recent_chat_peers.toml"
 RECENT_CHAT_PEERS_KEY = "RECENT_CHATTED_MACS"
 DEBUG_ESPNOW = (_get_env_int("DEBUG_ESPNOW", 0) != 0)
+# Send legacy "|"-joined text frames instead of binary ones (for older fleets).
+ESPNOW_TEXT_FRAMES = (_get_env_int("ESPNOW_TEXT_FRAMES", 0) != 0)
+# Send full state only on change (plus a slow refresh) and heartbeats otherwise.
+ESPNOW_DELTA_FRAMES = (_get_env_int("ESPNOW_DELTA_FRAMES", 1) != 0)
+# Broadcast a presence frame with a profile hash instead of name/interests;
+# receivers fetch the profile once by unicast. Off by default: code.py and
+# full_pipeline.py read only full state frames and cannot answer profile
+# requests, so set 1 only for fleets without them.
+ESPNOW_PULL_PROFILES = (_get_env_int("ESPNOW_PULL_PROFILES", 0) != 0)
+# Most peers tracked at once. When the table is full, a newcomer takes the
+# slot of the least valuable peer (stale, weak, not a match) or is ignored.
+PEER_TABLE_SIZE = max(4, _get_env_int("PEER_TABLE_SIZE", 32))
+# Crowd-scale mode: once more than CROWD_MODE_PEERS badges are heard within
+# PEER_TIMEOUT, a newcomer that cannot outrank the weakest tracked peer is
+# dropped before its frame is decoded, and the rest of the room is only counted.
+CROWD_MODE_PEERS = max(4, _get_env_int("CROWD_MODE_PEERS", PEER_TABLE_SIZE))
+# In crowd mode only this many of the most valuable peers are reported to the
+# match server (observations and /v1/match queries).
+CROWD_SERVER_PEERS = max(1, _get_env_int("CROWD_SERVER_PEERS", 8))
+# Local match fallback: while the match server is off or down, peers are
+# matched on the interests they broadcast, at most LOCAL_MATCH_PER_TICK of
+# them per loop pass. A server answer replaces the local decision.
+LOCAL_MATCH_ENABLE = _get_env_int("MATCH_LOCAL_FALLBACK", 1) != 0
+LOCAL_MATCH_PER_TICK = max(1, _get_env_int("LOCAL_MATCH_PER_TICK", 2))
+# The server counts as down after this many transient errors in a row, or
+# after MATCH_SERVER_DOWN_S seconds without a successful call. The next
+# successful call brings it back.
+MATCH_SERVER_DOWN_ERRORS = max(1, _get_env_int("MATCH_SERVER_DOWN_ERRORS", 3))
+MATCH_SERVER_DOWN_S = max(1, _get_env_int("MATCH_SERVER_DOWN_S", 30))
+# A server decision (yes or no) younger than this keeps a peer out of the
+# fallback; older answers and "no decision yet" are decided locally.
+MATCH_DECISION_TTL_S = max(1, _get_env_int("MATCH_DECISION_TTL_S", 120))
 
 
 MATCH_ENABLE_SERVER = _get_env_bool("MATCH_ENABLE_SERVER", True)
@@ -66,9 +131,23 @@ WIFI_PASSWORD = _get_env_str("CIRCUITPY_WIFI_PASSWORD", "")
 
 # Timing
 BROADCAST_INTERVAL = 2.0
+BROADCAST_MAX_INTERVAL = 5.0
+BROADCAST_REDUNDANCY = 3
+FULL_STATE_REFRESH = 10.0
 PEER_TIMEOUT = 15.0
+# Never stay silent long enough for neighbours to prune us.
+BROADCAST_MAX_SILENCE = PEER_TIMEOUT / 3
+# In CHAT, state goes unicast to the partner; the room only needs a presence beacon.
+CHAT_UNICAST_INTERVAL = 0.5
+CHAT_UNICAST_MAX_FAILS = 3
+BROADCAST_PRESENCE_INTERVAL = BROADCAST_MAX_INTERVAL
+# A contact card that could not be delivered is retried after this long, at
+# most CARD_MAX_ATTEMPTS sends per chat partner.
+CARD_RETRY_DELAY = 10.0
+CARD_MAX_ATTEMPTS = 3
+# Profiles of this many badges stay cached after they leave nearby_peers.
+PROFILE_CACHE_SIZE = 64
 DISPLAY_REFRESH = 5.0
-MAX_MSG_LEN = 250
 CHAT_HANDSHAKE_TIMEOUT = 30.0
 CHAT_PEER_EXIT_TIMEOUT = 10.0
 AUTO_CHAT_WINDOW = 60.0
@@ -115,6 +194,9 @@ broadcast_peer = espnow.Peer(mac=BROADCAST_MAC, channel=ESPNOW_PEER_CHANNEL)
 e.peers.append(broadcast_peer)
 
 my_mac = wifi.radio.mac_address
+# Cached once: the RX loop compares every packet against our own MAC.
+MY_MAC = bytes(my_mac)
+MY_MAC_HEX = MY_MAC.hex()
 MY_DEVICE_ID = server_match_client.make_device_id(my_mac)
 
 # -- State --
@@ -127,6 +209,59 @@ tx_attempts = 0
 tx_errors = 0
 rx_packets = 0
 parse_failures = 0
+tx_full_frames = 0
+tx_heartbeats = 0
+rx_cached_frames = 0
+rx_stale_heartbeats = 0
+rx_duplicates = 0
+rx_direct_frames = 0
+rx_alloc_bytes = 0
+rx_alloc_frames = 0
+# Heap bytes allocated per received frame (CircuitPython only).
+_mem_alloc = getattr(gc, "mem_alloc", None)
+
+# Delta broadcast state: the counter starts random so a rebooted badge
+# does not reuse the version a neighbour still has cached.
+state_version = random.randint(0, 255)
+last_state_frame = b""
+# Per-transmission sequence number so receivers can measure frame loss.
+tx_seq = random.randint(0, 255)
+last_full_broadcast = 0.0
+
+# Adaptive broadcast timing: BROADCAST_INTERVAL is the floor in a quiet room.
+scheduler = broadcast_scheduler.BroadcastScheduler(
+    BROADCAST_INTERVAL, BROADCAST_MAX_INTERVAL, BROADCAST_MAX_SILENCE,
+    redundancy=BROADCAST_REDUNDANCY,
+)
+# State version the room last heard in full (unicast may have sent it first).
+broadcast_state_ver = None
+
+# Unicast fast path to the chat partner (see _service_chat_link).
+partner_link = chat_link.ChatLink(
+    e, ESPNOW_PEER_CHANNEL, CHAT_UNICAST_INTERVAL, CHAT_UNICAST_MAX_FAILS
+)
+presence_beacon = False
+chat_state_dirty = False
+uc_fallbacks = 0
+
+# Contact cards go to the chat partner over the fragment transport, since a
+# full name, contact line and interest text do not fit one frame.
+MY_CARD = badge_frame.encode_card(MY_NAME, MY_CONTACT, MY_INTERESTS)
+card_transport = frag_transport.FragmentTransport(e)
+card_peer_mac = None
+card_fail_mark = 0
+card_retry_at = 0.0
+# Card sends started for card_attempts_mac (the current chat partner).
+card_attempts = 0
+card_attempts_mac = None
+
+# Pull-based profiles: room broadcasts carry MY_PROFILE_HASH and the name goes
+# out only to badges that ask for it (see _receive_profile_frame).
+MY_PROFILE_FRAME = badge_frame.encode_profile(MY_NAME[:20], MY_INTEREST_MASK, MY_INTEREST_EXTRAS)
+MY_PROFILE_HASH = badge_frame.profile_hash_of(MY_PROFILE_FRAME)
+profiles = profile_cache.ProfileCache(PROFILE_CACHE_SIZE)
+profile_exchange = profile_cache.ProfileExchange(e, ESPNOW_PEER_CHANNEL)
+
 match_rr_cursor = 0
 
 # Debug timing metrics (printed only when DEBUG_ESPNOW=1)
@@ -145,15 +280,66 @@ active_led_effect = None
 
 # Nearby peers
 nearby_peers = {}
-blocked_auto_rematch_peers = set()
-
-# Server state
-peer_server_state = {}
+# nearby_peers ranked best first by smoothed RSSI (display) and by link score
+# (closest-peer picks), kept current as frames arrive.
+peers_by_rssi = peer_index.RankedIndex()
+peers_by_link = peer_index.RankedIndex()
+# Server matches only, ranked by the server's confidence.
+peers_by_confidence = peer_index.RankedIndex()
+# Server rechecks a raw-RSSI delta would have triggered but the smoothed one did not.
+rssi_rechecks_saved = 0
+# Peer table: PEER_TABLE_SIZE records plus one scratch record a newcomer is
+# decoded into, all allocated at boot and reused in place.
+peer_record_pool = []
+peer_record_bytes = 0
+# Eviction value of a peer: its link score (dBm), minus this much per second
+# since it was last heard, plus a bonus if it is a match.
+PEER_STALE_PENALTY = 2.0
+PEER_MATCH_BONUS = 40.0
+peer_evictions = 0
+rx_table_full = 0
+# Badges in range beyond the table are only counted (crowd_meter.py).
+crowd = crowd_meter.CrowdMeter(time.monotonic(), window=PEER_TIMEOUT)
+crowd_mode = False
+# Lowest eviction value in a full table during crowd mode, else None;
+# refreshed once per receive_all().
+admit_floor = None
+rx_crowd_skipped = 0
+# Admitted peers (and chat partners) get a small int id (mac_intern.py); the
+# sets below are keyed by it and its hex string is built only once. Peer
+# records carry their own "id" and "mac_hex". Sized for everything that can
+# hold an id at once (peer records, recent peers, both alert caches); ids no
+# longer held are recycled.
+peer_ids = mac_intern.MacIntern(
+    capacity=PEER_TABLE_SIZE + RECENT_PEERS_SIZE + 2 * ALERT_DEDUPE_SIZE + 1,
+    in_use=lambda: _held_peer_ids(),
+)
+MY_PEER_ID = peer_ids.intern(MY_MAC)
+# Ids of peers we already chatted with (recent_peers.py).
+blocked_auto_rematch_peers = recent_peers.RecentPeers(
+    RECENT_CHAT_PEERS_FILE,
+    peer_ids,
+    size=RECENT_PEERS_SIZE,
+    ttl=RECENT_PEERS_TTL,
+    write_gap=RECENT_PEERS_WRITE_GAP,
+)
+
+# Server state (per-peer decisions live in each peer record's "server" dict)
 server_client = None
 server_enabled = False
 server_auth_failed = False
 next_observe_sync = 0.0
 self_interest_synced = False
+# Server health: transient errors in a row, time of the last successful call
+# and whether the local fallback has taken over (_note_server_*).
+server_error_streak = 0
+server_last_ok = 0.0
+server_down = False
+# Peers heard since the last local match pass; _local_match_step skips those
+# with unchanged interests or a fresh server decision.
+local_match_due = set()
+local_decisions = 0
+local_reused = 0
 
 # Chat state
 chat_peer_mac = None
@@ -165,11 +351,19 @@ chat_wait_peer_mac = None
 chat_wait_deadline = 0.0
 chat_peer_exit_deadline = 0.0
 
-# Auto-rematch state per peer (keyed by MAC hex).
-# window_deadline: live match window for case 2
-# cooldown_until: temporary block expiry for case 1 / case 2
-# had_chat_attempt: whether either side tried entering chat during the live window
-auto_rematch_state = {}
+# Auto-rematch state lives in each peer record:
+# rematch_window: live match window for case 2
+# rematch_cooldown: temporary block expiry for case 1 / case 2
+# rematch_attempt: whether either side tried entering chat during the live window
+
+# Every deadline the runtime waits on lives in one timer wheel (see
+# _service_timers): peer expiry keyed by MAC, rematch windows/cooldowns keyed
+# by (MAC, TIMER_REMATCH), and the chat handshake/exit timeouts by their kind.
+TIMER_PEER = 0
+TIMER_REMATCH = 1
+TIMER_CHAT_WAIT = 2
+TIMER_CHAT_EXIT = 3
+timers = timer_wheel.TimerWheel(time.monotonic())
 
 # Search-mode match LED latch state
 search_match_latched = False
@@ -178,78 +372,61 @@ search_match_peer_name = ""
 search_match_color = (0, 0, 0)
 search_match_topics = []
 search_match_icon_filename = ""
+# The best server match and the SEARCH latch are redone only after
+# _peers_changed() reported that one of their inputs moved: a peer added or
+# removed, a server match updated, a server decision, a block, a mode change.
+best_match_gate = peer_index.ChangeGate()
+search_latch_gate = peer_index.ChangeGate()
+best_server_match = None
 
 # -- Badge match alert state --
 RSSI_BADGE_THRESHOLD = -65
-seen_badge_devices = set()
+# Ids of peers whose match alert / new-peer flash was already shown.
+seen_badge_devices = dedupe_cache.DedupeCache(ALERT_DEDUPE_SIZE, ALERT_DEDUPE_TTL)
+flashed_new_peers = dedupe_cache.DedupeCache(ALERT_DEDUPE_SIZE, ALERT_DEDUPE_TTL)
+
+# (topic, server icon) -> image path or None, filled by _resolve_topic_image_path
+# so redraws do not os.stat() /images again.
+IMAGE_PATH_CACHE_SIZE = 16
+image_path_cache = {}
 
 # -------------------------
 # Helper functions
 # -------------------------
 def build_message():
-    interests_str = ""
     topic_str = ""
-    peer_mac_hex = ""
-    shared_flag = "0"
-    idx_str = "0"
-    ver_str = "0"
+    peer_mac = None
+    shared = False
+    idx = 0
+    ver = 0
 
     if current_mode == MODE_CHAT:
         if (not chat_force_empty_topic) and chat_common:
             topic_str = chat_common[chat_common_idx][:30]
         if isinstance(chat_peer_mac, (bytes, bytearray)):
-            peer_mac_hex = chat_peer_mac.hex()
-            if _peer_is_server_match(chat_peer_mac):
-                shared_flag = "1"
-        else:
-            peer_mac_hex = ""
-        idx_str = str(chat_common_idx)
-        ver_str = str(chat_idx_ver)
+            peer_mac = chat_peer_mac
+            shared = _peer_is_server_match(chat_peer_mac)
+        idx = chat_common_idx
+        ver = chat_idx_ver
     else:
-        target_peer = _pick_best_server_match_peer()
+        target_peer = _best_server_match_peer()
         if isinstance(target_peer, (bytes, bytearray)):
-            peer_mac_hex = target_peer.hex()
-            shared_flag = "1"
+            peer_mac = target_peer
+            shared = True
 
-    parts = [
-        str(current_mode),
+    encode = badge_frame.encode_text if ESPNOW_TEXT_FRAMES else badge_frame.encode_state
+    return encode(
+        current_mode,
         MY_NAME[:20],
-        interests_str,
-        topic_str,
-        peer_mac_hex,
-        shared_flag,
-        idx_str,
-        ver_str,
-    ]
-    msg = "|".join(parts)
-    return msg[:MAX_MSG_LEN]
-
-def parse_message(data):
-    try:
-        text = str(data, "utf-8")
-        parts = text.split("|")
-        while len(parts) < 8:
-            parts.append("")
-        mode = int(parts[0])
-        name = parts[1]
-        interests = [s.strip() for s in parts[2].split(",") if s.strip()]
-        topic = parts[3].strip()
-        peer_mac = bytes.fromhex(parts[4]) if parts[4] else None
-        shared_flag = (parts[5].strip() == "1")
-        common_idx = int(parts[6]) if parts[6] else 0
-        idx_ver = int(parts[7]) if parts[7] else 0
-        return {
-            "mode": mode,
-            "name": name,
-            "interests": interests,
-            "topic": topic,
-            "peer_mac": peer_mac,
-            "shared_flag": shared_flag,
-            "common_idx": common_idx,
-            "idx_ver": idx_ver,
-        }
-    except Exception:
-        return None
+        interest_mask=MY_INTEREST_MASK,
+        interest_extras=MY_INTEREST_EXTRAS,
+        topic=topic_str,
+        peer_mac=peer_mac,
+        shared=shared,
+        common_idx=idx,
+        idx_ver=ver,
+        state_ver=state_version,
+    )
 
 
 def _queue_led_effect(color, flashes=2, on_s=0.08, off_s=0.08):
@@ -360,88 +537,160 @@ def _normalize_mac_hex(text):
     return value
 
 
+def _mac_key(mac):
+    return mac if isinstance(mac, bytes) else bytes(mac)
+
+
+def _peer_id(mac):
+    """Interned id of a 6-byte MAC (assigned on first sight), or None."""
+    if not isinstance(mac, (bytes, bytearray)) or len(mac) != 6:
+        return None
+    return peer_ids.intern(_mac_key(mac))
+
+
+def _find_peer_id(mac):
+    """Id of a 6-byte MAC if it has one, else None (never assigns one)."""
+    if not isinstance(mac, (bytes, bytearray)) or len(mac) != 6:
+        return None
+    return peer_ids.find(_mac_key(mac))
+
+
 def _mac_bytes_to_hex(mac):
-    if isinstance(mac, (bytes, bytearray)) and len(mac) == 6:
-        return bytes(mac).hex()
-    return None
+    if not isinstance(mac, (bytes, bytearray)) or len(mac) != 6:
+        return None
+    pid = peer_ids.find(_mac_key(mac))
+    return peer_ids.hex(pid) if pid is not None else mac.hex()
+
+
+def _held_peer_ids():
+    """Ids something still refers to; peer_ids recycles the rest when full."""
+    held = {MY_PEER_ID}
+    for rec in nearby_peers.values():
+        held.add(rec["id"])
+    held.update(blocked_auto_rematch_peers)
+    held.update(seen_badge_devices)
+    held.update(flashed_new_peers)
+    return held
+
+
+def _is_blocked_peer_id(pid):
+    return pid != MY_PEER_ID and pid in blocked_auto_rematch_peers
 
 
 def _is_blocked_peer_mac(mac):
-    mac_hex = _mac_bytes_to_hex(mac)
-    if (not mac_hex) or (mac_hex == _mac_bytes_to_hex(my_mac)):
-        return False
-    return bytes.fromhex(mac_hex) in blocked_auto_rematch_peers
+    # Blocking always stores an id: a MAC without one is not blocked.
+    pid = _find_peer_id(mac)
+    return pid is not None and _is_blocked_peer_id(pid)
+
+
+def _rematch_active(rec):
+    return rec["rematch_window"] > 0.0 or rec["rematch_cooldown"] > 0.0
+
+
+def _clear_rematch_state(rec):
+    rec["rematch_window"] = 0.0
+    rec["rematch_cooldown"] = 0.0
+    rec["rematch_attempt"] = False
+
+
+def _expire_rematch_state(mac, now):
+    """A rematch window or cooldown in the timer wheel has run out."""
+    rec = nearby_peers.get(mac)
+    if rec is None or not _rematch_active(rec):
+        return
+    if rec["rematch_cooldown"] or rec["rematch_attempt"]:
+        _clear_rematch_state(rec)
+        return
+
+    # Case 2: shared match existed for 60s without a successful joint chat.
+    rec["rematch_window"] = 0.0
+    rec["rematch_cooldown"] = now + AUTO_RECONNECT_DELAY_EXTENDED
+    timers.schedule((mac, TIMER_REMATCH), rec["rematch_cooldown"], TIMER_REMATCH)
 
 
 def _track_match_window(mac, peer_info):
-    mac_hex = _mac_bytes_to_hex(mac)
-    my_hex = _mac_bytes_to_hex(my_mac)
-    if (not mac_hex) or (mac_hex == my_hex):
+    if mac == MY_MAC or _rematch_active(peer_info):
         return
-    if bytes.fromhex(mac_hex) in blocked_auto_rematch_peers:
+    if peer_info["id"] in blocked_auto_rematch_peers:
         return
     if not is_shared_interest_peer(peer_info):
         return
 
-    state = auto_rematch_state.get(mac_hex)
-    if state is None:
-        auto_rematch_state[mac_hex] = {
-            "window_deadline": time.monotonic() + AUTO_CHAT_WINDOW,
-            "cooldown_until": 0.0,
-            "had_chat_attempt": False,
-        }
+    deadline = time.monotonic() + AUTO_CHAT_WINDOW
+    peer_info["rematch_window"] = deadline
+    peer_info["rematch_cooldown"] = 0.0
+    peer_info["rematch_attempt"] = False
+    timers.schedule((mac, TIMER_REMATCH), deadline, TIMER_REMATCH)
 
 
 def _start_auto_rematch_block(mac, cooldown_seconds):
-    mac_hex = _mac_bytes_to_hex(mac)
-    my_hex = _mac_bytes_to_hex(my_mac)
-    if (not mac_hex) or (mac_hex == my_hex):
+    rec = nearby_peers.get(mac)
+    if rec is None or mac == MY_MAC:
         return
-    if bytes.fromhex(mac_hex) in blocked_auto_rematch_peers:
+    if rec["id"] in blocked_auto_rematch_peers:
         return
 
-    auto_rematch_state[mac_hex] = {
-        "window_deadline": 0.0,
-        "cooldown_until": time.monotonic() + cooldown_seconds,
-        "had_chat_attempt": True,
-    }
+    deadline = time.monotonic() + cooldown_seconds
+    rec["rematch_window"] = 0.0
+    rec["rematch_cooldown"] = deadline
+    rec["rematch_attempt"] = True
+    timers.schedule((mac, TIMER_REMATCH), deadline, TIMER_REMATCH)
+
+
+def _set_chat_wait_deadline(deadline):
+    """Arm (or with 0.0 disarm) the CHAT handshake timeout."""
+    global chat_wait_deadline
+    chat_wait_deadline = deadline
+    if deadline > 0.0:
+        timers.schedule(TIMER_CHAT_WAIT, deadline, TIMER_CHAT_WAIT)
+    else:
+        timers.cancel(TIMER_CHAT_WAIT)
+
+
+def _set_chat_peer_exit_deadline(deadline):
+    """Arm (or with 0.0 disarm) the partner-left-CHAT timeout."""
+    global chat_peer_exit_deadline
+    chat_peer_exit_deadline = deadline
+    if deadline > 0.0:
+        timers.schedule(TIMER_CHAT_EXIT, deadline, TIMER_CHAT_EXIT)
+    else:
+        timers.cancel(TIMER_CHAT_EXIT)
 
 
 def _mark_chat_handshake_success(mac):
-    mac_hex = _mac_bytes_to_hex(mac)
-    if not mac_hex:
+    pid = _peer_id(mac)
+    if pid is None:
         return
-    blocked_auto_rematch_peers.add(bytes.fromhex(mac_hex))
-    _save_recent_chat_peers(blocked_auto_rematch_peers)
-    if mac_hex in auto_rematch_state:
-        del auto_rematch_state[mac_hex]
+    # Called on every frame from the partner while both are in CHAT: the store
+    # batches its flash writes.
+    if blocked_auto_rematch_peers.add(pid, time.monotonic()):
+        _peers_changed()
+    rec = nearby_peers.get(mac)
+    if rec is not None and _rematch_active(rec):
+        _clear_rematch_state(rec)
+        timers.cancel((mac, TIMER_REMATCH))
 
 
 def _mark_chat_attempt(mac):
-    mac_hex = _mac_bytes_to_hex(mac)
-    my_hex = _mac_bytes_to_hex(my_mac)
-    if (not mac_hex) or (mac_hex == my_hex):
+    rec = nearby_peers.get(mac)
+    if rec is None or mac == MY_MAC:
         return
-    state = auto_rematch_state.get(mac_hex)
-    if state is None:
-        state = {
-            "window_deadline": time.monotonic() + AUTO_CHAT_WINDOW,
-            "cooldown_until": 0.0,
-            "had_chat_attempt": True,
-        }
-    else:
-        state["had_chat_attempt"] = True
-    auto_rematch_state[mac_hex] = state
+    if not _rematch_active(rec):
+        rec["rematch_window"] = time.monotonic() + AUTO_CHAT_WINDOW
+        timers.schedule((mac, TIMER_REMATCH), rec["rematch_window"], TIMER_REMATCH)
+    rec["rematch_attempt"] = True
 
 
 def _load_recent_chat_peers():
-    peers = set()
+    now = time.monotonic()
+    if blocked_auto_rematch_peers.load(now):
+        return
+    # No list in the current format yet: take over the old text one.
     try:
         with open(RECENT_CHAT_PEERS_TOML, "r") as fp:
             raw = fp.read()
     except OSError:
-        _save_recent_chat_peers(set())
-        return peers
+        return
 
     for raw_line in raw.splitlines():
         line = raw_line.strip()
@@ -458,29 +707,11 @@ def _load_recent_chat_peers():
         for item in value.split(","):
             normalized = _normalize_mac_hex(item)
             if normalized:
-                peers.add(bytes.fromhex(normalized))
+                blocked_auto_rematch_peers.add(peer_ids.intern(bytes.fromhex(normalized)), now)
         break
 
-    return peers
-
-
-def _save_recent_chat_peers(peers):
-    macs = []
-    for mac in peers:
-        mac_hex = _mac_bytes_to_hex(mac)
-        if mac_hex:
-            macs.append(mac_hex)
-    macs.sort()
-
-    data = '{}="{}"\n'.format(RECENT_CHAT_PEERS_KEY, ",".join(macs))
-    try:
-        with open(RECENT_CHAT_PEERS_TOML, "w") as fp:
-            fp.write(data)
-    except Exception as ex:
-        print("WARN: cannot write {}: {}".format(RECENT_CHAT_PEERS_TOML, ex))
-
 def _peer_confidence(mac):
-    state = _get_peer_server_state(mac, create=False) or {}
+    state = _peer_server_state(mac) or {}
     conf = state.get("confidence")
     if conf is None:
         return 0.0
@@ -527,7 +758,7 @@ def _topic_list_from_raw(raw):
 
 
 def _peer_server_topics(mac):
-    state = _get_peer_server_state(mac, create=False) or {}
+    state = _peer_server_state(mac) or {}
     single = _normalize_topic_token(state.get("topic"))
     if single:
         return [single]
@@ -578,43 +809,52 @@ def _topics_debug_str(topics):
 
 def _topic_source_for_peer(mac):
     if _peer_server_topics(mac):
-        return "server"
+        state = _peer_server_state(mac) or {}
+        # The local match fallback fills the same fields.
+        return "local" if state.get("source") == "local" else "server"
     if _peer_broadcast_topics(mac):
         return "peer"
     return "none"
 
 
-def _pick_best_server_match_peer(require_peer_targets_me=False):
-    best_mac = None
-    best_conf = -1.0
-    best_mac_hex = None
-    my_mac_bytes = bytes(my_mac)
+def _peers_changed():
+    """An input of the best match changed: redo it (and the SEARCH latch) on next use."""
+    best_match_gate.mark()
+    search_latch_gate.mark()
+
+
+def _peer_updated(mac):
+    """A nearby peer's state moved; only server matches can change the best match."""
+    if mac in peers_by_confidence:
+        _peers_changed()
+
+
+def _best_server_match_peer():
+    """_pick_best_server_match_peer(), redone only after _peers_changed()."""
+    global best_server_match
+    if best_match_gate.due():
+        best_server_match = _pick_best_server_match_peer()
+    return best_server_match
 
-    for mac, peer in nearby_peers.items():
-        if mac == my_mac_bytes:
+
+def _pick_best_server_match_peer(require_peer_targets_me=False):
+    # Highest confidence first; equal confidences go to the lower MAC.
+    for mac in peers_by_confidence:
+        if mac == MY_MAC:
             continue
         if _is_blocked_peer_mac(mac):
             continue
-        if not _peer_is_server_match(mac):
+        peer = nearby_peers.get(mac)
+        if peer is None:
             continue
         if require_peer_targets_me:
             if not peer.get("shared_flag"):
                 continue
-            if peer.get("peer_mac") != my_mac_bytes:
+            if peer.get("peer_mac") != MY_MAC:
                 continue
+        return mac
 
-        conf = _peer_confidence(mac)
-        mac_hex = _mac_bytes_to_hex(mac) or ""
-        if (
-            best_mac is None
-            or conf > best_conf
-            or (conf == best_conf and mac_hex < best_mac_hex)
-        ):
-            best_mac = mac
-            best_conf = conf
-            best_mac_hex = mac_hex
-
-    return best_mac
+    return None
 
 
 def _pair_led_color(mac_a, mac_b):
@@ -644,6 +884,14 @@ def _pair_led_color(mac_a, mac_b):
     return palette[h % len(palette)]
 
 
+def _peer_pair_color(mac):
+    """_pair_led_color(MY_MAC, mac), cached on the peer record while it is nearby."""
+    rec = nearby_peers.get(mac)
+    if rec is None:
+        return _pair_led_color(MY_MAC, mac)
+    return rec["pair_color"]
+
+
 def _safe_topic_chars(text):
     """CircuitPython-friendly sanitizer without str.isalnum()."""
     out = ""
@@ -669,6 +917,16 @@ def _topic_to_image_path(topic):
     if not raw:
         return None
 
+    idx = interest_catalog.interest_index(raw)
+    if idx is not None:
+        # Catalog topics: the BMP is named after the entry, one stat.
+        p = interest_catalog.image_path(idx)
+        try:
+            os.stat(p)
+            return p
+        except OSError:
+            pass
+
     names = []
     variants = (
         raw,
@@ -710,10 +968,16 @@ def _server_icon_to_image_path(icon_filename):
 
 
 def _resolve_topic_image_path(topic, icon_filename):
-    from_server = _server_icon_to_image_path(icon_filename)
-    if from_server:
-        return from_server
-    return _topic_to_image_path(topic)
+    key = (topic, icon_filename)
+    if key in image_path_cache:
+        return image_path_cache[key]
+    path = _server_icon_to_image_path(icon_filename)
+    if not path:
+        path = _topic_to_image_path(topic)
+    if len(image_path_cache) >= IMAGE_PATH_CACHE_SIZE:
+        image_path_cache.clear()
+    image_path_cache[key] = path
+    return path
 
 
 def _wrap_text_for_panel(text, max_chars=11, max_lines=3):
@@ -882,20 +1146,16 @@ def flash_alert(color, flashes=2, on_s=0.08, off_s=0.08):
 
 
 
-def check_badge_matches(packet_mac, peer_info):
-    global seen_badge_devices
-    if packet_mac == bytes(my_mac):
+def check_badge_matches(packet_mac, peer_info, now):
+    pid = peer_info["id"]
+    if pid == MY_PEER_ID:
         return
-    if _is_blocked_peer_mac(packet_mac):
+    if seen_badge_devices.seen(pid, now):
         return
-    if packet_mac in seen_badge_devices:
+    if _is_blocked_peer_id(pid):
         return
 
-    state = _get_peer_server_state(packet_mac, create=False)
-    if not state:
-        return
-    if not state.get("local_gate"):
-        return
+    state = peer_info["server"]
     if state.get("decision") is not True:
         return
 
@@ -916,10 +1176,11 @@ def check_badge_matches(packet_mac, peer_info):
     resolved_image = _resolve_topic_image_path(chosen_topic, icon_filename) if chosen_topic else None
     print(
         (
-            "ALERT! Server match with {}: conf={}%, rssi={} dBm, color={} "
+            "ALERT! {} match with {}: conf={}%, rssi={} dBm, color={} "
             "topic_src={} topic={} server_icon={} image={} "
             "server_topics={} peer_topics={}"
         ).format(
+            "Local" if state.get("source") == "local" else "Server",
             peer_info.get("name", ""),
             match_pct,
             rssi,
@@ -933,41 +1194,574 @@ def check_badge_matches(packet_mac, peer_info):
         )
     )
     flash_alert(color)
-    seen_badge_devices.add(packet_mac)
+    seen_badge_devices.add(pid, now)
 
 
 def is_shared_interest_peer(peer_info):
-    _ = peer_info
-    return True
+    return peer_info["server"]["decision"] is True
 # -------------------------
 # Broadcast / receive
 # -------------------------
-def do_broadcast():
-    global last_broadcast, tx_attempts, tx_errors
+def _refresh_state_frame(now):
+    """Rebuild our state frame; on change bump state_version and speed broadcasts up."""
+    global state_version, last_state_frame
     msg = build_message()
+    if msg != last_state_frame:
+        state_version = (state_version + 1) & 0xFF
+        msg = build_message()
+        last_state_frame = msg
+        scheduler.reset(now)
+    return msg
+
+
+def _next_broadcast_frame(now, allow_suppress=False):
+    """Return (frame, is_full) for this broadcast slot, or (None, False) if suppressed."""
+    global last_full_broadcast, broadcast_state_ver
+    msg = _refresh_state_frame(now)
+    if state_version != broadcast_state_ver:
+        # Local change the room has not heard yet: always send it in full.
+        broadcast_state_ver = state_version
+    elif allow_suppress and scheduler.should_suppress(now):
+        return None, False
+    elif (not ESPNOW_TEXT_FRAMES) and ESPNOW_DELTA_FRAMES and (now - last_full_broadcast < FULL_STATE_REFRESH):
+        return badge_frame.encode_heartbeat(state_version), False
+
+    last_full_broadcast = now
+    if ESPNOW_PULL_PROFILES and not ESPNOW_TEXT_FRAMES:
+        return badge_frame.as_presence(msg, MY_PROFILE_HASH), True
+    return msg, True
+
+
+def do_broadcast(scheduled=False):
+    global last_broadcast, tx_attempts, tx_errors, tx_full_frames, tx_heartbeats, tx_seq
+    now = time.monotonic()
+    msg, is_full = _next_broadcast_frame(now, allow_suppress=scheduled)
+    if msg is None:
+        return
+    if is_full:
+        tx_full_frames += 1
+    else:
+        tx_heartbeats += 1
     tx_attempts += 1
+    ok = True
     try:
-        e.send(bytes(msg, "utf-8"), broadcast_peer)
+        e.send(badge_frame.with_seq(msg, tx_seq), broadcast_peer)
     except Exception as ex:
+        ok = False
         tx_errors += 1
         if DEBUG_ESPNOW:
             print("ESPNOW TX error:", ex)
-    last_broadcast = time.monotonic()
+    tx_seq = (tx_seq + 1) & 0xFF
+    scheduler.note_tx(now, ok)
+    partner_link.note_broadcast()
+    profile_exchange.note_broadcast()
+    last_broadcast = now
 
 def flash_new_peer():
     _queue_led_effect((0, 80, 80), flashes=2, on_s=0.08, off_s=0.08)
+
+def _set_presence_beacon(enabled, now):
+    """Slow the room broadcast to a presence beacon while the partner is on unicast."""
+    global presence_beacon
+    if enabled == presence_beacon:
+        return
+    presence_beacon = enabled
+    if enabled:
+        scheduler.min_interval = BROADCAST_PRESENCE_INTERVAL
+    else:
+        scheduler.min_interval = BROADCAST_INTERVAL
+        scheduler.reset(now)
+
+
+def _partner_chats_with_us():
+    """True if chat_peer_mac's latest state says it is in CHAT with us."""
+    rec = nearby_peers.get(chat_peer_mac)
+    return rec is not None and rec["mode"] == MODE_CHAT and rec["peer_mac"] == MY_MAC
+
+
+def _service_chat_link(now):
+    """Keep the unicast link on chat_peer_mac and push chat state over it."""
+    global chat_state_dirty, uc_fallbacks
+    if ESPNOW_TEXT_FRAMES or current_mode != MODE_CHAT or not chat_peer_mac:
+        partner_link.close()
+        _set_presence_beacon(False, now)
+        return
+    if partner_link.mac != chat_peer_mac:
+        # ESP-NOW takes one registration per MAC; the chat link owns it now.
+        profile_exchange.release(chat_peer_mac)
+    if not partner_link.open(chat_peer_mac):
+        _set_presence_beacon(False, now)
+        return
+
+    partner_link.poll_ack()
+    # Any badge in range ACKs a unicast: only a partner whose state says it is
+    # chatting with us is listening, until then it is reached by broadcast.
+    listening = _partner_chats_with_us()
+    # A profile unicast still waiting for its ACK would resolve our send.
+    if listening and not profile_exchange.busy() and (chat_state_dirty or partner_link.due(now)):
+        if partner_link.send(_refresh_state_frame(now), now):
+            chat_state_dirty = False
+
+    link_up = listening and partner_link.is_up()
+    if presence_beacon and not link_up:
+        # Partner stopped ACKing or left the chat: back to room broadcasts.
+        uc_fallbacks += 1
+        _set_presence_beacon(False, now)
+        do_broadcast()
+    else:
+        _set_presence_beacon(link_up, now)
+
+
+def _service_contact_card(now):
+    """Send our contact card to the chat partner once its unicast link is up."""
+    global card_peer_mac, card_fail_mark, card_retry_at, card_attempts, card_attempts_mac
+    if card_peer_mac is not None and card_peer_mac != partner_link.mac:
+        # Chat ended or moved to another partner: drop the old transfer.
+        card_transport.cancel()
+        card_peer_mac = None
+        card_retry_at = 0.0
+    elif card_peer_mac is not None and card_transport.tx_failed != card_fail_mark:
+        card_peer_mac = None
+        card_retry_at = now + CARD_RETRY_DELAY
+    if card_attempts_mac != partner_link.mac:
+        card_attempts_mac = partner_link.mac
+        card_attempts = 0
+
+    # A partner that left the chat is not listening: no (re)send until it is back.
+    if (card_peer_mac is None and card_attempts < CARD_MAX_ATTEMPTS and now >= card_retry_at
+            and partner_link.is_up() and _partner_chats_with_us()):
+        card_fail_mark = card_transport.tx_failed
+        if card_transport.send(partner_link.peer, badge_frame.MSG_CARD, MY_CARD, now, reliable=True):
+            card_peer_mac = partner_link.mac
+            card_attempts += 1
+    if not partner_link.pending:
+        # Keep fragment ACKs out of the chat link's send_success/failure accounting.
+        card_transport.poll(now)
+
+
+def _service_profiles(now):
+    """Send queued profile requests and replies."""
+    if not partner_link.pending:
+        # Like card fragments, keep these ACKs out of the chat link's accounting.
+        profile_exchange.poll(now, partner_link.peer)
+
+
+def _reset_peer_server_state(state):
+    state["decision"] = None
+    state["confidence"] = None
+    state["source"] = None
+    state["topic"] = ""
+    state["topics"] = []
+    state["icon_filename"] = ""
+    state["eligible"] = None
+    state["reason"] = None
+    state["next_try"] = 0.0
+    state["last_error"] = ""
+    state["last_match_ts"] = 0.0
+    state["last_match_rssi"] = None
+    # last_match_ts of the answer whose raw-RSSI recheck smoothing skipped.
+    state["recheck_saved_ts"] = None
+    # Display row text, redone by _server_status_text after each server call.
+    state["status"] = "WAIT"
+    # (interest_mask, interest_extras) the last local decision was made from.
+    state["local_key"] = None
+    return state
+
+
+def _new_peer_record():
+    # One record per peer: radio state, server decision ("server") and
+    # auto-rematch fields, so a packet costs a single nearby_peers lookup.
+    return {
+        # Interned MAC id and its hex, plus the CHAT/SEARCH LED color of our
+        # pair; set when the record is given to a peer.
+        "id": None,
+        "mac_hex": "",
+        "pair_color": (0, 80, 80),
+        "name": "",
+        "mode": MODE_SEARCH,
+        "interest_mask": 0,
+        "interest_extras": (),
+        "topic": "",
+        "rssi": -100,
+        "last_seen": 0.0,
+        "peer_mac": None,
+        "shared_flag": False,
+        "common_idx": 0,
+        "idx_ver": 0,
+        "channel": 0,
+        "state_ver": None,
+        "profile_hash": None,
+        "profile_loaded": None,
+        "link": link_stats.LinkStats(),
+        "card": None,
+        "server": _reset_peer_server_state({}),
+        "rematch_window": 0.0,
+        "rematch_cooldown": 0.0,
+        "rematch_attempt": False,
+    }
+
+
+gc.collect()
+_pool_before = _mem_alloc() if _mem_alloc else 0
+for _ in range(PEER_TABLE_SIZE + 1):
+    peer_record_pool.append(_new_peer_record())
+if _mem_alloc:
+    peer_record_bytes = (_mem_alloc() - _pool_before) // (PEER_TABLE_SIZE + 1)
+print("Peer table: {} slots, {} bytes per peer".format(
+    PEER_TABLE_SIZE, peer_record_bytes if _mem_alloc else "?"
+))
+
+
+def _take_peer_record():
+    if peer_record_pool:
+        rec = peer_record_pool.pop()
+        rec["link"].reset()
+        rec["card"] = None
+        # Presence frames leave the profile fields alone: clear the last owner's.
+        rec["name"] = ""
+        rec["interest_mask"] = 0
+        rec["interest_extras"] = ()
+        rec["profile_loaded"] = None
+        rec["id"] = None
+        _reset_peer_server_state(rec["server"])
+        _clear_rematch_state(rec)
+        return rec
+    return _new_peer_record()
+
+
+def peer_link_stats(mac):
+    """LinkStats for a nearby peer (loss/dup/jitter/RSSI), or None."""
+    rec = nearby_peers.get(mac)
+    return rec["link"] if rec else None
+
+
+def peer_card(mac):
+    """Contact card {"name", "contact", "interests"} received from a peer, or None."""
+    rec = nearby_peers.get(mac)
+    return rec["card"] if rec else None
+
+
+def _peer_link_score(peer):
+    return peer["link"].link_score()
+
+
+def _print_link_stats():
+    for mac, rec in nearby_peers.items():
+        print("LINK {} {} {}".format(_mac_bytes_to_hex(mac), rec["name"], rec["link"].summary()))
+
+
+def _release_peer_record(rec):
+    if len(peer_record_pool) <= PEER_TABLE_SIZE:
+        peer_record_pool.append(rec)
+
+
+def _drop_peer(mac):
+    # The cached profile stays: a returning badge is not fetched again.
+    profile_exchange.forget(mac)
+    timers.cancel(mac)
+    peers_by_rssi.remove(mac)
+    peers_by_link.remove(mac)
+    peers_by_confidence.remove(mac)
+    timers.cancel((mac, TIMER_REMATCH))
+    local_match_due.discard(mac)
+    _release_peer_record(nearby_peers.pop(mac))
+    _peers_changed()
+
+
+def _peer_value(mac, rec, now):
+    """Eviction order for a full peer table: stale, weak and non-matching peers go first."""
+    if mac == chat_peer_mac or mac == chat_wait_peer_mac or mac == partner_link.mac:
+        return 1000.0
+    value = _peer_link_score(rec) - PEER_STALE_PENALTY * (now - rec["last_seen"])
+    if _peer_is_server_match(mac):
+        value += PEER_MATCH_BONUS
+    return value
+
+
+def _admit_peer(mac, rec, now):
+    """Make room for a newcomer; False if the table is full of peers worth more."""
+    global peer_evictions, rx_table_full
+    if len(nearby_peers) < PEER_TABLE_SIZE:
+        return True
+    victim = None
+    victim_value = 0.0
+    for key, peer in nearby_peers.items():
+        value = _peer_value(key, peer, now)
+        if victim is None or value < victim_value:
+            victim = key
+            victim_value = value
+    if victim_value >= _peer_value(mac, rec, now):
+        rx_table_full += 1
+        return False
+    peer_evictions += 1
+    _drop_peer(victim)
+    return True
+
+
+def _update_crowd_mode(now):
+    """Enter or leave crowd mode from the crowd estimate and refresh admit_floor."""
+    global crowd_mode, admit_floor
+    crowd.roll(now)
+    size = crowd.size()
+    if crowd_mode != (size > (CROWD_MODE_PEERS * 3 // 4 if crowd_mode else CROWD_MODE_PEERS)):
+        crowd_mode = not crowd_mode
+        print("CROWD mode {}: ~{} badges in range".format("on" if crowd_mode else "off", size))
+    admit_floor = None
+    if crowd_mode and len(nearby_peers) >= PEER_TABLE_SIZE:
+        for mac, rec in nearby_peers.items():
+            value = _peer_value(mac, rec, now)
+            if admit_floor is None or value < admit_floor:
+                admit_floor = value
+
+
+def _receive_transport_frame(mac, msg, now, rec):
+    """Feed a fragment/status frame to the card transport and keep finished cards."""
+    if rec is not None:
+        rec["last_seen"] = now
+    # Status reports can only go back over an open partner link.
+    reply_peer = partner_link.peer if mac == partner_link.mac else None
+    done = card_transport.receive(mac, msg, now, reply_peer)
+    if done is None or rec is None:
+        return
+    kind, payload = done
+    if kind == badge_frame.MSG_CARD:
+        rec["card"] = badge_frame.decode_card(payload)
+        if DEBUG_ESPNOW:
+            print("CARD from", _mac_bytes_to_hex(mac), rec["card"])
+
+
+def _apply_profile(rec, profile_hash, profile):
+    rec["name"], rec["interest_mask"], rec["interest_extras"] = profile
+    rec["profile_loaded"] = profile_hash
+
+
+def _note_full_profile(mac, rec):
+    """Cache the profile a full frame carried, so the owner's next presence
+    frame does not ask for it again."""
+    profile = (rec["name"], rec["interest_mask"], rec["interest_extras"])
+    profile_hash = badge_frame.profile_hash_of(badge_frame.encode_profile(*profile))
+    profiles.put(mac, profile_hash, profile)
+    profile_exchange.got(mac, profile_hash)
+    rec["profile_loaded"] = profile_hash
+
+
+def _load_profile(mac, rec, now, fetch=True):
+    """Fill a presence-only record from the cache, or (`fetch`) ask its owner for the profile."""
+    profile_hash = rec["profile_hash"]
+    if profile_hash is None or profile_hash == rec["profile_loaded"]:
+        return
+    profile = profiles.get(mac, profile_hash)
+    if profile is None:
+        if fetch:
+            profile_exchange.want(mac, profile_hash, now)
+    else:
+        _apply_profile(rec, profile_hash, profile)
+
+
+def _receive_profile_frame(mac, msg, now, rec):
+    """Answer profile requests and apply profiles we asked for; True if a record changed."""
+    global parse_failures
+    mac = _mac_key(mac)
+    if msg[2] == badge_frame.FRAME_PROFILE_REQ:
+        if len(msg) >= badge_frame.PROFILE_REQ_LEN and badge_frame.profile_hash_of(msg) == MY_PROFILE_HASH:
+            profile_exchange.reply(mac, MY_PROFILE_FRAME, now)
+        return False
+    info = badge_frame.decode_profile(msg)
+    if info is None:
+        parse_failures += 1
+        return False
+    profile_hash, profile = info
+    profiles.put(mac, profile_hash, profile)
+    profile_exchange.got(mac, profile_hash)
+    if rec is None or rec["profile_hash"] != profile_hash:
+        return False
+    _apply_profile(rec, profile_hash, profile)
+    rec["last_seen"] = now
+    local_match_due.add(mac)
+    _peer_updated(mac)
+    return True
+
+
+def _receive_packet(packet, now):
+    """Apply one packet to nearby_peers in place; return True if the display changed."""
+    global parse_failures, rx_cached_frames, rx_stale_heartbeats, rx_duplicates, last_full_broadcast
+    global rx_direct_frames, rx_crowd_skipped
+
+    mac_key = packet.mac
+    if mac_key == MY_MAC:
+        return False
+
+    msg = packet.msg
+    rec = nearby_peers.get(mac_key)
+    has_header = badge_frame.has_header(msg)
+    if badge_frame.is_transport_frame(msg):
+        # Fragments carry a msg_id and their own seq stream: no state or loss accounting.
+        _receive_transport_frame(mac_key, msg, now, rec)
+        return False
+    if badge_frame.is_profile_frame(msg):
+        # Unicast profile traffic: likewise outside the broadcast seq stream.
+        return _receive_profile_frame(mac_key, msg, now, rec)
+    seq = msg[badge_frame.SEQ_OFFSET] if has_header else None
+    if has_header and msg[2] == badge_frame.FRAME_DIRECT:
+        # Unicast from our chat partner: its seq is a separate stream.
+        rx_direct_frames += 1
+        if rec is not None:
+            rec["link"].add_rssi(packet.rssi)
+    elif rec is not None and not rec["link"].update(seq, now, packet.rssi):
+        # Same sequence number as the last frame: a duplicate copy.
+        rx_duplicates += 1
+        return False
+    # The first DIRECT frame after presence ones is decoded even with the same
+    # state_ver: its name and interests become the partner's profile.
+    if (rec is not None and has_header and msg[3] == rec["state_ver"]
+            and not (msg[2] == badge_frame.FRAME_DIRECT and rec["profile_hash"] is not None)):
+        # Sender state unchanged: keep the cached record, refresh liveness only.
+        rx_cached_frames += 1
+        scheduler.heard_consistent()
+        rec["rssi"] = rec["link"].rssi()
+        rec["last_seen"] = now
+        # Back in the fallback queue: its server decision may have gone stale.
+        local_match_due.add(mac_key)
+        _track_match_window(mac_key, rec)
+        if not _is_blocked_peer_id(rec["id"]):
+            check_badge_matches(mac_key, rec, now)
+        return False
+    if has_header and msg[2] == badge_frame.FRAME_HEARTBEAT:
+        # Version moved (or sender unknown): wait for its next full frame.
+        rx_stale_heartbeats += 1
+        if rec is not None:
+            rec["rssi"] = rec["link"].rssi()
+            rec["last_seen"] = now
+        return False
+
+    is_new = rec is None
+    if is_new:
+        if admit_floor is not None and packet.rssi <= admit_floor:
+            # Crowd mode: a newcomer (no server decision yet) is worth at most its RSSI,
+            # not enough to outrank the weakest tracked peer.
+            rx_crowd_skipped += 1
+            return False
+        rec = _take_peer_record()
+    else:
+        old_mode = rec["mode"]
+        old_name = rec["name"]
+        old_topic = rec["topic"]
+        old_peer_mac = rec["peer_mac"]
+        old_shared_flag = rec["shared_flag"]
+    if not badge_frame.decode_into(msg, rec):
+        parse_failures += 1
+        if is_new:
+            _release_peer_record(rec)
+        return False
+    rec["last_seen"] = now
+    if is_new:
+        mac_key = bytes(mac_key)
+        rec["link"].update(seq, now, packet.rssi)
+    rec["rssi"] = rec["link"].rssi()
+    if has_header and msg[2] == badge_frame.FRAME_DIRECT:
+        # The chat partner's full state carries its name and interests.
+        _note_full_profile(mac_key, rec)
+    # A newcomer asks for its profile only once it has a slot.
+    _load_profile(mac_key, rec, now, fetch=not is_new)
+    if is_new:
+        if not _admit_peer(mac_key, rec, now):
+            # Table full of peers worth more than this one: ignore it for now.
+            _release_peer_record(rec)
+            return False
+        # Only admitted peers get an id: the crowd beyond the table costs none.
+        rec["id"] = peer_ids.intern(mac_key)
+        rec["mac_hex"] = peer_ids.hex(rec["id"])
+        rec["pair_color"] = _pair_led_color(MY_MAC, mac_key)
+        nearby_peers[mac_key] = rec
+        _load_profile(mac_key, rec, now)
+        _peers_changed()
+    local_match_due.add(mac_key)
+
+    _track_match_window(mac_key, rec)
+    is_blocked_peer = _is_blocked_peer_id(rec["id"])
+
+    # --- badge match alert ---
+    if not is_blocked_peer:
+        check_badge_matches(mac_key, rec, now)
+
+    if is_new:
+        # A newcomer has none of our state: make the next slot a full frame.
+        last_full_broadcast = 0.0
+        if ((not is_blocked_peer) and _peer_is_server_match(mac_key) and
+                flashed_new_peers.first(rec["id"], now)):
+            flash_new_peer()
+        return True
+
+    _peer_updated(mac_key)
+    changed = (old_mode != rec["mode"] or
+               old_name != rec["name"] or
+               old_topic != rec["topic"] or
+               old_peer_mac != rec["peer_mac"] or
+               old_shared_flag != rec["shared_flag"])
+    # Peer timed out/exited CHAT that was targeting us:
+    # mirror cooldown on this badge so SEARCH match notice clears too.
+    if (old_mode == MODE_CHAT and
+            rec["mode"] == MODE_SEARCH and
+            old_peer_mac == MY_MAC):
+        _start_auto_rematch_block(mac_key, AUTO_RECONNECT_DELAY)
+        if current_mode == MODE_CHAT and chat_peer_mac == mac_key:
+            _set_chat_peer_exit_deadline(time.monotonic() + CHAT_PEER_EXIT_TIMEOUT)
+        changed = True
+    return changed
+
+
+def _service_timers(now):
+    """Handle every timer-wheel deadline that has passed; True if the mode changed."""
+    global display_dirty, chat_state_dirty
+    dropped = False
+    mode_changed = False
+    for key, kind in timers.expire(now):
+        if kind == TIMER_PEER:
+            rec = nearby_peers.get(key)
+            if rec is None:
+                continue
+            # Lossy links get extra grace: missing frames there are not a departure.
+            deadline = rec["last_seen"] + rec["link"].timeout(PEER_TIMEOUT)
+            if now < deadline:
+                # Its grace grew since the deadline was set.
+                timers.schedule(key, deadline, TIMER_PEER)
+                continue
+            _drop_peer(key)
+            dropped = True
+        elif kind == TIMER_REMATCH:
+            _expire_rematch_state(key[0], now)
+        elif kind == TIMER_CHAT_WAIT:
+            # CHAT handshake timeout:
+            # if peer never enters CHAT within 10s, return to SEARCH.
+            peer = nearby_peers.get(chat_wait_peer_mac) if chat_wait_peer_mac else None
+            if current_mode == MODE_CHAT and ((not peer) or (peer.get("mode") != MODE_CHAT)):
+                set_mode(MODE_SEARCH)
+                mode_changed = True
+            else:
+                _set_chat_wait_deadline(0.0)
+        elif kind == TIMER_CHAT_EXIT:
+            if current_mode == MODE_CHAT:
+                set_mode(MODE_SEARCH)
+                mode_changed = True
+    if dropped:
+        display_dirty = True
+        scheduler.reset(now)
+        chat_state_dirty = True
+    return mode_changed
+
 
 def receive_all(max_packets=RX_MAX_PACKETS_PER_TICK):
     global display_dirty, chat_peer_mac, chat_common, chat_common_idx, chat_idx_ver
     global search_match_latched, search_match_peer_mac, search_match_peer_name, search_match_color
     global search_match_topics, search_match_icon_filename
-    global chat_wait_peer_mac, chat_wait_deadline, chat_peer_exit_deadline
-    global rx_packets, parse_failures
+    global chat_wait_peer_mac
+    global rx_packets, rx_alloc_bytes, rx_alloc_frames, chat_state_dirty
 
     changed = False
     processed = 0
     now = time.monotonic()
 
+    _update_crowd_mode(now)
     while e:
         if max_packets and processed >= max_packets:
             break
@@ -976,62 +1770,23 @@ def receive_all(max_packets=RX_MAX_PACKETS_PER_TICK):
             break
         processed += 1
         rx_packets += 1
+        crowd.note(packet.mac)
 
-        info = parse_message(packet.msg)
-        if info is None:
-            parse_failures += 1
-            continue
-
-        mac_key = bytes(packet.mac)
-        if mac_key == bytes(my_mac):
-            continue
-
-        old = nearby_peers.get(mac_key)
-        nearby_peers[mac_key] = {
-            "name": info["name"],
-            "mode": info["mode"],
-            "interests": info["interests"],
-            "topic": info["topic"],
-            "rssi": packet.rssi,
-            "last_seen": now,
-            "peer_mac": info["peer_mac"],
-            "shared_flag": info["shared_flag"],
-            "common_idx": info["common_idx"],
-            "idx_ver": info["idx_ver"],
-        }
-        _track_match_window(mac_key, nearby_peers[mac_key])
-        is_blocked_peer = _is_blocked_peer_mac(mac_key)
-
-        # --- badge match alert ---
-        if not is_blocked_peer:
-            check_badge_matches(mac_key, nearby_peers[mac_key])
-
-        if old is None:
+        before = _mem_alloc() if _mem_alloc else 0
+        if _receive_packet(packet, now):
             changed = True
-            if (not is_blocked_peer) and _peer_is_server_match(mac_key):
-                flash_new_peer()
-        else:
-            if (old["mode"] != info["mode"] or
-                old["name"] != info["name"] or
-                old["topic"] != info["topic"] or
-                old.get("peer_mac") != info["peer_mac"] or
-                old.get("shared_flag") != info["shared_flag"]):
-                changed = True
-            # Peer timed out/exited CHAT that was targeting us:
-            # mirror cooldown on this badge so SEARCH match notice clears too.
-            if (old.get("mode") == MODE_CHAT and
-                    info["mode"] == MODE_SEARCH and
-                    old.get("peer_mac") == bytes(my_mac)):
-                _start_auto_rematch_block(mac_key, AUTO_RECONNECT_DELAY)
-                if current_mode == MODE_CHAT and chat_peer_mac == mac_key:
-                    chat_peer_exit_deadline = time.monotonic() + CHAT_PEER_EXIT_TIMEOUT
-                changed = True
-
-    # prune stale
-    stale = [k for k, v in nearby_peers.items() if now - v["last_seen"] > PEER_TIMEOUT]
-    for k in stale:
-        del nearby_peers[k]
-        changed = True
+        mac = _mac_key(packet.mac)
+        rec = nearby_peers.get(mac)
+        if rec is not None:
+            timers.schedule(mac, rec["last_seen"] + rec["link"].timeout(PEER_TIMEOUT), TIMER_PEER)
+            peers_by_rssi.update(mac, rec["rssi"])
+            peers_by_link.update(mac, _peer_link_score(rec))
+        if _mem_alloc:
+            used = _mem_alloc() - before
+            # A GC pass inside the frame makes the delta meaningless; skip it.
+            if used >= 0:
+                rx_alloc_bytes += used
+                rx_alloc_frames += 1
 
     if current_mode == MODE_CHAT:
         peer = nearby_peers.get(chat_peer_mac) if chat_peer_mac else None
@@ -1042,19 +1797,19 @@ def receive_all(max_packets=RX_MAX_PACKETS_PER_TICK):
                     _mark_chat_handshake_success(chat_peer_mac)
                     if (
                         chat_wait_peer_mac == chat_peer_mac and
-                        peer.get("peer_mac") == bytes(my_mac)
+                        peer.get("peer_mac") == MY_MAC
                     ):
-                        chat_wait_deadline = 0.0
-                    if chat_peer_exit_deadline > 0.0 and peer.get("peer_mac") == bytes(my_mac):
-                        chat_peer_exit_deadline = 0.0
+                        _set_chat_wait_deadline(0.0)
+                    if chat_peer_exit_deadline > 0.0 and peer.get("peer_mac") == MY_MAC:
+                        _set_chat_peer_exit_deadline(0.0)
 
-    else:
-        best_mac = _pick_best_server_match_peer()
+    elif search_latch_gate.due():
+        best_mac = _best_server_match_peer()
         if best_mac is not None:
             best_peer_name = nearby_peers.get(best_mac, {}).get("name", "")
-            new_color = _pair_led_color(bytes(my_mac), best_mac)
+            new_color = _peer_pair_color(best_mac)
             new_topics = _resolve_search_topics_for_peer(best_mac)
-            best_state = _get_peer_server_state(best_mac, create=False) or {}
+            best_state = _peer_server_state(best_mac) or {}
             new_icon_filename = _normalize_icon_filename(best_state.get("icon_filename"))
             if (not search_match_latched or
                     best_mac != search_match_peer_mac or
@@ -1081,21 +1836,21 @@ def receive_all(max_packets=RX_MAX_PACKETS_PER_TICK):
 
     if changed:
         display_dirty = True
+        # Neighbourhood or topic moved: go back to fast beacons (Trickle reset).
+        scheduler.reset(now)
+        chat_state_dirty = True
     return processed
 
 # -------------------------
 # Pick closest peer
 # -------------------------
 def pick_closest_peer(skip_blocked=False):
-    best_mac = None
-    best_rssi = -999
-    for mac, peer in nearby_peers.items():
+    """Peer with the best smoothed, loss-penalised RSSI."""
+    for mac in peers_by_link:
         if skip_blocked and _is_blocked_peer_mac(mac):
             continue
-        if peer["rssi"] > best_rssi:
-            best_mac = mac
-            best_rssi = peer["rssi"]
-    return best_mac
+        return mac
+    return None
 
 # -------------------------
 # Display / LEDs / Mode transitions
@@ -1121,7 +1876,7 @@ def update_leds(phase):
                 pixels.fill((0, 12, 0))
         else:
             if chat_peer_mac is not None and _peer_is_server_match(chat_peer_mac):
-                pixels.fill(_pair_led_color(bytes(my_mac), chat_peer_mac))
+                pixels.fill(_peer_pair_color(chat_peer_mac))
             else:
                 idx = (phase // 5) % 4
                 pixels.fill((5, 4, 0))
@@ -1139,6 +1894,9 @@ def rssi_bar(rssi):
 
 
 def _display_interest_text(text):
+    idx = interest_catalog.interest_index(text)
+    if idx is not None:
+        return interest_catalog.catalog_label(idx)
     value = (text or "").replace("_", " ").strip().lower()
     if not value:
         return ""
@@ -1315,7 +2073,7 @@ def render_display():
         if y <= (content_bottom - (18 if search_text_scale == 2 else 12)):
             g.append(label.Label(
                 terminalio.FONT,
-                text="Nearby: " + str(len(nearby_peers)),
+                text=("Nearby: ~" + str(crowd.size())) if crowd_mode else ("Nearby: " + str(len(nearby_peers))),
                 color=0x000000,
                 anchor_point=(0.0, 0.0),
                 anchored_position=(6, y),
@@ -1328,8 +2086,9 @@ def render_display():
             row_step = 17 if search_text_scale == 2 else 11
             room_rows = max(0, (content_bottom - y) // row_step)
             max_peers = min(max_peers, room_rows)
-            for mac, peer in sorted(nearby_peers.items(), key=lambda x: x[1]["rssi"], reverse=True)[:max_peers]:
-                status = _peer_status_text(mac)
+            for mac in peers_by_rssi.top(max_peers):
+                peer = nearby_peers[mac]
+                status = peer["server"]["status"]
                 line = "{} {} {}".format(
                     peer["name"][:8 if search_text_scale == 2 else 10],
                     status,
@@ -1361,7 +2120,7 @@ def render_display():
             peer_name = nearby_peers[chat_peer_mac]["name"][:16]
             peer_in_chat = (
                 nearby_peers[chat_peer_mac].get("mode") == MODE_CHAT and
-                nearby_peers[chat_peer_mac].get("peer_mac") == bytes(my_mac)
+                nearby_peers[chat_peer_mac].get("peer_mac") == MY_MAC
             )
 
         g.append(label.Label(
@@ -1380,7 +2139,7 @@ def render_display():
         image_drawn = False
         chat_icon_filename = ""
         if chat_peer_mac is not None:
-            chat_state = _get_peer_server_state(chat_peer_mac, create=False) or {}
+            chat_state = _peer_server_state(chat_peer_mac) or {}
             chat_icon_filename = chat_state.get("icon_filename") or ""
 
         if chat_topics:
@@ -1454,15 +2213,16 @@ def render_display():
 
 # -- Mode transitions --
 def set_mode(new_mode, force_closest=False, force_empty_topic=False):
-    global current_mode, display_dirty
+    global current_mode, display_dirty, chat_state_dirty
     global chat_peer_mac, chat_common, chat_common_idx, chat_idx_ver, chat_force_empty_topic
-    global chat_wait_peer_mac, chat_wait_deadline, chat_peer_exit_deadline
+    global chat_wait_peer_mac
     global search_match_latched, search_match_peer_mac, search_match_peer_name, search_match_color
     global search_match_topics, search_match_icon_filename
     global blocked_auto_rematch_peers
 
     if new_mode == current_mode:
         return
+    _peers_changed()
 
     if new_mode == MODE_CHAT:
         if force_closest:
@@ -1475,9 +2235,9 @@ def set_mode(new_mode, force_closest=False, force_empty_topic=False):
         if selected_peer is None:
             return
 
-        chat_wait_deadline = time.monotonic() + CHAT_HANDSHAKE_TIMEOUT
+        _set_chat_wait_deadline(time.monotonic() + CHAT_HANDSHAKE_TIMEOUT)
         chat_wait_peer_mac = selected_peer
-        chat_peer_exit_deadline = 0.0
+        _set_chat_peer_exit_deadline(0.0)
 
         search_match_latched = False
         search_match_peer_mac = None
@@ -1512,8 +2272,8 @@ def set_mode(new_mode, force_closest=False, force_empty_topic=False):
         chat_idx_ver = 0
         chat_force_empty_topic = False
         chat_wait_peer_mac = None
-        chat_wait_deadline = 0.0
-        chat_peer_exit_deadline = 0.0
+        _set_chat_wait_deadline(0.0)
+        _set_chat_peer_exit_deadline(0.0)
 
     current_mode = new_mode
 
@@ -1523,40 +2283,21 @@ def set_mode(new_mode, force_closest=False, force_empty_topic=False):
     pixels.fill(0)
 
     display_dirty = True
+    chat_state_dirty = True
     do_broadcast()
 
 
-blocked_auto_rematch_peers = _load_recent_chat_peers()
-
-
-def _new_peer_server_state():
-    return {
-        "local_gate": True,
-        "decision": None,
-        "confidence": None,
-        "source": None,
-        "topic": "",
-        "topics": [],
-        "icon_filename": "",
-        "eligible": None,
-        "reason": None,
-        "next_try": 0.0,
-        "last_error": "",
-        "last_match_ts": 0.0,
-        "last_match_rssi": None,
-    }
+_load_recent_chat_peers()
 
 
-def _get_peer_server_state(mac, create=True):
-    state = peer_server_state.get(mac)
-    if state is None and create:
-        state = _new_peer_server_state()
-        peer_server_state[mac] = state
-    return state
+def _peer_server_state(mac):
+    """Server-match state of a nearby peer, or None once it is gone."""
+    rec = nearby_peers.get(mac)
+    return rec["server"] if rec is not None else None
 
 
 def _peer_is_server_match(mac):
-    state = _get_peer_server_state(mac, create=False)
+    state = _peer_server_state(mac)
     if not state:
         return False
     return bool(state.get("decision") is True)
@@ -1575,10 +2316,7 @@ def _is_transient_server_error(code):
     return False
 
 
-def _peer_status_text(mac):
-    state = _get_peer_server_state(mac, create=False)
-    if not state:
-        return "WAIT"
+def _server_status_text(state):
     decision = state.get("decision")
     if decision is True:
         conf = state.get("confidence")
@@ -1591,17 +2329,6 @@ def _peer_status_text(mac):
     if err_code and (not _is_transient_server_error(err_code)):
         return "ERR"
     return "WAIT"
-
-
-def _sync_local_gate_cache():
-    active = set(nearby_peers.keys())
-    stale = [k for k in peer_server_state if k not in active]
-    for k in stale:
-        del peer_server_state[k]
-
-    for mac, _peer in nearby_peers.items():
-        state = _get_peer_server_state(mac, create=True)
-        state["local_gate"] = True
 
 
 def _ensure_wifi_connected():
@@ -1622,7 +2349,7 @@ def _ensure_wifi_connected():
 
 
 def _initialize_server_client(now):
-    global server_client, server_enabled, next_observe_sync
+    global server_client, server_enabled, next_observe_sync, server_last_ok
 
     if server_client is not None:
         return
@@ -1663,6 +2390,7 @@ def _initialize_server_client(now):
         )
         server_enabled = True
         next_observe_sync = now
+        server_last_ok = now
         _sync_self_interest()
         print("SERVER enabled base_url={} device_id={}".format(MATCH_SERVER_BASE_URL, MY_DEVICE_ID))
     except Exception as ex:
@@ -1679,6 +2407,29 @@ def _mark_server_error(result):
     return code
 
 
+def _note_server_ok(now):
+    global server_error_streak, server_last_ok, server_down
+    server_error_streak = 0
+    server_last_ok = now
+    if server_down:
+        server_down = False
+        print("SERVER reachable again: server answers replace local matches")
+
+
+def _note_server_failure(code, now):
+    """Count a failed call; enough transient ones in a row mark the server down."""
+    global server_error_streak, server_down
+    if not _is_transient_server_error(code):
+        # The server answered: not an outage.
+        return
+    server_error_streak += 1
+    if server_down:
+        return
+    if server_error_streak >= MATCH_SERVER_DOWN_ERRORS or now - server_last_ok >= MATCH_SERVER_DOWN_S:
+        server_down = True
+        print("SERVER down after {} errors: matching locally".format(server_error_streak))
+
+
 def _sync_self_interest():
     global self_interest_synced
 
@@ -1701,6 +2452,20 @@ def _sync_self_interest():
     self_interest_synced = True
 
 
+def _server_sync_peers(now):
+    """(mac, record) pairs to report to the server: every nearby peer, or in
+    crowd mode the CROWD_SERVER_PEERS most valuable ones (in MAC order, so the
+    /v1/match round robin stays stable).
+    """
+    items = list(nearby_peers.items())
+    if not crowd_mode or len(items) <= CROWD_SERVER_PEERS:
+        return items
+    items.sort(key=lambda item: _peer_value(item[0], item[1], now), reverse=True)
+    items = items[:CROWD_SERVER_PEERS]
+    items.sort(key=lambda item: item[0])
+    return items
+
+
 def _sync_server_observations(now):
     global next_observe_sync
 
@@ -1710,14 +2475,12 @@ def _sync_server_observations(now):
         return False
 
     observations = []
-    for mac, peer in nearby_peers.items():
-        state = _get_peer_server_state(mac, create=True)
+    for mac, peer in _server_sync_peers(now):
+        state = peer["server"]
         if state.get("decision") is False and now < float(state.get("next_try") or 0.0):
             continue
 
-        target_device_id = _mac_bytes_to_hex(mac)
-        if not target_device_id:
-            continue
+        target_device_id = peer["mac_hex"]
 
         observations.append(
             {
@@ -1735,16 +2498,19 @@ def _sync_server_observations(now):
     result = server_client.post_observe(MY_DEVICE_ID, observations)
     _record_server_call_duration(started)
     if result.get("ok"):
+        _note_server_ok(now)
         next_observe_sync = now + MATCH_OBSERVE_INTERVAL_S
         return True
 
     code = _mark_server_error(result)
+    _note_server_failure(code, now)
     next_observe_sync = now + MATCH_ERROR_BACKOFF_S
     print("SERVER observe failed code={}".format(code or "UNKNOWN"))
     return True
 
 
 def _peer_due_for_server_match(state, peer, now):
+    global rssi_rechecks_saved
     next_try = float(state.get("next_try") or 0.0)
     if now >= next_try:
         return True
@@ -1753,8 +2519,114 @@ def _peer_due_for_server_match(state, peer, now):
     if last_rssi is None:
         return False
 
+    # peer["rssi"] is smoothed: multipath flicker does not cost a /v1/match call.
     delta = abs(int(peer.get("rssi", -100)) - int(last_rssi))
-    return delta >= MATCH_RSSI_RECHECK_DELTA
+    if delta >= MATCH_RSSI_RECHECK_DELTA:
+        return True
+    if state["recheck_saved_ts"] != state["last_match_ts"]:
+        if abs(peer["link"].rssi_last - int(last_rssi)) >= MATCH_RSSI_RECHECK_DELTA:
+            # The raw reading would have asked again; count it once per answer.
+            state["recheck_saved_ts"] = state["last_match_ts"]
+            rssi_rechecks_saved += 1
+    return False
+
+
+def _match_decision_changed(mac, state, old_decision):
+    """Bookkeeping after a server or local answer updated a peer's state."""
+    if old_decision is True or state["decision"] is True:
+        _peers_changed()
+    if state["decision"] is True:
+        peers_by_confidence.update(mac, _peer_confidence(mac))
+    else:
+        peers_by_confidence.remove(mac)
+
+
+def _server_usable():
+    return server_enabled and (not server_auth_failed) and server_client is not None
+
+
+def _local_fallback_active():
+    """True while local matching stands in for the server: off, rejected or down."""
+    return LOCAL_MATCH_ENABLE and (server_down or not _server_usable())
+
+
+def _fresh_server_decision(state, now):
+    """True if the server said yes or no about this peer within MATCH_DECISION_TTL_S."""
+    if state["source"] == "local" or state["decision"] is None:
+        return False
+    return state["last_match_ts"] > 0.0 and now - state["last_match_ts"] < MATCH_DECISION_TTL_S
+
+
+def _build_local_interest_items(interests):
+    """(catalog bit, normalized extra, topic, icon file) per interest, in settings order."""
+    items = []
+    for item in interests:
+        idx = interest_catalog.interest_index(item)
+        if idx is None:
+            items.append((0, interest_catalog.normalize_interest(item), item, ""))
+        else:
+            items.append((
+                1 << idx, "", interest_catalog.catalog_label(idx), interest_catalog.catalog_name(idx) + ".bmp"
+            ))
+    return items
+
+
+LOCAL_INTEREST_ITEMS = _build_local_interest_items(MY_INTEREST_LIST)
+
+
+def _local_match(mac, peer):
+    """Decide a match from broadcast interests, in the server state schema (source "local")."""
+    global local_decisions, local_reused
+    state = peer["server"]
+    if peer["profile_hash"] is not None and peer["profile_loaded"] != peer["profile_hash"]:
+        # Interests not known yet: the profile reply queues the peer again.
+        return
+    key = (peer["interest_mask"], peer["interest_extras"])
+    if state["local_key"] == key:
+        local_reused += 1
+        return
+    local_decisions += 1
+    state["local_key"] = key
+    theirs_mask, theirs_extras = key
+    topic = ""
+    icon_filename = ""
+    for bit, extra, text, icon in LOCAL_INTEREST_ITEMS:
+        if (theirs_mask & bit) if bit else (extra in theirs_extras):
+            topic = text
+            icon_filename = icon
+            break
+    old_decision = state["decision"]
+    state["decision"] = bool(topic)
+    state["confidence"] = interest_catalog.jaccard_pct(
+        MY_INTEREST_MASK, MY_INTEREST_EXTRAS, theirs_mask, theirs_extras
+    ) / 100.0
+    state["source"] = "local"
+    state["topics"] = [topic] if topic else []
+    state["topic"] = topic
+    state["icon_filename"] = icon_filename
+    _match_decision_changed(mac, state, old_decision)
+    state["status"] = _server_status_text(state)
+    if old_decision != state["decision"]:
+        print("LOCAL_MATCH {} decision={} conf={} topic={}".format(
+            peer["mac_hex"], state["decision"], state["confidence"], topic or "-"
+        ))
+
+
+def _local_match_step(now, max_peers=LOCAL_MATCH_PER_TICK):
+    """Local decisions for up to `max_peers` queued peers while the fallback is active.
+
+    Peers with a fresh server decision keep it and leave the queue.
+    """
+    if not _local_fallback_active():
+        return
+    done = 0
+    while local_match_due and done < max_peers:
+        mac = local_match_due.pop()
+        peer = nearby_peers.get(mac)
+        if peer is None or _fresh_server_decision(peer["server"], now):
+            continue
+        _local_match(mac, peer)
+        done += 1
 
 
 def _sync_server_matches(now, max_calls=1):
@@ -1765,7 +2637,7 @@ def _sync_server_matches(now, max_calls=1):
     if max_calls <= 0:
         return 0
 
-    peer_items = list(nearby_peers.items())
+    peer_items = _server_sync_peers(now)
     if not peer_items:
         match_rr_cursor = 0
         return 0
@@ -1778,17 +2650,13 @@ def _sync_server_matches(now, max_calls=1):
     while checked < n and calls < max_calls:
         idx = (start_idx + checked) % n
         mac, peer = peer_items[idx]
-        state = _get_peer_server_state(mac, create=True)
+        state = peer["server"]
 
         if not _peer_due_for_server_match(state, peer, now):
             checked += 1
             continue
 
-        peer_device_id = _mac_bytes_to_hex(mac)
-        if not peer_device_id:
-            checked += 1
-            continue
-
+        peer_device_id = peer["mac_hex"]
         started = time.monotonic()
         result = server_client.post_match(
             MY_DEVICE_ID,
@@ -1799,6 +2667,7 @@ def _sync_server_matches(now, max_calls=1):
         match_rr_cursor = (idx + 1) % n
 
         if result.get("ok"):
+            _note_server_ok(now)
             data = result.get("data")
             if not isinstance(data, dict):
                 data = {}
@@ -1809,7 +2678,7 @@ def _sync_server_matches(now, max_calls=1):
 
             old_decision = state.get("decision")
             incoming_decision = data.get("decision")
-            if incoming_decision is None and old_decision is False:
+            if incoming_decision is None and old_decision is False and state["source"] != "local":
                 # Keep a confirmed NO sticky even when later requests are temporarily gated.
                 state["decision"] = False
             else:
@@ -1820,6 +2689,9 @@ def _sync_server_matches(now, max_calls=1):
                 state["topics"] = parsed_topics
                 state["topic"] = parsed_topics[0] if parsed_topics else ""
                 state["icon_filename"] = _normalize_icon_filename(data.get("icon_filename"))
+                # A later fallback decides this peer afresh.
+                state["local_key"] = None
+            _match_decision_changed(mac, state, old_decision)
             state["eligible"] = eligibility.get("eligible")
             state["reason"] = eligibility.get("reason")
             state["last_error"] = ""
@@ -1858,12 +2730,14 @@ def _sync_server_matches(now, max_calls=1):
                 )
         else:
             code = _mark_server_error(result)
+            _note_server_failure(code, now)
             if _is_transient_server_error(code):
                 state["last_error"] = ""
             else:
                 state["last_error"] = code or "UNKNOWN"
             state["next_try"] = now + MATCH_ERROR_BACKOFF_S
             print("SERVER match failed {} code={}".format(_mac_bytes_to_hex(mac), code or "UNKNOWN"))
+        state["status"] = _server_status_text(state)
 
         checked += 1
 
@@ -1878,7 +2752,7 @@ try:
         print(
             "ESPNOW cfg channel=", ESPNOW_CHANNEL,
             "peer_channel=", ESPNOW_PEER_CHANNEL,
-            "mac=", bytes(my_mac).hex()
+            "mac=", MY_MAC.hex()
         )
     _initialize_server_client(time.monotonic())
     render_display()
@@ -1894,21 +2768,24 @@ try:
         if handled_events > debug_button_events_max:
             debug_button_events_max = handled_events
 
-        # Periodic broadcast
-        if now - last_broadcast >= BROADCAST_INTERVAL:
-            do_broadcast()
+        # Periodic broadcast (adaptive, jittered, redundant beacons suppressed)
+        scheduler.peer_count = crowd.size() if crowd_mode else len(nearby_peers)
+        if scheduler.poll(now):
+            do_broadcast(scheduled=True)
 
         # Receive (bounded)
         rx_this_tick = receive_all(RX_MAX_PACKETS_PER_TICK)
         debug_rx_last_per_tick = rx_this_tick
         if rx_this_tick > debug_rx_max_per_tick:
             debug_rx_max_per_tick = rx_this_tick
+        _service_chat_link(now)
+        _service_contact_card(now)
+        _service_profiles(now)
 
         # LEDs first so HTTP timing has less impact on perceived blink cadence.
         update_leds(phase)
         phase = (phase + 1) % 200
 
-        _sync_local_gate_cache()
         network_ops = 0
         if network_ops < MAX_NETWORK_OPS_PER_TICK:
             if _sync_server_observations(now):
@@ -1916,24 +2793,15 @@ try:
         if network_ops < MAX_NETWORK_OPS_PER_TICK:
             network_ops += _sync_server_matches(now, max_calls=(MAX_NETWORK_OPS_PER_TICK - network_ops))
         debug_network_ops_last = network_ops
+        _local_match_step(now)
 
-        # CHAT handshake timeout:
-        # if peer never enters CHAT within 10s, return to SEARCH.
-        if current_mode == MODE_CHAT and chat_wait_deadline > 0.0:
-            if now >= chat_wait_deadline:
-                peer = nearby_peers.get(chat_wait_peer_mac) if chat_wait_peer_mac else None
-                if (
-                    (not peer)
-                    or (peer.get("mode") != MODE_CHAT)
-                ):
-                    set_mode(MODE_SEARCH)
-                    continue
-                chat_wait_deadline = 0.0
-
-        if current_mode == MODE_CHAT and chat_peer_exit_deadline > 0.0:
-            if now >= chat_peer_exit_deadline:
-                set_mode(MODE_SEARCH)
-                continue
+        # Recent-chat expiry and its batched flash writes.
+        if blocked_auto_rematch_peers.poll(now):
+            _peers_changed()
+
+        # Peer expiry, rematch windows and the CHAT handshake/exit timeouts.
+        if _service_timers(now):
+            continue
 
         if DEBUG_ESPNOW and (now - last_debug_log >= 5.0):
             channel_text = "?"
@@ -1946,10 +2814,13 @@ try:
                 debug_loop_max_ms = loop_elapsed_ms
             print(
                 (
-                    "DBG mode={} ch={} tx={} err={} rx={} parse_fail={} nearby={} "
+                    "DBG mode={} ch={} tx={} err={} rx={} parse_fail={} nearby={}/{} evicted={} table_full={} "
                     "blocked_active={} srv_en={} auth_fail={} btn_evt={} btn_evt_max={} "
                     "rx_tick={} rx_tick_max={} net_ops={} srv_ms_last={:.1f} "
-                    "srv_ms_max={:.1f} loop_ms_max={:.1f}"
+                    "srv_ms_max={:.1f} loop_ms_max={:.1f} tx_full={} tx_hb={} "
+                    "rx_cached={} rx_hb_stale={} rx_dup={} rx_direct={} uc_tx={} uc_ack={} "
+                    "uc_nack={} uc_fallback={} presence={} bcast_ivl={:.1f} bcast_suppressed={} "
+                    "bcast_resets={} rx_alloc_per_frame={}"
                 ).format(
                     MODE_NAMES[current_mode],
                     channel_text,
@@ -1958,7 +2829,10 @@ try:
                     rx_packets,
                     parse_failures,
                     len(nearby_peers),
-                    len(auto_rematch_state),
+                    PEER_TABLE_SIZE,
+                    peer_evictions,
+                    rx_table_full,
+                    sum(1 for rec in nearby_peers.values() if _rematch_active(rec)),
                     int(server_enabled),
                     int(server_auth_failed),
                     debug_button_events_last,
@@ -1969,8 +2843,45 @@ try:
                     debug_server_call_last_ms,
                     debug_server_call_max_ms,
                     debug_loop_max_ms,
+                    tx_full_frames,
+                    tx_heartbeats,
+                    rx_cached_frames,
+                    rx_stale_heartbeats,
+                    rx_duplicates,
+                    rx_direct_frames,
+                    partner_link.sent,
+                    partner_link.acked,
+                    partner_link.nacked,
+                    uc_fallbacks,
+                    int(presence_beacon),
+                    scheduler.interval,
+                    scheduler.suppressed,
+                    scheduler.resets,
+                    (rx_alloc_bytes // rx_alloc_frames) if rx_alloc_frames else "n/a",
                 )
             )
+            _print_link_stats()
+            print("FRAG " + card_transport.summary())
+            print("PROF cached={} hits={} misses={} {}".format(
+                len(profiles), profiles.hits, profiles.misses, profile_exchange.summary()
+            ))
+            print("RSSI rechecks_saved={}".format(rssi_rechecks_saved))
+            print("RECENT " + blocked_auto_rematch_peers.summary())
+            print("IDS used={}/{} recycled={} overflow={}".format(
+                len(peer_ids), peer_ids.capacity, peer_ids.recycled, peer_ids.overflow
+            ))
+            print("CROWD mode={} size={} frames={} skipped={} floor={}".format(
+                int(crowd_mode), crowd.size(), crowd.frames, rx_crowd_skipped,
+                "-" if admit_floor is None else int(admit_floor),
+            ))
+            print("LOCAL enabled={} server_down={} errors={} due={} decided={} reused={}".format(
+                int(_local_fallback_active()), int(server_down), server_error_streak,
+                len(local_match_due), local_decisions, local_reused,
+            ))
+            print("MATCH best_redone={} best_reused={} latch_redone={} latch_skipped={}".format(
+                best_match_gate.redone, best_match_gate.skipped,
+                search_latch_gate.redone, search_latch_gate.skipped,
+            ))
             last_debug_log = now
 
         # Refresh display (rate-limited)
@@ -1983,6 +2894,9 @@ try:
         time.sleep(LOOP_SLEEP_S)
 
 except Exception as ex:
+    partner_link.close()
+    profile_exchange.close()
+    blocked_auto_rematch_peers.flush(time.monotonic())
     # Blink NeoPixels red
     for _ in range(10):
         pixels.fill((255, 0, 0))
@@ -0,0 +1,176 @@
+# ---------------------------
+# Ranked peer index
+# ---------------------------
+# A nearby peer's RSSI, link score or match confidence only changes when one
+# of its frames (or a server answer about it) arrives, so instead of sorting
+# or scanning the whole peer table for every "closest" / "best" question the
+# runtime keeps a list of peers ordered best first and moves one entry each
+# time a score changes: a binary search plus a short list shift. Queries walk
+# from the front and normally stop at the first entry.
+#
+# StickyChoice adds hysteresis on top: a peer already picked keeps its place
+# until another one beats its score by a margin, so two peers a few dB apart
+# do not trade places on every frame.
+#
+# ChangeGate is the other half: state derived from the ranking (the best match,
+# the SEARCH latch) is redone only after the runtime reported that one of its
+# inputs changed, instead of on every tick.
+#
+# TopicIndex answers "who nearby has topic X": each peer is filed under its
+# (normalized) topics when its frame or profile changes them, so a query reads
+# one set and costs the peers that match, not the whole room. RankedIndex.ranked()
+# then puts those few in the ranking's order.
+
+
+class RankedIndex:
+    """MACs ordered by a numeric score, highest first; ties by ascending MAC."""
+
+    def __init__(self):
+        # Sorted ascending by (-score, mac), i.e. best first.
+        self.order = []
+        self.scores = {}
+
+    def _find(self, key):
+        lo = 0
+        hi = len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.order[mid] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def update(self, mac, score):
+        """Set the score of `mac`; False if it already had exactly that score."""
+        old = self.scores.get(mac)
+        if old == score:
+            return False
+        if old is not None:
+            del self.order[self._find((-old, mac))]
+        key = (-score, mac)
+        self.order.insert(self._find(key), key)
+        self.scores[mac] = score
+        return True
+
+    def remove(self, mac):
+        old = self.scores.get(mac)
+        if old is None:
+            return
+        del self.order[self._find((-old, mac))]
+        del self.scores[mac]
+
+    def score(self, mac):
+        return self.scores.get(mac)
+
+    def first(self):
+        return self.order[0][1] if self.order else None
+
+    def top(self, count):
+        return [key[1] for key in self.order[:count]]
+
+    def ranked(self, macs):
+        """The ranked ones among `macs`, best first."""
+        scores = self.scores
+        return sorted((mac for mac in macs if mac in scores), key=lambda mac: (-scores[mac], mac))
+
+    def __iter__(self):
+        # Best first. Do not update the index while walking it.
+        for key in self.order:
+            yield key[1]
+
+    def __contains__(self, mac):
+        return mac in self.scores
+
+    def __len__(self):
+        return len(self.order)
+
+
+class TopicIndex:
+    """Topic key -> set of MACs filed under it, updated one peer at a time."""
+
+    def __init__(self):
+        self.peers = {}
+        # mac -> tuple of the keys it is filed under
+        self.keys = {}
+
+    def set(self, mac, keys):
+        """File `mac` under exactly `keys` (a tuple); False if nothing moved."""
+        old = self.keys.get(mac, ())
+        if old == keys:
+            return False
+        for key in old:
+            if key not in keys:
+                macs = self.peers[key]
+                macs.discard(mac)
+                if not macs:
+                    del self.peers[key]
+        for key in keys:
+            if key not in old:
+                macs = self.peers.get(key)
+                if macs is None:
+                    macs = set()
+                    self.peers[key] = macs
+                macs.add(mac)
+        if keys:
+            self.keys[mac] = keys
+        else:
+            del self.keys[mac]
+        return True
+
+    def remove(self, mac):
+        self.set(mac, ())
+
+    def get(self, key):
+        """MACs filed under `key` (do not modify)."""
+        return self.peers.get(key, ())
+
+    def __len__(self):
+        return len(self.peers)
+
+
+class StickyChoice:
+    """Hysteresis for a "best peer" pick.
+
+    `held` counts the times the top-ranked peer changed while the pick stayed
+    put: each one is a switch (and the redraw or server call after it) saved.
+    """
+
+    def __init__(self, margin):
+        self.margin = margin
+        self.top = None
+        self.held = 0
+
+    def choose(self, best, best_score, current, current_score):
+        """Return `best`, or keep `current` while `best` leads it by no more than the margin.
+
+        `current_score` is None when the current pick is no longer eligible.
+        """
+        top_changed = best != self.top
+        self.top = best
+        if current_score is None or best == current or best_score > current_score + self.margin:
+            return best
+        if top_changed:
+            self.held += 1
+        return current
+
+
+class ChangeGate:
+    """Dirty flag for derived state, counting recomputations done and avoided."""
+
+    def __init__(self):
+        self.dirty = True
+        self.redone = 0
+        self.skipped = 0
+
+    def mark(self):
+        self.dirty = True
+
+    def due(self):
+        """True once after each mark(): the caller recomputes now."""
+        if self.dirty:
+            self.dirty = False
+            self.redone += 1
+            return True
+        self.skipped += 1
+        return False
@@ -0,0 +1,119 @@
+# ---------------------------
+# Per-peer link statistics
+# ---------------------------
+# Fed from every received frame: the sender's u8 sequence byte separates
+# lost and duplicated frames from a badge that simply went quiet, and RSSI /
+# arrival times give a smoothed link quality for pruning and peer selection.
+
+SEQ_MOD = 256
+# A forward jump this large means the sender restarted its counter: resync.
+SEQ_WINDOW = SEQ_MOD // 2
+# Dropping every frame costs this much in link_score().
+LOSS_PENALTY_DB = 20.0
+# Extra PEER_TIMEOUT grace at 100% loss: lossy links are not departures.
+LOSS_TIMEOUT_GRACE = 1.0
+# RSSI is smoothed in fixed point (1/RSSI_SCALE dB): each sample is the median
+# of the last three readings, folded into an EWMA of weight 1/RSSI_SMOOTHING.
+# One multipath spike then moves neither a peer's rank nor a threshold.
+RSSI_SCALE = 16
+RSSI_SMOOTHING = 8
+
+
+class LinkStats:
+    """Counters for one sender; reset() reuses the object for a new peer."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last_seq = None
+        self.received = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.last_arrival = 0.0
+        self.last_gap = 0.0
+        self.jitter = 0.0
+        self.rssi_min = 0
+        self.rssi_max = 0
+        # Smoothed RSSI * RSSI_SCALE; the last two raw readings feed the median.
+        self.rssi_fp = 0
+        self.rssi_last = 0
+        self.rssi_prev = 0
+        self.rssi_samples = 0
+        # Smoothed fraction of recent frames lost; drives timeout/link_score.
+        self.recent_loss = 0.0
+
+    def update(self, seq, now, rssi):
+        """Account one frame; return False if it repeats the last sequence number."""
+        if seq is not None and self.last_seq is not None:
+            step = (seq - self.last_seq) % SEQ_MOD
+            if step == 0:
+                self.duplicates += 1
+                return False
+            if step < SEQ_WINDOW:
+                self.lost += step - 1
+                self.recent_loss += (((step - 1) / step) - self.recent_loss) / 8.0
+        if seq is not None:
+            self.last_seq = seq
+
+        if self.received:
+            gap = now - self.last_arrival
+            if self.received > 1:
+                # RFC 3550 style: smoothed variation between arrival gaps.
+                self.jitter += (abs(gap - self.last_gap) - self.jitter) / 16.0
+            self.last_gap = gap
+        self.add_rssi(rssi)
+        self.last_arrival = now
+        self.received += 1
+        return True
+
+    def add_rssi(self, rssi):
+        """Fold one raw RSSI reading into the smoothed estimate."""
+        if not self.rssi_samples:
+            self.rssi_min = rssi
+            self.rssi_max = rssi
+            self.rssi_fp = rssi * RSSI_SCALE
+        else:
+            self.rssi_min = min(self.rssi_min, rssi)
+            self.rssi_max = max(self.rssi_max, rssi)
+            sample = rssi
+            if self.rssi_samples > 1:
+                a = self.rssi_prev
+                b = self.rssi_last
+                if a > b:
+                    a, b = b, a
+                sample = a if rssi < a else (b if rssi > b else rssi)
+            self.rssi_fp += (sample * RSSI_SCALE - self.rssi_fp) // RSSI_SMOOTHING
+        self.rssi_prev = self.rssi_last
+        self.rssi_last = rssi
+        self.rssi_samples += 1
+
+    def rssi(self):
+        """Smoothed RSSI in whole dBm."""
+        return (self.rssi_fp + RSSI_SCALE // 2) // RSSI_SCALE
+
+    def loss_ratio(self):
+        expected = self.received + self.lost
+        if expected == 0:
+            return 0.0
+        return self.lost / expected
+
+    def timeout(self, base):
+        """PEER_TIMEOUT for this peer, stretched while its link is dropping frames."""
+        return base * (1.0 + LOSS_TIMEOUT_GRACE * self.recent_loss)
+
+    def link_score(self):
+        """Smoothed RSSI in dBm, penalised by frame loss (higher is better)."""
+        return self.rssi_fp / RSSI_SCALE - LOSS_PENALTY_DB * self.recent_loss
+
+    def summary(self):
+        return "rx={} lost={} dup={} loss={}% jitter_ms={} rssi={}/{}/{}".format(
+            self.received,
+            self.lost,
+            self.duplicates,
+            int(self.loss_ratio() * 100),
+            int(self.jitter * 1000),
+            self.rssi_min,
+            self.rssi(),
+            self.rssi_max,
+        )
@@ -0,0 +1,76 @@
+# ---------------------------
+# MAC interning
+# ---------------------------
+# A badge gets a small integer id when it is admitted to the peer table, or
+# when a finished chat or a rematch block has to remember it; badges heard
+# beyond the table get none. Sets and tables that outlive a peer record
+# (blocked peers, shown alerts, rematch state) are keyed by that id, and the
+# MAC's hex form is built once here instead of on every log line, server call
+# or save.
+#
+# The table holds at most `capacity` MACs. When it is full, the ids nothing
+# refers to any more are recycled: `in_use()` (supplied by the runtime)
+# returns the ids still held by a peer record or one of those sets, and every
+# other id is forgotten and put on the free list. Only if all of them are
+# still held does the table grow past `capacity` (counted in `overflow`).
+
+
+class MacIntern:
+    """MAC bytes <-> small int id, plus the hex string of each MAC."""
+
+    def __init__(self, capacity=256, in_use=None):
+        self.capacity = capacity
+        self.in_use = in_use
+        self.ids = {}
+        self.macs = []
+        self.hexes = []
+        # Ids free to hand out again (their slots in macs/hexes are None).
+        self.free = []
+        self.recycled = 0
+        self.overflow = 0
+
+    def intern(self, mac):
+        """Id of `mac` (bytes), assigning a free one on first sight."""
+        pid = self.ids.get(mac)
+        if pid is not None:
+            return pid
+        if not self.free and len(self.macs) >= self.capacity:
+            self._collect()
+        if self.free:
+            pid = self.free.pop()
+            self.macs[pid] = mac
+            self.hexes[pid] = mac.hex()
+        else:
+            if len(self.macs) >= self.capacity:
+                self.overflow += 1
+            pid = len(self.macs)
+            self.macs.append(mac)
+            self.hexes.append(mac.hex())
+        self.ids[mac] = pid
+        return pid
+
+    def _collect(self):
+        if self.in_use is None:
+            return
+        held = self.in_use()
+        for pid in range(len(self.macs)):
+            mac = self.macs[pid]
+            if mac is not None and pid not in held:
+                del self.ids[mac]
+                self.macs[pid] = None
+                self.hexes[pid] = None
+                self.free.append(pid)
+                self.recycled += 1
+
+    def find(self, mac):
+        """Id of `mac`, or None if it is not interned."""
+        return self.ids.get(mac)
+
+    def mac(self, pid):
+        return self.macs[pid]
+
+    def hex(self, pid):
+        return self.hexes[pid]
+
+    def __len__(self):
+        return len(self.ids)
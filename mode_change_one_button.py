@@ -1,5 +1,8 @@
 import time
 import os
+import gc
+import math
+import random
 import board
 import displayio
 import terminalio
@@ -8,6 +11,20 @@ import digitalio
 import espnow
 import wifi
 from adafruit_display_text import label
+import badge_frame
+import broadcast_scheduler
+import channel_plan
+import chat_link
+import crowd_meter
+import dedupe_cache
+import frag_transport
+import link_stats
+import mac_intern
+import peer_index
+import profile_cache
+import recent_peers
+import timer_wheel
+import interest_catalog
 
 # ---------------------------
 # Load settings.toml config
@@ -27,6 +44,17 @@ def _get_env_int(key, default):
     except Exception:
         return default
 
+def _parse_channels(csv_text):
+    channels = []
+    for part in (csv_text or "").split(","):
+        try:
+            ch = int(part.strip())
+        except Exception:
+            continue
+        if 1 <= ch <= 13 and ch not in channels:
+            channels.append(ch)
+    return channels
+
 def _parse_interests(csv_text):
     if not csv_text:
         return []
@@ -34,18 +62,88 @@ def _parse_interests(csv_text):
     return [p for p in parts if p][:12]
 
 MY_NAME = _get_env_str("MY_NAME", "MagTag")
+# Optional contact line (handle, email, ...) for the contact card.
+MY_CONTACT = _get_env_str("MY_CONTACT", "")
 MY_INTERESTS = _parse_interests(_get_env_str("MY_INTERESTS", "python,circuitpython"))
+# Canonical catalog ids saved by the survey (user_survey.py). When set they
+# are our catalog interests; MY_INTERESTS then only adds off-catalog ones.
+MY_INTEREST_IDS = interest_catalog.parse_ids(_get_env_str("MY_INTEREST_IDS", ""))
+if MY_INTEREST_IDS:
+    MY_INTERESTS = [interest_catalog.catalog_name(idx) for idx in MY_INTEREST_IDS] + [
+        item for item in MY_INTERESTS if interest_catalog.interest_index(item) is None
+    ]
+# Catalog bitmask + normalized off-catalog extras, computed once at boot.
+MY_INTEREST_MASK, MY_INTEREST_EXTRAS = interest_catalog.encode_interests(MY_INTERESTS)
+# Match score: "jaccard" (shared share of both interest lists) or "idf", which
+# scales that by how rare the shared interests are among nearby peers, so an
+# interest the whole room shares (the "python" at a Python meetup) counts for
+# little in the alert color, the display % and the SEARCH topic.
+MATCH_SCORING_IDF = _get_env_str("MATCH_SCORING", "jaccard").strip().lower() == "idf"
 ESPNOW_CHANNEL = _get_env_int("ESPNOW_CHANNEL", 6)
 ESPNOW_PEER_CHANNEL = _get_env_int("ESPNOW_PEER_CHANNEL", 0)
+# Data channels for large venues, e.g. "1,6,11": badges hash onto one and meet
+# on ESPNOW_CHANNEL (the rendezvous channel). Empty keeps everyone on
+# ESPNOW_CHANNEL. Needs ESPNOW_PEER_CHANNEL=0 so peers follow the radio.
+ESPNOW_DATA_CHANNELS = _parse_channels(_get_env_str("ESPNOW_DATA_CHANNELS", ""))
+# Badges we chatted with are not auto-rematched: up to RECENT_PEERS_SIZE of
+# them, each forgotten RECENT_PEERS_TTL seconds (of badge uptime) after the
+# last chat. The list is rewritten on flash at most every RECENT_PEERS_WRITE_GAP s.
+RECENT_CHAT_PEERS_FILE = "/recent_chat_peers.bin"
+RECENT_PEERS_SIZE = max(4, _get_env_int("RECENT_PEERS_SIZE", 64))
+RECENT_PEERS_TTL = max(60, _get_env_int("RECENT_PEERS_TTL", 86400))
+RECENT_PEERS_WRITE_GAP = max(1, _get_env_int("RECENT_PEERS_WRITE_GAP", 30))
+# Match alerts and new-peer flashes fire once per badge, and again if it is
+# met ALERT_DEDUPE_TTL seconds later; ALERT_DEDUPE_SIZE badges are remembered.
+ALERT_DEDUPE_SIZE = max(4, _get_env_int("ALERT_DEDUPE_SIZE", 64))
+ALERT_DEDUPE_TTL = max(10, _get_env_int("ALERT_DEDUPE_TTL", 1800))
+# Older text list, imported once when RECENT_CHAT_PEERS_FILE does not exist.
 RECENT_CHAT_PEERS_TOML = "/recent_chat_peers.toml"
 RECENT_CHAT_PEERS_KEY = "RECENT_CHATTED_MACS"
 DEBUG_ESPNOW = (_get_env_int("DEBUG_ESPNOW", 0) != 0)
+# Send legacy "|"-joined text frames instead of binary ones (for older fleets).
+ESPNOW_TEXT_FRAMES = (_get_env_int("ESPNOW_TEXT_FRAMES", 0) != 0)
+# Send full state only on change (plus a slow refresh) and heartbeats otherwise.
+ESPNOW_DELTA_FRAMES = (_get_env_int("ESPNOW_DELTA_FRAMES", 1) != 0)
+# Broadcast a presence frame with a profile hash instead of name/interests;
+# receivers fetch the profile once by unicast. Off by default: code.py and
+# full_pipeline.py read only full state frames and cannot answer profile
+# requests, so set 1 only for fleets without them.
+ESPNOW_PULL_PROFILES = (_get_env_int("ESPNOW_PULL_PROFILES", 0) != 0)
+# Most peers tracked at once. When the table is full, a newcomer takes the
+# slot of the least valuable peer (stale, weak, not a match) or is ignored.
+PEER_TABLE_SIZE = max(4, _get_env_int("PEER_TABLE_SIZE", 32))
+# Crowd-scale mode: once more than CROWD_MODE_PEERS badges are heard within
+# PEER_TIMEOUT, a newcomer that cannot outrank the weakest tracked peer is
+# dropped before its frame is decoded, and the rest of the room is only counted.
+CROWD_MODE_PEERS = max(4, _get_env_int("CROWD_MODE_PEERS", PEER_TABLE_SIZE))
+# Decisions use each peer's smoothed RSSI (link_stats), and a peer already
+# picked is only replaced by one whose link score is this many dB better.
+RSSI_HYSTERESIS_DB = max(0, _get_env_int("RSSI_HYSTERESIS_DB", 4))
 
 # Timing
 BROADCAST_INTERVAL = 2.0
+BROADCAST_MAX_INTERVAL = 5.0
+BROADCAST_REDUNDANCY = 3
+FULL_STATE_REFRESH = 10.0
 PEER_TIMEOUT = 15.0
+# Never stay silent long enough for neighbours to prune us.
+BROADCAST_MAX_SILENCE = PEER_TIMEOUT / 3
+# In CHAT, state goes unicast to the partner; the room only needs a presence beacon.
+CHAT_UNICAST_INTERVAL = 0.5
+CHAT_UNICAST_MAX_FAILS = 3
+BROADCAST_PRESENCE_INTERVAL = BROADCAST_MAX_INTERVAL
+# A contact card that could not be delivered is retried after this long, at
+# most CARD_MAX_ATTEMPTS sends per chat partner.
+CARD_RETRY_DELAY = 10.0
+CARD_MAX_ATTEMPTS = 3
+# Profiles of this many badges stay cached after they leave nearby_peers.
+PROFILE_CACHE_SIZE = 64
+# Channel plan: how often and how long badges visit the rendezvous channel.
+RENDEZVOUS_PERIOD = 10.0
+RENDEZVOUS_DWELL = 2.0
+# Peers homed on another data channel are only heard at rendezvous.
+CROSS_CHANNEL_GRACE = 2 * RENDEZVOUS_PERIOD
 DISPLAY_REFRESH = 5.0
-MAX_MSG_LEN = 250
 CHAT_HANDSHAKE_TIMEOUT = 30.0
 CHAT_PEER_EXIT_TIMEOUT = 10.0
 AUTO_CHAT_WINDOW = 60.0
@@ -92,9 +190,13 @@ def button_held(btn_index, hold_seconds):
     return False
 
 # -- ESP-NOW setup --
+def _set_radio_channel(channel):
+    # Starting and stopping an AP is how the radio gets retuned for ESP-NOW.
+    wifi.radio.start_ap(" ", "", channel=channel, max_connections=0)
+    wifi.radio.stop_ap()
+
 wifi.radio.enabled = True
-wifi.radio.start_ap(" ", "", channel=ESPNOW_CHANNEL, max_connections=0)
-wifi.radio.stop_ap()
+_set_radio_channel(ESPNOW_CHANNEL)
 
 BROADCAST_MAC = b"\xff\xff\xff\xff\xff\xff"
 e = espnow.ESPNow(buffer_size=1024)
@@ -102,6 +204,8 @@ broadcast_peer = espnow.Peer(mac=BROADCAST_MAC, channel=ESPNOW_PEER_CHANNEL)
 e.peers.append(broadcast_peer)
 
 my_mac = wifi.radio.mac_address
+# Cached once: the RX loop compares every packet against our own MAC.
+MY_MAC = bytes(my_mac)
 
 # -- State --
 current_mode = MODE_SEARCH
@@ -113,10 +217,117 @@ tx_attempts = 0
 tx_errors = 0
 rx_packets = 0
 parse_failures = 0
+tx_full_frames = 0
+tx_heartbeats = 0
+rx_cached_frames = 0
+rx_stale_heartbeats = 0
+rx_duplicates = 0
+rx_direct_frames = 0
+rx_alloc_bytes = 0
+rx_alloc_frames = 0
+# Heap bytes allocated per received frame (CircuitPython only).
+_mem_alloc = getattr(gc, "mem_alloc", None)
+
+# Delta broadcast state: the counter starts random so a rebooted badge
+# does not reuse the version a neighbour still has cached.
+state_version = random.randint(0, 255)
+last_state_frame = b""
+# Per-transmission sequence number so receivers can measure frame loss.
+tx_seq = random.randint(0, 255)
+last_full_broadcast = 0.0
+
+# Adaptive broadcast timing: BROADCAST_INTERVAL is the floor in a quiet room.
+scheduler = broadcast_scheduler.BroadcastScheduler(
+    BROADCAST_INTERVAL, BROADCAST_MAX_INTERVAL, BROADCAST_MAX_SILENCE,
+    redundancy=BROADCAST_REDUNDANCY,
+)
+# State version the room last heard in full (unicast may have sent it first).
+broadcast_state_ver = None
+
+# Unicast fast path to the chat partner (see _service_chat_link).
+partner_link = chat_link.ChatLink(
+    e, ESPNOW_PEER_CHANNEL, CHAT_UNICAST_INTERVAL, CHAT_UNICAST_MAX_FAILS
+)
+presence_beacon = False
+chat_state_dirty = False
+uc_fallbacks = 0
+
+# Contact cards go to the chat partner over the fragment transport, since a
+# full name, contact line and interest text do not fit one frame.
+MY_CARD = badge_frame.encode_card(MY_NAME, MY_CONTACT, ",".join(MY_INTERESTS))
+card_transport = frag_transport.FragmentTransport(e)
+card_peer_mac = None
+card_fail_mark = 0
+card_retry_at = 0.0
+# Card sends started for card_attempts_mac (the current chat partner).
+card_attempts = 0
+card_attempts_mac = None
+
+# Pull-based profiles: room broadcasts carry MY_PROFILE_HASH and name/interests
+# go out only to badges that ask for them (see _receive_profile_frame).
+MY_PROFILE_FRAME = badge_frame.encode_profile(MY_NAME[:20], MY_INTEREST_MASK, MY_INTEREST_EXTRAS)
+MY_PROFILE_HASH = badge_frame.profile_hash_of(MY_PROFILE_FRAME)
+profiles = profile_cache.ProfileCache(PROFILE_CACHE_SIZE)
+profile_exchange = profile_cache.ProfileExchange(e, ESPNOW_PEER_CHANNEL)
+
+# Multi-channel operation (see _service_channel); inert without data channels.
+chan_plan = channel_plan.ChannelPlan(
+    ESPNOW_CHANNEL, ESPNOW_DATA_CHANNELS, MY_MAC, RENDEZVOUS_PERIOD, RENDEZVOUS_DWELL
+)
+# Chat channel we announce to chat_channel_peer, and partner_link.acked when
+# we started announcing it (the partner must ACK something newer).
+chat_channel_want = 0
+chat_channel_peer = None
+chat_channel_mark = 0
 
 # Nearby peers
 nearby_peers = {}
-blocked_auto_rematch_peers = set()
+# nearby_peers ranked best first by smoothed RSSI (display) and by link score
+# (closest-peer picks), kept current as frames arrive.
+peers_by_rssi = peer_index.RankedIndex()
+peers_by_link = peer_index.RankedIndex()
+# nearby_peers by normalized topic: the interests each peer shares with us, and
+# the topic of peers in CHAT (see _index_peer()).
+peers_by_interest = peer_index.TopicIndex()
+peers_by_chat_topic = peer_index.TopicIndex()
+# Hysteresis for the CHAT partner we follow and the SEARCH match on screen.
+chat_follow_choice = peer_index.StickyChoice(RSSI_HYSTERESIS_DB)
+search_match_choice = peer_index.StickyChoice(RSSI_HYSTERESIS_DB)
+# Peer table: PEER_TABLE_SIZE records plus one scratch record a newcomer is
+# decoded into, all allocated at boot and reused in place.
+peer_record_pool = []
+peer_record_bytes = 0
+# Eviction value of a peer: its link score (dBm), minus this much per second
+# since it was last heard, plus a bonus if it is a match.
+PEER_STALE_PENALTY = 2.0
+PEER_MATCH_BONUS = 40.0
+peer_evictions = 0
+rx_table_full = 0
+# Badges in range beyond the table are only counted (crowd_meter.py).
+crowd = crowd_meter.CrowdMeter(time.monotonic(), window=PEER_TIMEOUT)
+crowd_mode = False
+# Lowest eviction value in a full table during crowd mode, else None;
+# refreshed once per receive_all().
+admit_floor = None
+rx_crowd_skipped = 0
+# Admitted peers (and chat or rematch partners) get a small int id
+# (mac_intern.py); the sets and tables below are keyed by it and its hex string
+# is built only once.
+# Sized for everything that can hold an id at once (peer records, recent
+# peers, both alert caches, rematch state); ids no longer held are recycled.
+peer_ids = mac_intern.MacIntern(
+    capacity=2 * PEER_TABLE_SIZE + RECENT_PEERS_SIZE + 2 * ALERT_DEDUPE_SIZE + 1,
+    in_use=lambda: _held_peer_ids(),
+)
+MY_PEER_ID = peer_ids.intern(MY_MAC)
+# Ids of peers we already chatted with (recent_peers.py).
+blocked_auto_rematch_peers = recent_peers.RecentPeers(
+    RECENT_CHAT_PEERS_FILE,
+    peer_ids,
+    size=RECENT_PEERS_SIZE,
+    ttl=RECENT_PEERS_TTL,
+    write_gap=RECENT_PEERS_WRITE_GAP,
+)
 
 # Chat state
 chat_peer_mac = None
@@ -128,99 +339,214 @@ chat_wait_peer_mac = None
 chat_wait_deadline = 0.0
 chat_peer_exit_deadline = 0.0
 
-# Auto-rematch state per peer (keyed by MAC hex).
+# Auto-rematch state per peer (keyed by peer id).
 # window_deadline: live match window for case 2
 # cooldown_until: temporary block expiry for case 1 / case 2
 # had_chat_attempt: whether either side tried entering chat during the live window
 auto_rematch_state = {}
 
+# Every deadline the runtime waits on lives in one timer wheel (see
+# _service_timers): peer expiry keyed by MAC, rematch windows/cooldowns keyed
+# by (peer id, TIMER_REMATCH), and the chat handshake/exit timeouts keyed by
+# their kind.
+TIMER_PEER = 0
+TIMER_REMATCH = 1
+TIMER_CHAT_WAIT = 2
+TIMER_CHAT_EXIT = 3
+timers = timer_wheel.TimerWheel(time.monotonic())
+
 # Search-mode match LED latch state
 search_match_latched = False
 search_match_topic = ""
 search_match_color = (0, 0, 0)
+# Peer behind search_match_topic, kept by search_match_choice.
+search_match_mac = None
+# The best shared match and the SEARCH latch are redone only after
+# _peers_changed() reported that one of their inputs moved: a peer added,
+# removed or updated, a rematch block starting or ending, a mode change.
+best_match_gate = peer_index.ChangeGate()
+search_latch_gate = peer_index.ChangeGate()
+best_shared_match = (None, "", -999)
 
 # -- Badge match alert state --
 RSSI_BADGE_THRESHOLD = -65
-seen_badge_devices = set()
+# Ids of peers whose match alert / new-peer flash was already shown.
+seen_badge_devices = dedupe_cache.DedupeCache(ALERT_DEDUPE_SIZE, ALERT_DEDUPE_TTL)
+flashed_new_peers = dedupe_cache.DedupeCache(ALERT_DEDUPE_SIZE, ALERT_DEDUPE_TTL)
+
+# Shared-interest topic (lowercase) -> LED color, filled by interest_to_led_color.
+TOPIC_COLOR_CACHE_SIZE = 16
+topic_color_cache = {}
 
 # -------------------------
 # Helper functions
 # -------------------------
 def build_message():
-    interests_str = ",".join(MY_INTERESTS[:12])
     topic_str = ""
-    peer_mac_hex = ""
-    shared_flag = "0"
-    idx_str = "0"
-    ver_str = "0"
+    peer_mac = None
+    idx = 0
+    ver = 0
+    channel = chan_plan.home if chan_plan.enabled() else 0
 
     if current_mode == MODE_CHAT:
+        channel = chat_channel_want
         if (not chat_force_empty_topic) and chat_common:
             topic_str = chat_common[chat_common_idx][:30]
         if isinstance(chat_peer_mac, (bytes, bytearray)):
-            peer_mac_hex = chat_peer_mac.hex()
-        else:
-            peer_mac_hex = ""
-        idx_str = str(chat_common_idx)
-        ver_str = str(chat_idx_ver)
+            peer_mac = chat_peer_mac
+        idx = chat_common_idx
+        ver = chat_idx_ver
 
-    parts = [
-        str(current_mode),
+    encode = badge_frame.encode_text if ESPNOW_TEXT_FRAMES else badge_frame.encode_state
+    return encode(
+        current_mode,
         MY_NAME[:20],
-        interests_str,
-        topic_str,
-        peer_mac_hex,
-        shared_flag,
-        idx_str,
-        ver_str,
-    ]
-    msg = "|".join(parts)
-    return msg[:MAX_MSG_LEN]
+        interest_mask=MY_INTEREST_MASK,
+        interest_extras=MY_INTEREST_EXTRAS,
+        topic=topic_str,
+        peer_mac=peer_mac,
+        shared=False,
+        common_idx=idx,
+        idx_ver=ver,
+        state_ver=state_version,
+        channel=channel,
+    )
 
-def parse_message(data):
-    try:
-        text = str(data, "utf-8")
-        parts = text.split("|")
-        while len(parts) < 8:
-            parts.append("")
-        mode = int(parts[0])
-        name = parts[1]
-        interests = [s.strip() for s in parts[2].split(",") if s.strip()]
-        topic = parts[3].strip()
-        peer_mac = bytes.fromhex(parts[4]) if parts[4] else None
-        common_idx = int(parts[6]) if parts[6] else 0
-        idx_ver = int(parts[7]) if parts[7] else 0
-        return {
-            "mode": mode,
-            "name": name,
-            "interests": interests,
-            "topic": topic,
-            "peer_mac": peer_mac,
-            "common_idx": common_idx,
-            "idx_ver": idx_ver,
-        }
-    except Exception:
-        return None
+def _build_interest_items(interests):
+    """(catalog bit, normalized extra, original text) per interest, in order."""
+    items = []
+    for item in interests:
+        idx = interest_catalog.interest_index(item)
+        if idx is None:
+            items.append((0, interest_catalog.normalize_interest(item), item))
+        else:
+            items.append((1 << idx, "", item))
+    return items
+
+
+MY_INTEREST_ITEMS = _build_interest_items(MY_INTERESTS)
+# Topic index keys of MY_INTEREST_ITEMS, in the same order.
+MY_INTEREST_KEYS = tuple(interest_catalog.normalize_interest(item) for item in MY_INTERESTS)
+MY_INTEREST_BY_KEY = dict(zip(MY_INTEREST_KEYS, MY_INTERESTS))
+
+
+def _is_my_interest(topic):
+    idx = interest_catalog.interest_index(topic)
+    if idx is not None:
+        return bool((MY_INTEREST_MASK >> idx) & 1)
+    return interest_catalog.normalize_interest(topic) in MY_INTEREST_EXTRAS
+
+
+# Match results are cached on each peer record under "match" as
+# (interest_mask, interest_extras, first common, shared list, Jaccard %,
+# MY_INTEREST_KEYS shared). The
+# interest payload is the key: the entry is redone only when a state frame or
+# profile brings different interests, not on every render, alert check or tick.
+match_cache_hits = 0
+match_cache_misses = 0
 
-def compute_match(mine, theirs):
-    mine_set = set(s.lower() for s in mine)
-    theirs_set = set(s.lower() for s in theirs)
-    common = mine_set & theirs_set
-    total = len(mine_set | theirs_set)
-    if total == 0:
-        return [], 0
-    pct = int((len(common) / total) * 100)
-    return sorted(common), pct
-
-
-def first_common_interest(mine, theirs):
-    theirs_set = set(s.lower() for s in theirs)
-    for item in mine:
-        if item.lower() in theirs_set:
+
+def _shared_interests(theirs_mask, theirs_extras):
+    common_mask = MY_INTEREST_MASK & theirs_mask
+    if (not common_mask) and (not theirs_extras):
+        return []
+    common = [name.lower() for name in interest_catalog.names_from_mask(common_mask)]
+    for item in MY_INTEREST_EXTRAS:
+        if item in theirs_extras:
+            common.append(item)
+    common.sort()
+    return common
+
+
+def _first_common_interest(theirs_mask, theirs_extras):
+    if (not (theirs_mask & MY_INTEREST_MASK)) and (not theirs_extras):
+        return None
+    for bit, extra, item in MY_INTEREST_ITEMS:
+        if bit:
+            if theirs_mask & bit:
+                return item
+        elif extra in theirs_extras:
             return item
     return None
 
 
+def _shared_interest_keys(theirs_mask, theirs_extras):
+    keys = []
+    for i in range(len(MY_INTEREST_ITEMS)):
+        bit, extra, _ = MY_INTEREST_ITEMS[i]
+        if (theirs_mask & bit) if bit else (extra in theirs_extras):
+            keys.append(MY_INTEREST_KEYS[i])
+    return tuple(keys)
+
+
+def _peer_match(peer):
+    global match_cache_hits, match_cache_misses
+    theirs_mask = peer.get("interest_mask", 0)
+    theirs_extras = peer.get("interest_extras", ())
+    cached = peer.get("match")
+    if cached is not None and cached[0] == theirs_mask and cached[1] == theirs_extras:
+        match_cache_hits += 1
+        return cached
+    match_cache_misses += 1
+    cached = (
+        theirs_mask,
+        theirs_extras,
+        _first_common_interest(theirs_mask, theirs_extras),
+        _shared_interests(theirs_mask, theirs_extras),
+        interest_catalog.jaccard_pct(MY_INTEREST_MASK, MY_INTEREST_EXTRAS, theirs_mask, theirs_extras),
+        _shared_interest_keys(theirs_mask, theirs_extras),
+    )
+    peer["match"] = cached
+    return cached
+
+
+def _interest_idf(key):
+    """ln((N + 1) / df) over the N nearby peers; df is read off peers_by_interest."""
+    return math.log((len(nearby_peers) + 1) / max(1, len(peers_by_interest.get(key))))
+
+
+def _rarest_interest_key(keys):
+    """The key (first in settings order on ties) shared by the fewest nearby peers."""
+    rarest = None
+    rarest_df = 0
+    for key in keys:
+        df = len(peers_by_interest.get(key))
+        if rarest is None or df < rarest_df:
+            rarest = key
+            rarest_df = df
+    return rarest
+
+
+def match_pct(peer):
+    cached = _peer_match(peer)
+    keys = cached[5]
+    if not (MATCH_SCORING_IDF and keys):
+        return cached[4]
+    # Mean IDF of the shared interests, relative to an interest only this peer
+    # shares (df = 1). The document frequencies are kept current by
+    # _index_peer(), so this costs one set length per shared interest.
+    top = math.log(len(nearby_peers) + 1)
+    if top <= 0:
+        return cached[4]
+    weight = 0.0
+    for key in keys:
+        weight += _interest_idf(key)
+    return int(cached[4] * weight / (len(keys) * top))
+
+
+def compute_match(peer):
+    """Return (sorted shared interests, Jaccard %) between us and a peer record.
+
+    The list is shared with the cache: do not modify it.
+    """
+    return _peer_match(peer)[3], match_pct(peer)
+
+
+def first_common_interest(peer):
+    """Return the first of MY_INTERESTS (in settings order) that the peer shares."""
+    return _peer_match(peer)[2]
+
+
 def index_for_topic(common_list, topic):
     """Return index of topic in common_list (case-insensitive), or None."""
     if not common_list or not topic:
@@ -242,116 +568,175 @@ def _normalize_mac_hex(text):
     return value
 
 
+def _mac_key(mac):
+    return mac if isinstance(mac, bytes) else bytes(mac)
+
+
+def _peer_id(mac):
+    """Interned id of a 6-byte MAC (assigned on first sight), or None."""
+    if not isinstance(mac, (bytes, bytearray)) or len(mac) != 6:
+        return None
+    return peer_ids.intern(_mac_key(mac))
+
+
+def _find_peer_id(mac):
+    """Id of a 6-byte MAC if it has one, else None (never assigns one)."""
+    if not isinstance(mac, (bytes, bytearray)) or len(mac) != 6:
+        return None
+    return peer_ids.find(_mac_key(mac))
+
+
 def _mac_bytes_to_hex(mac):
-    if isinstance(mac, (bytes, bytearray)) and len(mac) == 6:
-        return bytes(mac).hex()
-    return None
+    if not isinstance(mac, (bytes, bytearray)) or len(mac) != 6:
+        return None
+    pid = peer_ids.find(_mac_key(mac))
+    return peer_ids.hex(pid) if pid is not None else mac.hex()
 
 
-def _is_blocked_peer_mac(mac):
-    mac_hex = _mac_bytes_to_hex(mac)
-    if (not mac_hex) or (mac_hex == _mac_bytes_to_hex(my_mac)):
+def _held_peer_ids():
+    """Ids something still refers to; peer_ids recycles the rest when full."""
+    held = {MY_PEER_ID}
+    for rec in nearby_peers.values():
+        held.add(rec["id"])
+    held.update(blocked_auto_rematch_peers)
+    held.update(seen_badge_devices)
+    held.update(flashed_new_peers)
+    held.update(auto_rematch_state)
+    return held
+
+
+def _is_blocked_peer_id(pid):
+    if pid == MY_PEER_ID:
         return False
-    if bytes.fromhex(mac_hex) in blocked_auto_rematch_peers:
+    if pid in blocked_auto_rematch_peers:
         return True
 
-    state = auto_rematch_state.get(mac_hex)
-    if state is None:
-        return False
+    # Windows turn into cooldowns, and cooldowns lapse, in _expire_rematch_state.
+    state = auto_rematch_state.get(pid)
+    return state is not None and state["cooldown_until"] > 0.0
 
-    now = time.monotonic()
-    cooldown_until = state.get("cooldown_until", 0.0)
-    if cooldown_until and now < cooldown_until:
-        return True
 
-    if cooldown_until and now >= cooldown_until:
-        del auto_rematch_state[mac_hex]
-        return False
+def _is_blocked_peer_mac(mac):
+    # Blocking always stores an id: a MAC without one is not blocked.
+    pid = _find_peer_id(mac)
+    return pid is not None and _is_blocked_peer_id(pid)
 
-    window_deadline = state.get("window_deadline", 0.0)
-    if window_deadline and now >= window_deadline:
-        if state.get("had_chat_attempt", False):
-            del auto_rematch_state[mac_hex]
-            return False
 
-        # Case 2: shared match existed for 60s without a successful joint chat.
-        state["window_deadline"] = 0.0
-        state["cooldown_until"] = now + AUTO_RECONNECT_DELAY_EXTENDED
-        auto_rematch_state[mac_hex] = state
-        return True
+def _expire_rematch_state(pid, now):
+    """A rematch window or cooldown in the timer wheel has run out."""
+    state = auto_rematch_state.get(pid)
+    if state is None:
+        return
+    if state["cooldown_until"] or state["had_chat_attempt"]:
+        del auto_rematch_state[pid]
+        if state["cooldown_until"]:
+            _peers_changed()
+        return
 
-    return False
+    # Case 2: shared match existed for 60s without a successful joint chat.
+    state["window_deadline"] = 0.0
+    state["cooldown_until"] = now + AUTO_RECONNECT_DELAY_EXTENDED
+    timers.schedule((pid, TIMER_REMATCH), state["cooldown_until"], TIMER_REMATCH)
+    _peers_changed()
 
 
-def _track_match_window(mac, peer_info):
-    mac_hex = _mac_bytes_to_hex(mac)
-    my_hex = _mac_bytes_to_hex(my_mac)
-    if (not mac_hex) or (mac_hex == my_hex):
+def _track_match_window(peer_info):
+    pid = peer_info["id"]
+    if pid == MY_PEER_ID:
+        return
+    if pid in auto_rematch_state:
         return
-    if bytes.fromhex(mac_hex) in blocked_auto_rematch_peers:
+    if pid in blocked_auto_rematch_peers:
         return
     if not is_shared_interest_peer(peer_info):
         return
 
-    state = auto_rematch_state.get(mac_hex)
-    if state is None:
-        auto_rematch_state[mac_hex] = {
-            "window_deadline": time.monotonic() + AUTO_CHAT_WINDOW,
-            "cooldown_until": 0.0,
-            "had_chat_attempt": False,
-        }
+    deadline = time.monotonic() + AUTO_CHAT_WINDOW
+    auto_rematch_state[pid] = {
+        "window_deadline": deadline,
+        "cooldown_until": 0.0,
+        "had_chat_attempt": False,
+    }
+    timers.schedule((pid, TIMER_REMATCH), deadline, TIMER_REMATCH)
 
 
 def _start_auto_rematch_block(mac, cooldown_seconds):
-    mac_hex = _mac_bytes_to_hex(mac)
-    my_hex = _mac_bytes_to_hex(my_mac)
-    if (not mac_hex) or (mac_hex == my_hex):
+    pid = _peer_id(mac)
+    if (pid is None) or (pid == MY_PEER_ID):
         return
-    if bytes.fromhex(mac_hex) in blocked_auto_rematch_peers:
+    if pid in blocked_auto_rematch_peers:
         return
 
-    auto_rematch_state[mac_hex] = {
+    deadline = time.monotonic() + cooldown_seconds
+    auto_rematch_state[pid] = {
         "window_deadline": 0.0,
-        "cooldown_until": time.monotonic() + cooldown_seconds,
+        "cooldown_until": deadline,
         "had_chat_attempt": True,
     }
+    timers.schedule((pid, TIMER_REMATCH), deadline, TIMER_REMATCH)
+    _peers_changed()
+
+
+def _set_chat_wait_deadline(deadline):
+    """Arm (or with 0.0 disarm) the CHAT handshake timeout."""
+    global chat_wait_deadline
+    chat_wait_deadline = deadline
+    if deadline > 0.0:
+        timers.schedule(TIMER_CHAT_WAIT, deadline, TIMER_CHAT_WAIT)
+    else:
+        timers.cancel(TIMER_CHAT_WAIT)
+
+
+def _set_chat_peer_exit_deadline(deadline):
+    """Arm (or with 0.0 disarm) the partner-left-CHAT timeout."""
+    global chat_peer_exit_deadline
+    chat_peer_exit_deadline = deadline
+    if deadline > 0.0:
+        timers.schedule(TIMER_CHAT_EXIT, deadline, TIMER_CHAT_EXIT)
+    else:
+        timers.cancel(TIMER_CHAT_EXIT)
 
 
 def _mark_chat_handshake_success(mac):
-    mac_hex = _mac_bytes_to_hex(mac)
-    if not mac_hex:
+    pid = _peer_id(mac)
+    if pid is None:
         return
-    blocked_auto_rematch_peers.add(bytes.fromhex(mac_hex))
-    _save_recent_chat_peers(blocked_auto_rematch_peers)
-    if mac_hex in auto_rematch_state:
-        del auto_rematch_state[mac_hex]
+    # Called on every frame from the partner while both are in CHAT: the store
+    # batches its flash writes.
+    if blocked_auto_rematch_peers.add(pid, time.monotonic()):
+        _peers_changed()
+    if pid in auto_rematch_state:
+        del auto_rematch_state[pid]
+        timers.cancel((pid, TIMER_REMATCH))
 
 
 def _mark_chat_attempt(mac):
-    mac_hex = _mac_bytes_to_hex(mac)
-    my_hex = _mac_bytes_to_hex(my_mac)
-    if (not mac_hex) or (mac_hex == my_hex):
+    pid = _peer_id(mac)
+    if (pid is None) or (pid == MY_PEER_ID):
         return
-    state = auto_rematch_state.get(mac_hex)
+    state = auto_rematch_state.get(pid)
     if state is None:
         state = {
             "window_deadline": time.monotonic() + AUTO_CHAT_WINDOW,
             "cooldown_until": 0.0,
             "had_chat_attempt": True,
         }
+        timers.schedule((pid, TIMER_REMATCH), state["window_deadline"], TIMER_REMATCH)
     else:
         state["had_chat_attempt"] = True
-    auto_rematch_state[mac_hex] = state
+    auto_rematch_state[pid] = state
 
 
 def _load_recent_chat_peers():
-    peers = set()
+    now = time.monotonic()
+    if blocked_auto_rematch_peers.load(now):
+        return
+    # No list in the current format yet: take over the old text one.
     try:
         with open(RECENT_CHAT_PEERS_TOML, "r") as fp:
             raw = fp.read()
     except OSError:
-        _save_recent_chat_peers(set())
-        return peers
+        return
 
     for raw_line in raw.splitlines():
         line = raw_line.strip()
@@ -368,49 +753,96 @@ def _load_recent_chat_peers():
         for item in value.split(","):
             normalized = _normalize_mac_hex(item)
             if normalized:
-                peers.add(bytes.fromhex(normalized))
+                blocked_auto_rematch_peers.add(peer_ids.intern(bytes.fromhex(normalized)), now)
         break
 
-    return peers
 
+def _shared_match_topic(peer):
+    if peer.get("mode") == MODE_CHAT and peer.get("topic"):
+        peer_topic = peer.get("topic", "")
+        if _is_my_interest(peer_topic):
+            return peer_topic
+    if MATCH_SCORING_IDF:
+        key = _rarest_interest_key(_peer_match(peer)[5])
+        return MY_INTEREST_BY_KEY[key] if key is not None else None
+    return first_common_interest(peer)
+
+
+def _index_peer(mac, rec):
+    """File a nearby peer in the topic indexes after its frame or profile changed."""
+    if peers_by_interest.set(mac, _peer_match(rec)[5]) and MATCH_SCORING_IDF:
+        # Interest frequencies moved: other peers' rarest topic may have too.
+        _peers_changed()
+    topic = rec["topic"]
+    if rec["mode"] == MODE_CHAT and topic:
+        peers_by_chat_topic.set(mac, (interest_catalog.normalize_interest(topic),))
+    else:
+        peers_by_chat_topic.remove(mac)
 
-def _save_recent_chat_peers(peers):
-    macs = []
-    for mac in peers:
-        mac_hex = _mac_bytes_to_hex(mac)
-        if mac_hex:
-            macs.append(mac_hex)
-    macs.sort()
 
-    data = '{}="{}"\n'.format(RECENT_CHAT_PEERS_KEY, ",".join(macs))
-    try:
-        with open(RECENT_CHAT_PEERS_TOML, "w") as fp:
-            fp.write(data)
-    except Exception as ex:
-        print("WARN: cannot write {}: {}".format(RECENT_CHAT_PEERS_TOML, ex))
+def _shared_match_peers():
+    """Nearby peers that share one of our interests or chat on one, best link first."""
+    macs = set()
+    for key in MY_INTEREST_KEYS:
+        macs.update(peers_by_interest.get(key))
+        macs.update(peers_by_chat_topic.get(key))
+    return peers_by_link.ranked(macs)
+
+
+def _peers_changed():
+    """An input of the best match changed: redo it (and the SEARCH latch) on next use."""
+    best_match_gate.mark()
+    search_latch_gate.mark()
+
+
+def _peer_updated(mac, rec):
+    """A nearby peer's state or link score moved; only candidates can change the match."""
+    if (rec["first_common"] is not None or rec["mode"] == MODE_CHAT or
+            mac == search_match_mac):
+        _peers_changed()
 
 
 def find_best_shared_match():
-    """Return (topic, name, rssi) for best nearby shared-interest peer."""
+    """Return (topic, name, rssi) for best nearby shared-interest peer.
+
+    The peer already matched keeps the spot until another beats its link
+    score by RSSI_HYSTERESIS_DB. The scan is redone only after _peers_changed().
+    """
+    global best_shared_match
+    if best_match_gate.due():
+        best_shared_match = _find_best_shared_match()
+    return best_shared_match
+
+
+def _find_best_shared_match():
+    global search_match_mac
+    best_mac = None
     best_topic = None
-    best_name = ""
-    best_rssi = -999
-    for mac, peer in nearby_peers.items():
+    current_topic = None
+    for mac in _shared_match_peers():
         if _is_blocked_peer_mac(mac):
             continue
-        topic = ""
-        if peer.get("mode") == MODE_CHAT and peer.get("topic"):
-            peer_topic = peer.get("topic", "")
-            if any(peer_topic.lower() == mine.lower() for mine in MY_INTERESTS):
-                topic = peer_topic
+        topic = _shared_match_topic(nearby_peers[mac])
         if not topic:
-            topic = first_common_interest(MY_INTERESTS, peer.get("interests", []))
-        rssi = peer.get("rssi", -999)
-        if topic and rssi > best_rssi:
+            continue
+        if best_mac is None:
+            best_mac = mac
             best_topic = topic
-            best_name = peer.get("name", "")
-            best_rssi = rssi
-    return best_topic, best_name, best_rssi
+        if mac == search_match_mac:
+            current_topic = topic
+        if current_topic or search_match_mac not in peers_by_link:
+            break
+    if best_mac is None:
+        search_match_mac = None
+        return None, "", -999
+
+    current_score = peers_by_link.score(search_match_mac) if current_topic else None
+    search_match_mac = search_match_choice.choose(
+        best_mac, peers_by_link.score(best_mac), search_match_mac, current_score
+    )
+    peer = nearby_peers[search_match_mac]
+    topic = best_topic if search_match_mac == best_mac else current_topic
+    return topic, peer.get("name", ""), peer.get("rssi", -999)
 
 
 def has_live_shared_match():
@@ -425,8 +857,12 @@ def interest_to_led_color(topic):
     """
     if not topic:
         return (0, 80, 80)
+    key = topic.lower()
+    color = topic_color_cache.get(key)
+    if color is not None:
+        return color
     h = 0
-    for ch in topic.lower():
+    for ch in key:
         h = ((h * 33) + ord(ch)) & 0xFFFF
     palette = (
         (120, 30, 30),
@@ -438,7 +874,11 @@ def interest_to_led_color(topic):
         (120, 50, 90),
         (60, 120, 40),
     )
-    return palette[h % len(palette)]
+    color = palette[h % len(palette)]
+    if len(topic_color_cache) >= TOPIC_COLOR_CACHE_SIZE:
+        topic_color_cache.clear()
+    topic_color_cache[key] = color
+    return color
 
 
 def _safe_topic_chars(text):
@@ -466,6 +906,16 @@ def _topic_to_image_path(topic):
     if not raw:
         return None
 
+    idx = interest_catalog.interest_index(raw)
+    if idx is not None:
+        # Catalog topics: the BMP is named after the entry, one stat.
+        p = interest_catalog.image_path(idx)
+        try:
+            os.stat(p)
+            return p
+        except OSError:
+            pass
+
     names = []
     variants = (
         raw,
@@ -515,52 +965,97 @@ def flash_alert(color, flashes=2, on_s=0.08, off_s=0.08):
         time.sleep(off_s)
 
 
-def check_badge_matches(packet_mac, peer_info):
-    global seen_badge_devices
-    if packet_mac == bytes(my_mac):
+def check_badge_matches(peer_info, now):
+    pid = peer_info["id"]
+    if pid == MY_PEER_ID:
         return
-    if _is_blocked_peer_mac(packet_mac):
+    if seen_badge_devices.seen(pid, now):
         return
-    if packet_mac in seen_badge_devices:
+    if _is_blocked_peer_id(pid):
         return
     rssi = peer_info.get("rssi", -100)
     if rssi < RSSI_BADGE_THRESHOLD:
         return
-    peer_interests = peer_info.get("interests", [])
-    _, match_pct = compute_match(MY_INTERESTS, peer_interests)
-    shared = set(s.lower() for s in MY_INTERESTS) & set(s.lower() for s in peer_interests)
+    if not is_shared_interest_peer(peer_info):
+        return
+    shared, pct = compute_match(peer_info)
     if shared:
-        color = get_match_led_color(match_pct, rssi)
+        color = get_match_led_color(pct, rssi)
         print(
             "ALERT! Shared badges with {}: {} ({}%, {} dBm, color={})".format(
                 peer_info.get("name", ""),
-                list(shared),
-                match_pct,
+                shared,
+                pct,
                 rssi,
                 color,
             )
         )
         flash_alert(color)
-        seen_badge_devices.add(packet_mac)
+        seen_badge_devices.add(pid, now)
 
 
 def is_shared_interest_peer(peer_info):
-    peer_interests = peer_info.get("interests", [])
-    return first_common_interest(MY_INTERESTS, peer_interests) is not None
+    if "first_common" in peer_info:
+        # Cached on the peer record whenever its state frame is decoded.
+        return peer_info["first_common"] is not None
+    return first_common_interest(peer_info) is not None
 # -------------------------
 # Broadcast / receive
 # -------------------------
-def do_broadcast():
-    global last_broadcast, tx_attempts, tx_errors
+def _refresh_state_frame(now):
+    """Rebuild our state frame; on change bump state_version and speed broadcasts up."""
+    global state_version, last_state_frame
     msg = build_message()
+    if msg != last_state_frame:
+        state_version = (state_version + 1) & 0xFF
+        msg = build_message()
+        last_state_frame = msg
+        scheduler.reset(now)
+    return msg
+
+
+def _next_broadcast_frame(now, allow_suppress=False):
+    """Return (frame, is_full) for this broadcast slot, or (None, False) if suppressed."""
+    global last_full_broadcast, broadcast_state_ver
+    msg = _refresh_state_frame(now)
+    if state_version != broadcast_state_ver:
+        # Local change the room has not heard yet: always send it in full.
+        broadcast_state_ver = state_version
+    elif allow_suppress and scheduler.should_suppress(now):
+        return None, False
+    elif (not ESPNOW_TEXT_FRAMES) and ESPNOW_DELTA_FRAMES and (now - last_full_broadcast < FULL_STATE_REFRESH):
+        return badge_frame.encode_heartbeat(state_version), False
+
+    last_full_broadcast = now
+    if ESPNOW_PULL_PROFILES and not ESPNOW_TEXT_FRAMES:
+        return badge_frame.as_presence(msg, MY_PROFILE_HASH), True
+    return msg, True
+
+
+def do_broadcast(scheduled=False):
+    global last_broadcast, tx_attempts, tx_errors, tx_full_frames, tx_heartbeats, tx_seq
+    now = time.monotonic()
+    msg, is_full = _next_broadcast_frame(now, allow_suppress=scheduled)
+    if msg is None:
+        return
+    if is_full:
+        tx_full_frames += 1
+    else:
+        tx_heartbeats += 1
     tx_attempts += 1
+    ok = True
     try:
-        e.send(bytes(msg, "utf-8"), broadcast_peer)
+        e.send(badge_frame.with_seq(msg, tx_seq), broadcast_peer)
     except Exception as ex:
+        ok = False
         tx_errors += 1
         if DEBUG_ESPNOW:
             print("ESPNOW TX error:", ex)
-    last_broadcast = time.monotonic()
+    tx_seq = (tx_seq + 1) & 0xFF
+    scheduler.note_tx(now, ok)
+    partner_link.note_broadcast()
+    profile_exchange.note_broadcast()
+    last_broadcast = now
 
 def flash_new_peer():
     for _ in range(2):
@@ -569,96 +1064,601 @@ def flash_new_peer():
         pixels.fill(0)
         time.sleep(0.08)
 
+def _set_presence_beacon(enabled, now):
+    """Slow the room broadcast to a presence beacon while the partner is on unicast."""
+    global presence_beacon
+    if enabled == presence_beacon:
+        return
+    presence_beacon = enabled
+    if enabled:
+        scheduler.min_interval = BROADCAST_PRESENCE_INTERVAL
+    else:
+        scheduler.min_interval = BROADCAST_INTERVAL
+        scheduler.reset(now)
+
+
+def _partner_chats_with_us():
+    """True if chat_peer_mac's latest state says it is in CHAT with us."""
+    rec = nearby_peers.get(chat_peer_mac)
+    return rec is not None and rec["mode"] == MODE_CHAT and rec["peer_mac"] == MY_MAC
+
+
+def _service_chat_link(now):
+    """Keep the unicast link on chat_peer_mac and push chat state over it."""
+    global chat_state_dirty, uc_fallbacks
+    if ESPNOW_TEXT_FRAMES or current_mode != MODE_CHAT or not chat_peer_mac:
+        partner_link.close()
+        _set_presence_beacon(False, now)
+        return
+    if partner_link.mac != chat_peer_mac:
+        # ESP-NOW takes one registration per MAC; the chat link owns it now.
+        profile_exchange.release(chat_peer_mac)
+    if not partner_link.open(chat_peer_mac):
+        _set_presence_beacon(False, now)
+        return
+
+    partner_link.poll_ack()
+    # Any badge in range ACKs a unicast: only a partner whose state says it is
+    # chatting with us is listening, until then it is reached by broadcast.
+    listening = _partner_chats_with_us()
+    # A profile unicast still waiting for its ACK would resolve our send.
+    if listening and not profile_exchange.busy() and (chat_state_dirty or partner_link.due(now)):
+        if partner_link.send(_refresh_state_frame(now), now):
+            chat_state_dirty = False
+
+    link_up = listening and partner_link.is_up()
+    if presence_beacon and not link_up:
+        # Partner stopped ACKing or left the chat: back to room broadcasts.
+        uc_fallbacks += 1
+        _set_presence_beacon(False, now)
+        do_broadcast()
+    else:
+        _set_presence_beacon(link_up, now)
+
+
+def _service_contact_card(now):
+    """Send our contact card to the chat partner once its unicast link is up."""
+    global card_peer_mac, card_fail_mark, card_retry_at, card_attempts, card_attempts_mac
+    if card_peer_mac is not None and card_peer_mac != partner_link.mac:
+        # Chat ended or moved to another partner: drop the old transfer.
+        card_transport.cancel()
+        card_peer_mac = None
+        card_retry_at = 0.0
+    elif card_peer_mac is not None and card_transport.tx_failed != card_fail_mark:
+        card_peer_mac = None
+        card_retry_at = now + CARD_RETRY_DELAY
+    if card_attempts_mac != partner_link.mac:
+        card_attempts_mac = partner_link.mac
+        card_attempts = 0
+
+    # A partner that left the chat is not listening: no (re)send until it is back.
+    if (card_peer_mac is None and card_attempts < CARD_MAX_ATTEMPTS and now >= card_retry_at
+            and partner_link.is_up() and _partner_chats_with_us()):
+        card_fail_mark = card_transport.tx_failed
+        if card_transport.send(partner_link.peer, badge_frame.MSG_CARD, MY_CARD, now, reliable=True):
+            card_peer_mac = partner_link.mac
+            card_attempts += 1
+    if not partner_link.pending:
+        # Keep fragment ACKs out of the chat link's send_success/failure accounting.
+        card_transport.poll(now)
+
+
+def _service_profiles(now):
+    """Send queued profile requests and replies."""
+    if not partner_link.pending:
+        # Like card fragments, keep these ACKs out of the chat link's accounting.
+        profile_exchange.poll(now, partner_link.peer)
+
+
+def _retune(channel, now):
+    """Move the radio to `channel` and re-announce ourselves there."""
+    global last_full_broadcast
+    started = time.monotonic()
+    try:
+        _set_radio_channel(channel)
+    except Exception as ex:
+        if DEBUG_ESPNOW:
+            print("ESPNOW channel switch error:", ex)
+        return
+    chan_plan.note_switch(channel, now, time.monotonic() - started)
+    # Nobody on the new channel has our current state yet.
+    last_full_broadcast = 0.0
+    scheduler.reset(now)
+    do_broadcast()
+
+
+def _service_channel(now):
+    """Follow the channel plan; in CHAT agree on a channel with the partner.
+
+    The higher MAC picks its quietest data channel and announces it in its
+    state frames; the partner echoes it. Each side moves once the partner
+    announces the same channel and has ACKed a unicast sent since we started
+    announcing it. Until then both wait on the rendezvous channel, and they
+    return there if the pinned channel stops delivering ACKs."""
+    global chat_channel_want, chat_channel_peer, chat_channel_mark, chat_state_dirty
+    if not chan_plan.enabled():
+        return
+    if current_mode != MODE_CHAT or not chat_peer_mac or ESPNOW_TEXT_FRAMES:
+        chat_channel_want = 0
+        chat_channel_peer = None
+        chan_plan.pinned = 0
+    else:
+        if chat_channel_peer != chat_peer_mac:
+            chat_channel_want = 0
+            chat_channel_peer = chat_peer_mac
+            chan_plan.pinned = 0
+        peer_asks = 0
+        if _partner_chats_with_us():
+            peer_asks = nearby_peers[chat_peer_mac]["channel"]
+        want = chat_channel_want
+        if MY_MAC > chat_peer_mac:
+            if not want:
+                want = chan_plan.quietest(chat_peer_mac[-1], now)
+        elif peer_asks:
+            want = peer_asks
+        if want != chat_channel_want:
+            chat_channel_want = want
+            chat_channel_mark = partner_link.acked
+            chat_state_dirty = True
+
+        if chan_plan.pinned and partner_link.failures >= CHAT_UNICAST_MAX_FAILS:
+            # Partner went quiet on the chat channel: meet again at rendezvous.
+            chan_plan.pinned = 0
+            chat_channel_mark = partner_link.acked
+        elif (not chan_plan.pinned) and want and peer_asks == want and partner_link.acked > chat_channel_mark:
+            chan_plan.pinned = want
+
+    target = chan_plan.target(now, hold=(current_mode == MODE_CHAT))
+    if target != chan_plan.current:
+        _retune(target, now)
+
+
+def _new_peer_record():
+    return {
+        "name": "",
+        "mode": MODE_SEARCH,
+        "interest_mask": 0,
+        "interest_extras": (),
+        "topic": "",
+        "rssi": -100,
+        "last_seen": 0.0,
+        "peer_mac": None,
+        "shared_flag": False,
+        "common_idx": 0,
+        "idx_ver": 0,
+        "channel": 0,
+        "state_ver": None,
+        "profile_hash": None,
+        "profile_loaded": None,
+        "link": link_stats.LinkStats(),
+        "card": None,
+        "first_common": None,
+        # Cached match result, see _peer_match().
+        "match": None,
+        # Interned MAC id, set when the record is given to a peer.
+        "id": None,
+    }
+
+
+gc.collect()
+_pool_before = _mem_alloc() if _mem_alloc else 0
+for _ in range(PEER_TABLE_SIZE + 1):
+    peer_record_pool.append(_new_peer_record())
+if _mem_alloc:
+    peer_record_bytes = (_mem_alloc() - _pool_before) // (PEER_TABLE_SIZE + 1)
+print("Peer table: {} slots, {} bytes per peer".format(
+    PEER_TABLE_SIZE, peer_record_bytes if _mem_alloc else "?"
+))
+
+
+def _take_peer_record():
+    if peer_record_pool:
+        rec = peer_record_pool.pop()
+        rec["link"].reset()
+        rec["card"] = None
+        # Presence frames leave the profile fields alone: clear the last owner's.
+        rec["name"] = ""
+        rec["interest_mask"] = 0
+        rec["interest_extras"] = ()
+        rec["profile_loaded"] = None
+        rec["id"] = None
+        return rec
+    return _new_peer_record()
+
+
+def peer_link_stats(mac):
+    """LinkStats for a nearby peer (loss/dup/jitter/RSSI), or None."""
+    rec = nearby_peers.get(mac)
+    return rec["link"] if rec else None
+
+
+def peer_card(mac):
+    """Contact card {"name", "contact", "interests"} received from a peer, or None."""
+    rec = nearby_peers.get(mac)
+    return rec["card"] if rec else None
+
+
+def _hears_all_frames(peer):
+    """False for peers homed on another channel: their seq gaps are not loss."""
+    return (not chan_plan.enabled()) or peer["channel"] in (0, chan_plan.current)
+
+
+def _peer_timeout(peer):
+    timeout = peer["link"].timeout(PEER_TIMEOUT)
+    if chan_plan.enabled() and peer["channel"] not in (0, chan_plan.home):
+        timeout += CROSS_CHANNEL_GRACE
+    return timeout
+
+
+def _peer_link_score(peer):
+    return peer["link"].link_score()
+
+
+def _print_link_stats():
+    for mac, rec in nearby_peers.items():
+        print("LINK {} {} {}".format(_mac_bytes_to_hex(mac), rec["name"], rec["link"].summary()))
+
+
+def _release_peer_record(rec):
+    if len(peer_record_pool) <= PEER_TABLE_SIZE:
+        peer_record_pool.append(rec)
+
+
+def _drop_peer(mac):
+    # The cached profile stays: a returning badge is not fetched again.
+    profile_exchange.forget(mac)
+    timers.cancel(mac)
+    peers_by_rssi.remove(mac)
+    peers_by_link.remove(mac)
+    peers_by_interest.remove(mac)
+    peers_by_chat_topic.remove(mac)
+    _release_peer_record(nearby_peers.pop(mac))
+    _peers_changed()
+
+
+def _peer_value(mac, rec, now):
+    """Eviction order for a full peer table: stale, weak and non-matching peers go first."""
+    if mac == chat_peer_mac or mac == chat_wait_peer_mac or mac == partner_link.mac:
+        return 1000.0
+    value = _peer_link_score(rec) - PEER_STALE_PENALTY * (now - rec["last_seen"])
+    if is_shared_interest_peer(rec):
+        value += PEER_MATCH_BONUS
+    return value
+
+
+def _admit_peer(mac, rec, now):
+    """Make room for a newcomer; False if the table is full of peers worth more."""
+    global peer_evictions, rx_table_full
+    if len(nearby_peers) < PEER_TABLE_SIZE:
+        return True
+    victim = None
+    victim_value = 0.0
+    for key, peer in nearby_peers.items():
+        value = _peer_value(key, peer, now)
+        if victim is None or value < victim_value:
+            victim = key
+            victim_value = value
+    if victim_value >= _peer_value(mac, rec, now):
+        rx_table_full += 1
+        return False
+    peer_evictions += 1
+    _drop_peer(victim)
+    return True
+
+
+def _update_crowd_mode(now):
+    """Enter or leave crowd mode from the crowd estimate and refresh admit_floor."""
+    global crowd_mode, admit_floor
+    crowd.roll(now)
+    size = crowd.size()
+    if crowd_mode != (size > (CROWD_MODE_PEERS * 3 // 4 if crowd_mode else CROWD_MODE_PEERS)):
+        crowd_mode = not crowd_mode
+        print("CROWD mode {}: ~{} badges in range".format("on" if crowd_mode else "off", size))
+    admit_floor = None
+    if crowd_mode and len(nearby_peers) >= PEER_TABLE_SIZE:
+        for mac, rec in nearby_peers.items():
+            value = _peer_value(mac, rec, now)
+            if admit_floor is None or value < admit_floor:
+                admit_floor = value
+
+
+def _receive_transport_frame(mac, msg, now, rec):
+    """Feed a fragment/status frame to the card transport and keep finished cards."""
+    if rec is not None:
+        rec["last_seen"] = now
+    # Status reports can only go back over an open partner link.
+    reply_peer = partner_link.peer if mac == partner_link.mac else None
+    done = card_transport.receive(mac, msg, now, reply_peer)
+    if done is None or rec is None:
+        return
+    kind, payload = done
+    if kind == badge_frame.MSG_CARD:
+        rec["card"] = badge_frame.decode_card(payload)
+        if DEBUG_ESPNOW:
+            print("CARD from", _mac_bytes_to_hex(mac), rec["card"])
+
+
+def _apply_profile(rec, profile_hash, profile):
+    rec["name"], rec["interest_mask"], rec["interest_extras"] = profile
+    rec["profile_loaded"] = profile_hash
+    rec["first_common"] = first_common_interest(rec)
+
+
+def _note_full_profile(mac, rec):
+    """Cache the profile a full frame carried, so the owner's next presence
+    frame does not ask for it again."""
+    profile = (rec["name"], rec["interest_mask"], rec["interest_extras"])
+    profile_hash = badge_frame.profile_hash_of(badge_frame.encode_profile(*profile))
+    profiles.put(mac, profile_hash, profile)
+    profile_exchange.got(mac, profile_hash)
+    rec["profile_loaded"] = profile_hash
+
+
+def _load_profile(mac, rec, now, fetch=True):
+    """Fill a presence-only record from the cache, or (`fetch`) ask its owner for the profile."""
+    profile_hash = rec["profile_hash"]
+    if profile_hash is None or profile_hash == rec["profile_loaded"]:
+        return
+    profile = profiles.get(mac, profile_hash)
+    if profile is None:
+        if fetch:
+            profile_exchange.want(mac, profile_hash, now)
+    else:
+        _apply_profile(rec, profile_hash, profile)
+
+
+def _receive_profile_frame(mac, msg, now, rec):
+    """Answer profile requests and apply profiles we asked for; True if a record changed."""
+    global parse_failures
+    mac = _mac_key(mac)
+    if msg[2] == badge_frame.FRAME_PROFILE_REQ:
+        if len(msg) >= badge_frame.PROFILE_REQ_LEN and badge_frame.profile_hash_of(msg) == MY_PROFILE_HASH:
+            profile_exchange.reply(mac, MY_PROFILE_FRAME, now)
+        return False
+    info = badge_frame.decode_profile(msg)
+    if info is None:
+        parse_failures += 1
+        return False
+    profile_hash, profile = info
+    profiles.put(mac, profile_hash, profile)
+    profile_exchange.got(mac, profile_hash)
+    if rec is None or rec["profile_hash"] != profile_hash:
+        return False
+    was_shared = is_shared_interest_peer(rec)
+    _apply_profile(rec, profile_hash, profile)
+    rec["last_seen"] = now
+    _index_peer(mac, rec)
+    _peer_updated(mac, rec)
+    _track_match_window(rec)
+    if not _is_blocked_peer_id(rec["id"]):
+        check_badge_matches(rec, now)
+        if (not was_shared) and is_shared_interest_peer(rec) and flashed_new_peers.first(rec["id"], now):
+            flash_new_peer()
+    return True
+
+
+def _receive_packet(packet, now):
+    """Apply one packet to nearby_peers in place; return True if the display changed."""
+    global parse_failures, rx_cached_frames, rx_stale_heartbeats, rx_duplicates, last_full_broadcast
+    global rx_direct_frames, rx_crowd_skipped
+
+    mac_key = packet.mac
+    if mac_key == MY_MAC:
+        return False
+
+    msg = packet.msg
+    rec = nearby_peers.get(mac_key)
+    has_header = badge_frame.has_header(msg)
+    if badge_frame.is_transport_frame(msg):
+        # Fragments carry a msg_id and their own seq stream: no state or loss accounting.
+        _receive_transport_frame(mac_key, msg, now, rec)
+        return False
+    if badge_frame.is_profile_frame(msg):
+        # Unicast profile traffic: likewise outside the broadcast seq stream.
+        return _receive_profile_frame(mac_key, msg, now, rec)
+    seq = msg[badge_frame.SEQ_OFFSET] if has_header else None
+    if has_header and msg[2] == badge_frame.FRAME_DIRECT:
+        # Unicast from our chat partner: its seq is a separate stream.
+        rx_direct_frames += 1
+        if rec is not None:
+            rec["link"].add_rssi(packet.rssi)
+    elif rec is not None and not rec["link"].update(seq if _hears_all_frames(rec) else None, now, packet.rssi):
+        # Same sequence number as the last frame: a duplicate copy.
+        rx_duplicates += 1
+        return False
+    # The first DIRECT frame after presence ones is decoded even with the same
+    # state_ver: its name and interests become the partner's profile.
+    if (rec is not None and has_header and msg[3] == rec["state_ver"]
+            and not (msg[2] == badge_frame.FRAME_DIRECT and rec["profile_hash"] is not None)):
+        # Sender state unchanged: keep the cached record, refresh liveness only.
+        rx_cached_frames += 1
+        scheduler.heard_consistent()
+        rec["rssi"] = rec["link"].rssi()
+        rec["last_seen"] = now
+        _track_match_window(rec)
+        if not _is_blocked_peer_id(rec["id"]):
+            check_badge_matches(rec, now)
+        return False
+    if has_header and msg[2] == badge_frame.FRAME_HEARTBEAT:
+        # Version moved (or sender unknown): wait for its next full frame.
+        rx_stale_heartbeats += 1
+        if rec is not None:
+            rec["rssi"] = rec["link"].rssi()
+            rec["last_seen"] = now
+        return False
+
+    is_new = rec is None
+    if is_new:
+        if admit_floor is not None and packet.rssi + PEER_MATCH_BONUS <= admit_floor:
+            # Crowd mode: even as a match this newcomer could not outrank the
+            # weakest tracked peer.
+            rx_crowd_skipped += 1
+            return False
+        rec = _take_peer_record()
+    else:
+        old_mode = rec["mode"]
+        old_name = rec["name"]
+        old_topic = rec["topic"]
+        old_peer_mac = rec["peer_mac"]
+    if not badge_frame.decode_into(msg, rec):
+        parse_failures += 1
+        if is_new:
+            _release_peer_record(rec)
+        return False
+    rec["last_seen"] = now
+    if is_new:
+        mac_key = bytes(mac_key)
+        rec["link"].update(seq, now, packet.rssi)
+    rec["rssi"] = rec["link"].rssi()
+    if has_header and msg[2] == badge_frame.FRAME_DIRECT:
+        # The chat partner's full state carries its name and interests.
+        _note_full_profile(mac_key, rec)
+    # A newcomer asks for its profile only once it has a slot.
+    _load_profile(mac_key, rec, now, fetch=not is_new)
+    rec["first_common"] = first_common_interest(rec)
+    if is_new:
+        if not _admit_peer(mac_key, rec, now):
+            # Table full of peers worth more than this one: ignore it for now.
+            _release_peer_record(rec)
+            return False
+        # Only admitted peers get an id: the crowd beyond the table costs none.
+        rec["id"] = peer_ids.intern(mac_key)
+        nearby_peers[mac_key] = rec
+        _load_profile(mac_key, rec, now)
+        _peers_changed()
+    _index_peer(mac_key, rec)
+
+    _track_match_window(rec)
+    is_blocked_peer = _is_blocked_peer_id(rec["id"])
+
+    # --- badge match alert ---
+    if not is_blocked_peer:
+        check_badge_matches(rec, now)
+
+    if is_new:
+        # A newcomer has none of our state: make the next slot a full frame.
+        last_full_broadcast = 0.0
+        if ((not is_blocked_peer) and is_shared_interest_peer(rec) and
+                flashed_new_peers.first(rec["id"], now)):
+            flash_new_peer()
+        return True
+
+    _peer_updated(mac_key, rec)
+    changed = (old_mode != rec["mode"] or
+               old_name != rec["name"] or
+               old_topic != rec["topic"])
+    # Peer timed out/exited CHAT that was targeting us:
+    # mirror cooldown on this badge so SEARCH match notice clears too.
+    if (old_mode == MODE_CHAT and
+            rec["mode"] == MODE_SEARCH and
+            old_peer_mac == MY_MAC):
+        _start_auto_rematch_block(mac_key, AUTO_RECONNECT_DELAY)
+        if current_mode == MODE_CHAT and chat_peer_mac == mac_key:
+            _set_chat_peer_exit_deadline(time.monotonic() + CHAT_PEER_EXIT_TIMEOUT)
+        changed = True
+    return changed
+
+
+def _service_timers(now):
+    """Handle every timer-wheel deadline that has passed; True if the mode changed."""
+    global display_dirty, chat_state_dirty
+    dropped = False
+    mode_changed = False
+    for key, kind in timers.expire(now):
+        if kind == TIMER_PEER:
+            rec = nearby_peers.get(key)
+            if rec is None:
+                continue
+            # Lossy links and peers on other channels get extra grace: missing frames
+            # there are not a departure.
+            deadline = rec["last_seen"] + _peer_timeout(rec)
+            if now < deadline:
+                # Its grace grew since the deadline was set.
+                timers.schedule(key, deadline, TIMER_PEER)
+                continue
+            _drop_peer(key)
+            dropped = True
+        elif kind == TIMER_REMATCH:
+            _expire_rematch_state(key[0], now)
+        elif kind == TIMER_CHAT_WAIT:
+            # CHAT handshake timeout:
+            # if peer never enters CHAT within 10s, return to SEARCH.
+            peer = nearby_peers.get(chat_wait_peer_mac) if chat_wait_peer_mac else None
+            if current_mode == MODE_CHAT and ((not peer) or (peer.get("mode") != MODE_CHAT)):
+                set_mode(MODE_SEARCH)
+                mode_changed = True
+            else:
+                _set_chat_wait_deadline(0.0)
+        elif kind == TIMER_CHAT_EXIT:
+            if current_mode == MODE_CHAT:
+                set_mode(MODE_SEARCH)
+                mode_changed = True
+    if dropped:
+        display_dirty = True
+        scheduler.reset(now)
+        chat_state_dirty = True
+    return mode_changed
+
+
 def receive_all():
     global display_dirty, chat_peer_mac, chat_common, chat_common_idx, chat_idx_ver
     global search_match_latched, search_match_topic, search_match_color
-    global chat_wait_peer_mac, chat_wait_deadline, chat_peer_exit_deadline
-    global rx_packets, parse_failures
+    global chat_wait_peer_mac
+    global rx_packets, rx_alloc_bytes, rx_alloc_frames, chat_state_dirty
 
     changed = False
     now = time.monotonic()
 
+    _update_crowd_mode(now)
     while e:
         packet = e.read()
         if packet is None:
             break
         rx_packets += 1
+        crowd.note(packet.mac)
+        chan_plan.note_rx()
 
-        info = parse_message(packet.msg)
-        if info is None:
-            parse_failures += 1
-            continue
-
-        mac_key = bytes(packet.mac)
-        if mac_key == bytes(my_mac):
-            continue
-
-        old = nearby_peers.get(mac_key)
-        nearby_peers[mac_key] = {
-            "name": info["name"],
-            "mode": info["mode"],
-            "interests": info["interests"],
-            "topic": info["topic"],
-            "rssi": packet.rssi,
-            "last_seen": now,
-            "peer_mac": info["peer_mac"],
-            "common_idx": info["common_idx"],
-            "idx_ver": info["idx_ver"],
-        }
-        _track_match_window(mac_key, nearby_peers[mac_key])
-        is_blocked_peer = _is_blocked_peer_mac(mac_key)
-
-        # --- badge match alert ---
-        if not is_blocked_peer:
-            check_badge_matches(mac_key, nearby_peers[mac_key])
-
-        if old is None:
+        before = _mem_alloc() if _mem_alloc else 0
+        if _receive_packet(packet, now):
             changed = True
-            if (not is_blocked_peer) and is_shared_interest_peer(nearby_peers[mac_key]):
-                flash_new_peer()
-        else:
-            if (old["mode"] != info["mode"] or
-                old["name"] != info["name"] or
-                old["topic"] != info["topic"]):
-                changed = True
-            # Peer timed out/exited CHAT that was targeting us:
-            # mirror cooldown on this badge so SEARCH match notice clears too.
-            if (old.get("mode") == MODE_CHAT and
-                    info["mode"] == MODE_SEARCH and
-                    old.get("peer_mac") == bytes(my_mac)):
-                _start_auto_rematch_block(mac_key, AUTO_RECONNECT_DELAY)
-                if current_mode == MODE_CHAT and chat_peer_mac == mac_key:
-                    chat_peer_exit_deadline = time.monotonic() + CHAT_PEER_EXIT_TIMEOUT
-                changed = True
-
-    # prune stale
-    stale = [k for k, v in nearby_peers.items() if now - v["last_seen"] > PEER_TIMEOUT]
-    for k in stale:
-        del nearby_peers[k]
-        changed = True
+        mac = _mac_key(packet.mac)
+        rec = nearby_peers.get(mac)
+        if rec is not None:
+            timers.schedule(mac, rec["last_seen"] + _peer_timeout(rec), TIMER_PEER)
+            peers_by_rssi.update(mac, rec["rssi"])
+            if peers_by_link.update(mac, _peer_link_score(rec)):
+                _peer_updated(mac, rec)
+        if _mem_alloc:
+            used = _mem_alloc() - before
+            # A GC pass inside the frame makes the delta meaningless; skip it.
+            if used >= 0:
+                rx_alloc_bytes += used
+                rx_alloc_frames += 1
 
     if current_mode == MODE_CHAT:
         # Follow the strongest broadcaster in the same active topic to allow open join.
         if (not chat_force_empty_topic) and chat_common:
-            active_topic = chat_common[chat_common_idx].lower()
+            active_topic = interest_catalog.normalize_interest(chat_common[chat_common_idx])
             best_mac = None
-            best_rssi = -999
-            for mac, candidate in nearby_peers.items():
+            current_score = None
+            for mac in peers_by_link.ranked(peers_by_chat_topic.get(active_topic)):
                 if mac != chat_peer_mac and _is_blocked_peer_mac(mac):
                     continue
-                if candidate.get("mode") != MODE_CHAT:
-                    continue
-                if candidate.get("topic", "").lower() != active_topic:
-                    continue
-                if candidate["rssi"] > best_rssi:
+                if best_mac is None:
                     best_mac = mac
-                    best_rssi = candidate["rssi"]
+                if mac == chat_peer_mac:
+                    current_score = peers_by_link.score(mac)
+                    break
+                if chat_peer_mac not in peers_by_link:
+                    break
             if best_mac is not None:
-                chat_peer_mac = best_mac
+                chat_peer_mac = chat_follow_choice.choose(
+                    best_mac, peers_by_link.score(best_mac), chat_peer_mac, current_score
+                )
 
         peer = nearby_peers.get(chat_peer_mac) if chat_peer_mac else None
         if peer:
-            new_common, _ = compute_match(MY_INTERESTS, peer["interests"])
+            new_common, _ = compute_match(peer)
             if new_common != chat_common:
                 prior_topic = chat_common[chat_common_idx] if chat_common else ""
                 chat_common = new_common
@@ -678,9 +1678,9 @@ def receive_all():
                 if chat_peer_mac:
                     _mark_chat_handshake_success(chat_peer_mac)
                     if chat_wait_peer_mac == chat_peer_mac:
-                        chat_wait_deadline = 0.0
+                        _set_chat_wait_deadline(0.0)
                     if chat_peer_exit_deadline > 0.0:
-                        chat_peer_exit_deadline = 0.0
+                        _set_chat_peer_exit_deadline(0.0)
                 peer_ver = peer.get("idx_ver", 0)
                 peer_topic = peer.get("topic", "")
                 peer_topic_idx = index_for_topic(chat_common, peer_topic)
@@ -695,7 +1695,7 @@ def receive_all():
                         chat_common_idx = 0
                     changed = True
                 elif peer_ver == chat_idx_ver:
-                    if bytes(my_mac) > chat_peer_mac:
+                    if MY_MAC > chat_peer_mac:
                         if chat_common:
                             if peer_topic_idx is not None:
                                 peer_idx = peer_topic_idx
@@ -707,7 +1707,7 @@ def receive_all():
                             chat_common_idx = peer_idx
                             changed = True
 
-    else:
+    elif search_latch_gate.due():
         # Keep SEARCH display topic and SEARCH LED color sourced from the same live match.
         matched_topic, _, _ = find_best_shared_match()
         if matched_topic:
@@ -728,20 +1728,20 @@ def receive_all():
 
     if changed:
         display_dirty = True
+        # Neighbourhood or topic moved: go back to fast beacons (Trickle reset).
+        scheduler.reset(now)
+        chat_state_dirty = True
 
 # -------------------------
 # Pick closest peer
 # -------------------------
 def pick_closest_peer(skip_blocked=False):
-    best_mac = None
-    best_rssi = -999
-    for mac, peer in nearby_peers.items():
+    """Peer with the best smoothed, loss-penalised RSSI."""
+    for mac in peers_by_link:
         if skip_blocked and _is_blocked_peer_mac(mac):
             continue
-        if peer["rssi"] > best_rssi:
-            best_mac = mac
-            best_rssi = peer["rssi"]
-    return best_mac
+        return mac
+    return None
 
 # -------------------------
 # Display / LEDs / Mode transitions
@@ -780,6 +1780,9 @@ def rssi_bar(rssi):
 
 
 def _display_interest_text(text):
+    idx = interest_catalog.interest_index(text)
+    if idx is not None:
+        return interest_catalog.catalog_label(idx)
     value = (text or "").replace("_", " ").strip().lower()
     if not value:
         return ""
@@ -918,7 +1921,7 @@ def render_display():
 
         g.append(label.Label(
             terminalio.FONT,
-            text="Nearby: " + str(len(nearby_peers)),
+            text=("Nearby: ~" + str(crowd.size())) if crowd_mode else ("Nearby: " + str(len(nearby_peers))),
             color=0x000000,
             anchor_point=(0.0, 0.0),
             anchored_position=(6, y),
@@ -928,8 +1931,9 @@ def render_display():
 
         if nearby_peers:
             max_peers = 2 if search_text_scale == 2 else 4
-            for _, peer in sorted(nearby_peers.items(), key=lambda x: x[1]["rssi"], reverse=True)[:max_peers]:
-                _, pct = compute_match(MY_INTERESTS, peer["interests"])
+            for mac in peers_by_rssi.top(max_peers):
+                peer = nearby_peers[mac]
+                pct = match_pct(peer)
                 line = "{} {}% {}".format(
                     peer["name"][:8 if search_text_scale == 2 else 10],
                     pct,
@@ -1070,18 +2074,19 @@ def render_display():
 
 # -- Mode transitions --
 def set_mode(new_mode, force_closest=False, force_empty_topic=False):
-    global current_mode, display_dirty
+    global current_mode, display_dirty, chat_state_dirty
     global chat_peer_mac, chat_common, chat_common_idx, chat_idx_ver, chat_force_empty_topic
-    global chat_wait_peer_mac, chat_wait_deadline, chat_peer_exit_deadline
+    global chat_wait_peer_mac
     global search_match_latched, search_match_topic, search_match_color, blocked_auto_rematch_peers
 
     if new_mode == current_mode:
         return
+    _peers_changed()
 
     if new_mode == MODE_CHAT:
-        chat_wait_deadline = time.monotonic() + CHAT_HANDSHAKE_TIMEOUT
+        _set_chat_wait_deadline(time.monotonic() + CHAT_HANDSHAKE_TIMEOUT)
         chat_wait_peer_mac = None
-        chat_peer_exit_deadline = 0.0
+        _set_chat_peer_exit_deadline(0.0)
         # Preserve the currently latched SEARCH topic (if any) as preferred chat start.
         preferred_topic = search_match_topic
         # Clear search-match latch once user chooses to move into chat.
@@ -1096,22 +2101,20 @@ def set_mode(new_mode, force_closest=False, force_empty_topic=False):
         if force_closest:
             chat_peer_mac = pick_closest_peer(skip_blocked=False)
             if chat_peer_mac and chat_peer_mac in nearby_peers:
-                chat_common, _ = compute_match(MY_INTERESTS, nearby_peers[chat_peer_mac]["interests"])
+                chat_common, _ = compute_match(nearby_peers[chat_peer_mac])
         else:
             # Prefer joining an ongoing chat that has a shared topic.
             best_mac = None
-            best_rssi = -999
             best_topic = None
-            mine_lower = set(s.lower() for s in MY_INTERESTS)
-            for mac, peer in nearby_peers.items():
+            chatting = set()
+            for key in MY_INTEREST_KEYS:
+                chatting.update(peers_by_chat_topic.get(key))
+            for mac in peers_by_link.ranked(chatting):
                 if _is_blocked_peer_mac(mac):
                     continue
-                topic = peer.get("topic", "")
-                if peer.get("mode") == MODE_CHAT and topic and topic.lower() in mine_lower:
-                    if peer["rssi"] > best_rssi:
-                        best_mac = mac
-                        best_rssi = peer["rssi"]
-                        best_topic = topic
+                best_mac = mac
+                best_topic = nearby_peers[mac]["topic"]
+                break
 
             if best_mac is not None:
                 chat_peer_mac = best_mac
@@ -1120,7 +2123,7 @@ def set_mode(new_mode, force_closest=False, force_empty_topic=False):
                 if chat_peer_mac is None:
                     chat_peer_mac = pick_closest_peer(skip_blocked=True)
                 if chat_peer_mac and chat_peer_mac in nearby_peers:
-                    chat_common, _ = compute_match(MY_INTERESTS, nearby_peers[chat_peer_mac]["interests"])
+                    chat_common, _ = compute_match(nearby_peers[chat_peer_mac])
 
         # If SEARCH had a matched topic, start CHAT on that same topic when possible.
         if chat_common and preferred_topic:
@@ -1148,8 +2151,8 @@ def set_mode(new_mode, force_closest=False, force_empty_topic=False):
         chat_idx_ver = 0
         chat_force_empty_topic = False
         chat_wait_peer_mac = None
-        chat_wait_deadline = 0.0
-        chat_peer_exit_deadline = 0.0
+        _set_chat_wait_deadline(0.0)
+        _set_chat_peer_exit_deadline(0.0)
 
     current_mode = new_mode
 
@@ -1159,9 +2162,10 @@ def set_mode(new_mode, force_closest=False, force_empty_topic=False):
     pixels.fill(0)
 
     display_dirty = True
+    chat_state_dirty = True
     do_broadcast()
 
-blocked_auto_rematch_peers = _load_recent_chat_peers()
+_load_recent_chat_peers()
 
 # ===== MAIN LOOP =====
 try:
@@ -1169,7 +2173,8 @@ try:
         print(
             "ESPNOW cfg channel=", ESPNOW_CHANNEL,
             "peer_channel=", ESPNOW_PEER_CHANNEL,
-            "mac=", bytes(my_mac).hex()
+            "data_channels=", ESPNOW_DATA_CHANNELS,
+            "mac=", MY_MAC.hex()
         )
     render_display()
     do_broadcast()
@@ -1202,27 +2207,25 @@ try:
             elif not buttons[BTN_C].value:
                 wait_release(BTN_C)
 
-        # Periodic broadcast
-        if now - last_broadcast >= BROADCAST_INTERVAL:
-            do_broadcast()
+        # Periodic broadcast (adaptive, jittered, redundant beacons suppressed)
+        scheduler.peer_count = crowd.size() if crowd_mode else len(nearby_peers)
+        if scheduler.poll(now):
+            do_broadcast(scheduled=True)
 
         # Receive
         receive_all()
+        _service_chat_link(now)
+        _service_contact_card(now)
+        _service_profiles(now)
+        _service_channel(now)
 
-        # CHAT handshake timeout:
-        # if peer never enters CHAT within 10s, return to SEARCH.
-        if current_mode == MODE_CHAT and chat_wait_deadline > 0.0:
-            if now >= chat_wait_deadline:
-                peer = nearby_peers.get(chat_wait_peer_mac) if chat_wait_peer_mac else None
-                if (not peer) or (peer.get("mode") != MODE_CHAT):
-                    set_mode(MODE_SEARCH)
-                    continue
-                chat_wait_deadline = 0.0
+        # Recent-chat expiry and its batched flash writes.
+        if blocked_auto_rematch_peers.poll(now):
+            _peers_changed()
 
-        if current_mode == MODE_CHAT and chat_peer_exit_deadline > 0.0:
-            if now >= chat_peer_exit_deadline:
-                set_mode(MODE_SEARCH)
-                continue
+        # Peer expiry, rematch windows and the CHAT handshake/exit timeouts.
+        if _service_timers(now):
+            continue
 
         if DEBUG_ESPNOW and (now - last_debug_log >= 5.0):
             channel_text = "?"
@@ -1231,7 +2234,12 @@ try:
             except Exception:
                 pass
             print(
-                "DBG mode={} ch={} tx={} err={} rx={} parse_fail={} nearby={} blocked_active={}".format(
+                (
+                    "DBG mode={} ch={} tx={} err={} rx={} parse_fail={} nearby={}/{} evicted={} table_full={} blocked_active={} "
+                    "tx_full={} tx_hb={} rx_cached={} rx_hb_stale={} rx_dup={} rx_direct={} "
+                    "uc_tx={} uc_ack={} uc_nack={} uc_fallback={} presence={} "
+                    "bcast_ivl={:.1f} bcast_suppressed={} bcast_resets={} rx_alloc_per_frame={}"
+                ).format(
                     MODE_NAMES[current_mode],
                     channel_text,
                     tx_attempts,
@@ -1239,9 +2247,50 @@ try:
                     rx_packets,
                     parse_failures,
                     len(nearby_peers),
+                    PEER_TABLE_SIZE,
+                    peer_evictions,
+                    rx_table_full,
                     len(auto_rematch_state),
+                    tx_full_frames,
+                    tx_heartbeats,
+                    rx_cached_frames,
+                    rx_stale_heartbeats,
+                    rx_duplicates,
+                    rx_direct_frames,
+                    partner_link.sent,
+                    partner_link.acked,
+                    partner_link.nacked,
+                    uc_fallbacks,
+                    int(presence_beacon),
+                    scheduler.interval,
+                    scheduler.suppressed,
+                    scheduler.resets,
+                    (rx_alloc_bytes // rx_alloc_frames) if rx_alloc_frames else "n/a",
                 )
             )
+            _print_link_stats()
+            print("FRAG " + card_transport.summary())
+            print("PROF cached={} hits={} misses={} {}".format(
+                len(profiles), profiles.hits, profiles.misses, profile_exchange.summary()
+            ))
+            print("RSSI hysteresis_db={} held_chat={} held_search={}".format(
+                RSSI_HYSTERESIS_DB, chat_follow_choice.held, search_match_choice.held
+            ))
+            print("RECENT " + blocked_auto_rematch_peers.summary())
+            print("IDS used={}/{} recycled={} overflow={}".format(
+                len(peer_ids), peer_ids.capacity, peer_ids.recycled, peer_ids.overflow
+            ))
+            print("CROWD mode={} size={} frames={} skipped={} floor={}".format(
+                int(crowd_mode), crowd.size(), crowd.frames, rx_crowd_skipped,
+                "-" if admit_floor is None else int(admit_floor),
+            ))
+            print("MATCH best_redone={} best_reused={} latch_redone={} latch_skipped={} cache_hits={} cache_misses={}".format(
+                best_match_gate.redone, best_match_gate.skipped,
+                search_latch_gate.redone, search_latch_gate.skipped,
+                match_cache_hits, match_cache_misses,
+            ))
+            if chan_plan.enabled():
+                print("CHAN " + chan_plan.summary(now))
             last_debug_log = now
 
         # Refresh display (rate-limited)
@@ -1255,6 +2304,9 @@ try:
         time.sleep(0.08)
 
 except Exception as ex:
+    partner_link.close()
+    profile_exchange.close()
+    blocked_auto_rematch_peers.flush(time.monotonic())
     # Blink NeoPixels red
     for _ in range(10):
         pixels.fill((255, 0, 0))
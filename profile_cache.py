@@ -0,0 +1,223 @@
+import espnow
+
+import badge_frame
+
+# ---------------------------
+# Pull-based peer profiles
+# ---------------------------
+# Broadcasts carry only a presence frame with a hash of the sender's profile
+# (name + interests). A receiver that has no profile cached for that
+# (mac, hash) asks the owner for it once by unicast; the owner answers with a
+# FRAME_PROFILE. Profiles are kept here independently of nearby_peers, so a
+# badge that drifts out of range and back costs nothing after the first fetch.
+
+
+class ProfileCache:
+    """(mac, profile hash) -> (name, interest_mask, interest_extras).
+
+    Bounded at `size` entries; when full the least recently used entry goes.
+    A new hash from the same MAC replaces its old profile.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self.entries = {}
+        self.tick = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mac, profile_hash):
+        entry = self.entries.get(mac)
+        if entry is None or entry[0] != profile_hash:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tick += 1
+        entry[2] = self.tick
+        return entry[1]
+
+    def put(self, mac, profile_hash, profile):
+        if mac not in self.entries and len(self.entries) >= self.size:
+            oldest = None
+            oldest_tick = 0
+            for key, entry in self.entries.items():
+                if oldest is None or entry[2] < oldest_tick:
+                    oldest = key
+                    oldest_tick = entry[2]
+            del self.entries[oldest]
+        self.tick += 1
+        self.entries[mac] = [profile_hash, profile, self.tick]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ProfileExchange:
+    """Unicast profile requests and replies over short-lived ESP-NOW peers.
+
+    want() queues a request and poll() sends it, retrying every `retry`
+    seconds; after `max_tries` unanswered requests the MAC is left alone for
+    `backoff` seconds. reply() queues our profile for a requester, at most
+    once per `reply_gap` seconds each. poll() sends at most `per_poll`
+    frames (replies first), so a crowd arriving at once, or a new hash, is
+    spread over several loop passes instead of one burst. Senders need a registered
+    espnow.Peer: up to `max_peers` are kept, least recently used removed
+    first, and poll() reuses the chat link's peer for its MAC.
+
+    Our unicasts are resolved on the driver's send_success / send_failure
+    counters like the chat link's, so the two must take turns: busy() stays
+    True until every send from the last poll() has been ACKed or has failed.
+    """
+
+    def __init__(self, esp, channel=0, max_peers=4, retry=1.0, max_tries=3,
+                 backoff=30.0, reply_gap=1.0, per_poll=2):
+        self.esp = esp
+        self.channel = channel
+        self.max_peers = max_peers
+        self.retry = retry
+        self.max_tries = max_tries
+        self.backoff = backoff
+        self.reply_gap = reply_gap
+        self.per_poll = per_poll
+
+        # mac -> [profile hash, tries, next attempt]
+        self.pending = {}
+        # (mac, frame) replies waiting for poll(); mac -> last reply time.
+        self.replies = []
+        self.replied = {}
+        # Peers we registered, least recently used first.
+        self.peers = []
+        # Sends not yet resolved, and the driver counters before the first.
+        self.in_flight = 0
+        self._success_mark = 0
+        self._failure_mark = 0
+
+        self.requests = 0
+        self.answers = 0
+        self.received = 0
+        self.gave_up = 0
+        self.errors = 0
+
+    def want(self, mac, profile_hash, now):
+        entry = self.pending.get(mac)
+        if entry is None or entry[0] != profile_hash:
+            self.pending[mac] = [profile_hash, 0, now]
+
+    def got(self, mac, profile_hash):
+        entry = self.pending.get(mac)
+        if entry is not None and entry[0] == profile_hash:
+            del self.pending[mac]
+            self.received += 1
+
+    def forget(self, mac):
+        if mac in self.pending:
+            del self.pending[mac]
+
+    def reply(self, mac, frame, now):
+        last = self.replied.get(mac)
+        if last is not None and now - last < self.reply_gap:
+            return
+        if len(self.replied) >= 2 * self.max_peers:
+            self.replied.clear()
+        self.replied[mac] = now
+        self.replies.append((mac, frame))
+
+    def note_broadcast(self):
+        """A broadcast went out while a unicast is unresolved; it always counts as success."""
+        if self.in_flight:
+            self._success_mark += 1
+
+    def busy(self):
+        if self.in_flight:
+            moved = (self.esp.send_success - self._success_mark) + (self.esp.send_failure - self._failure_mark)
+            if moved >= self.in_flight:
+                self.in_flight = 0
+        return self.in_flight > 0
+
+    def poll(self, now, shared_peer=None):
+        """Send queued replies and due requests, up to `per_poll` frames.
+
+        Whatever is left stays queued or due for the next poll()."""
+        budget = self.per_poll
+        while self.replies and budget > 0:
+            mac, frame = self.replies.pop(0)
+            budget -= 1
+            if self._send(mac, frame, shared_peer):
+                self.answers += 1
+        if not self.pending:
+            return
+        for mac, entry in self.pending.items():
+            if budget <= 0:
+                break
+            if now < entry[2]:
+                continue
+            if entry[1] >= self.max_tries:
+                # Owner is not answering: stop asking for a while.
+                entry[1] = 0
+                entry[2] = now + self.backoff
+                self.gave_up += 1
+                continue
+            entry[1] += 1
+            entry[2] = now + self.retry
+            budget -= 1
+            if self._send(mac, badge_frame.encode_profile_request(entry[0]), shared_peer):
+                self.requests += 1
+
+    def _peer_for(self, mac):
+        for peer in self.peers:
+            if peer.mac == mac:
+                self.peers.remove(peer)
+                self.peers.append(peer)
+                return peer
+        if len(self.peers) >= self.max_peers:
+            self._remove(self.peers.pop(0))
+        peer = espnow.Peer(mac=mac, channel=self.channel)
+        self.esp.peers.append(peer)
+        self.peers.append(peer)
+        return peer
+
+    def _send(self, mac, frame, shared_peer):
+        try:
+            if shared_peer is not None and shared_peer.mac == mac:
+                peer = shared_peer
+            else:
+                peer = self._peer_for(mac)
+            if not self.in_flight:
+                self._success_mark = self.esp.send_success
+                self._failure_mark = self.esp.send_failure
+            self.esp.send(frame, peer)
+        except Exception:
+            self.errors += 1
+            return False
+        self.in_flight += 1
+        return True
+
+    def _remove(self, peer):
+        try:
+            self.esp.peers.remove(peer)
+        except Exception:
+            pass
+
+    def release(self, mac):
+        """Drop our peer for `mac` so another owner (the chat link) can add it."""
+        for peer in self.peers:
+            if peer.mac == mac:
+                self.peers.remove(peer)
+                self._remove(peer)
+                return
+
+    def close(self):
+        for peer in self.peers:
+            self._remove(peer)
+        self.peers = []
+
+    def summary(self):
+        return "pending={} req={} answered={} got={} gave_up={} errors={} peers={}".format(
+            len(self.pending),
+            self.requests,
+            self.answers,
+            self.received,
+            self.gave_up,
+            self.errors,
+            len(self.peers),
+        )
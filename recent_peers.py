@@ -0,0 +1,152 @@
+import struct
+
+# ---------------------------
+# Recently chatted peers
+# ---------------------------
+# Badges we completed a CHAT handshake with are not offered for auto-rematch
+# again. The set is bounded (the entry closest to expiry goes first when it is
+# full) and each entry expires `ttl` seconds after the last chat with it.
+#
+# On flash it is a flat file of fixed records: the 6-byte MAC and the seconds
+# the entry has left (little-endian u32). time.monotonic() restarts at boot
+# and the badge has no wall clock, so only powered-on time counts towards
+# expiry.
+#
+# Changes only mark the store dirty, and poll() rewrites the file at most
+# every `write_gap` seconds, so a burst of new chats costs one write. A
+# refreshed expiry is kept exact in memory but marks the store dirty only
+# once it has moved by more than `ttl / 16` since it last did: a partner whose
+# frames re-add it every tick does not rewrite the file for the whole chat.
+
+RECORD_FORMAT = "<6sI"
+RECORD_LEN = 10
+
+
+class RecentPeers:
+    """Peer ids (see mac_intern) -> expiry time, persisted to `path`."""
+
+    def __init__(self, path, ids, size=64, ttl=86400.0, write_gap=30.0):
+        self.path = path
+        self.ids = ids
+        self.size = size
+        self.ttl = ttl
+        self.write_gap = write_gap
+        self.expires = {}
+        # Expiry of each entry when it last marked the store dirty.
+        self.marked = {}
+        self.refresh_step = ttl / 16
+        # Earliest expiry in `expires` (may be early after a refresh), or None.
+        self.next_expiry = None
+        self.dirty = False
+        self.last_write = None
+
+        self.writes = 0
+        self.expired = 0
+        self.evicted = 0
+        self.errors = 0
+
+    def __contains__(self, pid):
+        return pid in self.expires
+
+    def __iter__(self):
+        return iter(self.expires)
+
+    def __len__(self):
+        return len(self.expires)
+
+    def add(self, pid, now, left=None):
+        """Record a chat with `pid` now; True if it was not in the set."""
+        expires = now + (self.ttl if left is None else min(left, self.ttl))
+        old = self.expires.get(pid)
+        is_new = old is None
+        if is_new and len(self.expires) >= self.size:
+            self._evict()
+        if is_new or abs(expires - self.marked[pid]) > self.refresh_step:
+            # The file holds the time left; a few seconds more of a day-long
+            # block are not worth a flash write.
+            self.dirty = True
+            self.marked[pid] = expires
+        self.expires[pid] = expires
+        if self.next_expiry is None or expires < self.next_expiry:
+            self.next_expiry = expires
+        return is_new
+
+    def _evict(self):
+        oldest = None
+        oldest_expires = 0.0
+        for pid, expires in self.expires.items():
+            if oldest is None or expires < oldest_expires:
+                oldest = pid
+                oldest_expires = expires
+        del self.expires[oldest]
+        del self.marked[oldest]
+        self.evicted += 1
+
+    def _expire(self, now):
+        gone = [pid for pid, expires in self.expires.items() if expires <= now]
+        for pid in gone:
+            del self.expires[pid]
+            del self.marked[pid]
+        if gone:
+            self.expired += len(gone)
+            self.dirty = True
+        self.next_expiry = min(self.expires.values()) if self.expires else None
+        return bool(gone)
+
+    def poll(self, now):
+        """Drop expired entries and write the file if it is dirty and due.
+
+        Returns True if any entry expired.
+        """
+        expired = False
+        if self.next_expiry is not None and now >= self.next_expiry:
+            expired = self._expire(now)
+        if self.dirty and (self.last_write is None or now - self.last_write >= self.write_gap):
+            self.save(now)
+        return expired
+
+    def flush(self, now):
+        if self.dirty:
+            self.save(now)
+
+    def load(self, now):
+        """Read the file; False if there is none (or it cannot be read)."""
+        try:
+            with open(self.path, "rb") as fp:
+                data = fp.read()
+        except OSError:
+            return False
+        for offset in range(0, len(data) - RECORD_LEN + 1, RECORD_LEN):
+            mac, left = struct.unpack_from(RECORD_FORMAT, data, offset)
+            if left > 0:
+                self.add(self.ids.intern(bytes(mac)), now, left)
+        self.dirty = False
+        return True
+
+    def save(self, now):
+        data = bytearray()
+        for pid, expires in self.expires.items():
+            left = int(expires - now)
+            if left > 0:
+                data += struct.pack(RECORD_FORMAT, self.ids.mac(pid), left)
+        self.last_write = now
+        try:
+            with open(self.path, "wb") as fp:
+                fp.write(data)
+        except OSError:
+            # Read-only while USB has the drive: try again after write_gap.
+            self.errors += 1
+            return
+        self.dirty = False
+        self.writes += 1
+
+    def summary(self):
+        return "peers={}/{} writes={} expired={} evicted={} errors={} dirty={}".format(
+            len(self.expires),
+            self.size,
+            self.writes,
+            self.expired,
+            self.evicted,
+            self.errors,
+            int(self.dirty),
+        )
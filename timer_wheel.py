@@ -0,0 +1,95 @@
+# ---------------------------
+# Hashed timer wheel
+# ---------------------------
+# One wheel holds every deadline the runtime waits on: peer expiry, the chat
+# handshake/exit timeouts and auto-rematch windows and cooldowns. Time is cut
+# into `resolution`-second slots and expire() walks only the slots that have
+# fully elapsed since its last call, so a tick where nothing expires costs a
+# single comparison however many timers are pending.
+#
+# Rescheduling a waiting key to a later deadline only rewrites its entry; it
+# is re-filed when its old slot comes up. Peers push their expiry back on
+# every frame, so that keeps the per-frame cost to a dict lookup. Filings
+# left behind by cancel() or by a move to an earlier slot are dropped when
+# their slot is walked. Deadlines fire up to one slot late.
+
+
+class TimerWheel:
+    """Deadlines keyed by any hashable, each tagged with a caller-defined kind."""
+
+    def __init__(self, now, resolution=0.25, slots=128):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(slots)]
+        # key -> [deadline, kind, slot index it is filed in]
+        self.entries = {}
+        # Next slot tick to walk; every tick before it has been handled.
+        self.tick = int(now / resolution)
+        self.fired = 0
+
+    def _slot_for(self, deadline):
+        t = int(deadline / self.resolution)
+        if t < self.tick:
+            t = self.tick
+        return t % len(self.slots)
+
+    def _file(self, key, entry):
+        slot = self._slot_for(entry[0])
+        entry[2] = slot
+        self.slots[slot].append(key)
+
+    def schedule(self, key, deadline, kind=0):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = [deadline, kind, 0]
+            self.entries[key] = entry
+            self._file(key, entry)
+            return
+        moved_earlier = deadline < entry[0]
+        entry[0] = deadline
+        entry[1] = kind
+        if moved_earlier and self._slot_for(deadline) != entry[2]:
+            self._file(key, entry)
+
+    def cancel(self, key):
+        if key in self.entries:
+            del self.entries[key]
+
+    def deadline(self, key):
+        entry = self.entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def expire(self, now):
+        """Remove and return [(key, kind)] for every deadline that has passed."""
+        last = int(now / self.resolution) - 1
+        if last < self.tick:
+            return ()
+        count = len(self.slots)
+        if last - self.tick >= count:
+            # Stalled for a whole revolution: walk each slot once.
+            self.tick = last - count + 1
+        due = None
+        while self.tick <= last:
+            slot = self.tick % count
+            filed = self.slots[slot]
+            self.tick += 1
+            if not filed:
+                continue
+            self.slots[slot] = []
+            for key in filed:
+                entry = self.entries.get(key)
+                if entry is None or entry[2] != slot:
+                    continue
+                if entry[0] <= now:
+                    del self.entries[key]
+                    if due is None:
+                        due = []
+                    due.append((key, entry[1]))
+                else:
+                    self._file(key, entry)
+        if due is None:
+            return ()
+        self.fired += len(due)
+        return due
+
+    def __len__(self):
+        return len(self.entries)
@@ -6,6 +6,7 @@ import wifi
 import socketpool
 from adafruit_httpserver import Server, Request, Response, GET, POST
 from adafruit_miniqr import QRCode
+import interest_catalog
 
 # ----------------------------
 # Survey helpers
@@ -24,6 +25,9 @@ def html_escape(text):
 
 
 def interest_label(text):
+    idx = interest_catalog.interest_index(text)
+    if idx is not None:
+        return interest_catalog.catalog_label(idx)
     label = (text or "").replace("_", " ").strip().lower()
     if not label:
         return ""
@@ -32,23 +36,13 @@ def interest_label(text):
 
 
 def build_interest_lookup(interests):
+    """Normalized spelling -> option, built once at startup."""
     lookup = {}
     for raw in interests:
         base = (raw or "").strip()
-        if not base:
-            continue
-        variants = (
-            base,
-            base.lower(),
-            base.replace("_", " "),
-            base.lower().replace("_", " "),
-            base.replace("-", " "),
-            base.lower().replace("-", " "),
-        )
-        for item in variants:
-            key = item.strip().lower()
-            if key and key not in lookup:
-                lookup[key] = base
+        key = interest_catalog.normalize_interest(base)
+        if key and key not in lookup:
+            lookup[key] = base
     return lookup
 
 
@@ -160,12 +154,20 @@ def write_settings(name, interests):
     clean_name = (name or "MagTag").strip()[:20]
     clean_interests = [x.strip() for x in interests if x and x.strip()][:MAX_INTERESTS]
     interests_csv = ", ".join(clean_interests)
+    # Canonical catalog ids, so the badge runtime matches without re-parsing names.
+    ids = []
+    for item in clean_interests:
+        idx = interest_catalog.interest_index(item)
+        if idx is not None and idx not in ids:
+            ids.append(idx)
+    ids_csv = ", ".join(str(idx) for idx in ids)
 
     with open(path, "r") as f:
         lines = f.read().splitlines()
 
     has_name = False
     has_interests = False
+    has_ids = False
     out = []
     for line in lines:
         stripped = line.strip()
@@ -175,6 +177,9 @@ def write_settings(name, interests):
         elif stripped.startswith("MY_INTERESTS"):
             out.append('MY_INTERESTS= "{}"'.format(toml_escape(interests_csv)))
             has_interests = True
+        elif stripped.startswith("MY_INTEREST_IDS"):
+            out.append('MY_INTEREST_IDS= "{}"'.format(ids_csv))
+            has_ids = True
         else:
             out.append(line)
 
@@ -182,6 +187,8 @@ def write_settings(name, interests):
         out.append('MY_NAME= "{}"'.format(toml_escape(clean_name)))
     if not has_interests:
         out.append('MY_INTERESTS= "{}"'.format(toml_escape(interests_csv)))
+    if not has_ids:
+        out.append('MY_INTEREST_IDS= "{}"'.format(ids_csv))
 
     with open(path, "w") as f:
         f.write("\n".join(out) + "\n")
@@ -259,6 +266,7 @@ print("Connected:", url)
 ALL_INTERESTS = load_interest_options()
 if not ALL_INTERESTS:
     ALL_INTERESTS = ["python", "circuitpython", "electronics"]
+ALLOWED_LOOKUP = build_interest_lookup(ALL_INTERESTS)
 
 current_name = (os.getenv("MY_NAME") or "MagTag").strip()
 current_hobbies = parse_csv(os.getenv("MY_INTERESTS") or "")
@@ -289,11 +297,9 @@ def index(request: Request):
         if not isinstance(selected, list):
             selected = [selected] if selected else []
 
-        allowed_lookup = build_interest_lookup(ALL_INTERESTS)
         filtered = []
         for x in selected:
-            key = (x or "").strip().lower()
-            canonical = allowed_lookup.get(key)
+            canonical = ALLOWED_LOOKUP.get(interest_catalog.normalize_interest(x))
             if canonical and canonical not in filtered:
                 filtered.append(canonical)
         filtered = filtered[:MAX_INTERESTS]